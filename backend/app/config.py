@@ -2,12 +2,25 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     BOT_TOKEN: str
+    # Bot API root; point at `python -m app.fake_bot_api` for offline runs
+    TELEGRAM_API_BASE: str = "https://api.telegram.org"
     BOT_USERNAME: str | None = None
     ADMIN_IDS: str = ""
     WEDDING_DATE: str = "2026-07-25T16:00:00+03:00"
     WEBAPP_URL: str = "https://example.com"
 
     DATABASE_URL: str = "sqlite:///./data/app.db"
+    # async driver URL for async routes; derived from DATABASE_URL when unset
+    ASYNC_DATABASE_URL: str | None = None
+
+    # SQLite connection pragmas, applied to every pooled connection
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 16384
+    SQLITE_MMAP_SIZE: int = 128 * 1024 * 1024
+    SQLITE_TEMP_STORE: str = "MEMORY"
+    SQLITE_FOREIGN_KEYS: bool = True
 
     # Public base url (for WebApp calling API directly outside docker)
     PUBLIC_API_BASE_URL: str = "http://localhost:8000"
@@ -17,6 +30,59 @@ class Settings(BaseSettings):
     DEV_USER_ID: int = 1
     GOOGLE_SA_JSON_PATH: str | None = None
 
+    # Verified initData cache (per process)
+    INITDATA_CACHE_SIZE: int = 1024
+    INITDATA_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+
+    # Signed session tokens issued by /api/auth/telegram (x-session-token)
+    SESSION_SECRET: str | None = None
+    SESSION_TTL_SECONDS: int = 12 * 60 * 60
+
+    # Signed family invite tokens (x-invite-token / inv_ links)
+    INVITE_SECRET: str | None = None
+    INVITE_TTL_DAYS: int = 7
+
+    # Telegram notification outbox, drained by an in-process dispatcher
+    OUTBOX_DISPATCHER_ENABLED: bool = True
+    OUTBOX_POLL_SECONDS: float = 2.0
+    OUTBOX_BATCH_SIZE: int = 20
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_BACKOFF_BASE_SECONDS: float = 5.0
+    OUTBOX_BACKOFF_MAX_SECONDS: float = 3600.0
+    OUTBOX_LEASE_SECONDS: int = 120
+    # Bot API requests in flight at once per dispatcher
+    OUTBOX_SEND_CONCURRENCY: int = 8
+
+    # getChat @username lookups (services/username_cache.py)
+    USERNAME_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    USERNAME_NEGATIVE_TTL_SECONDS: int = 60 * 60
+
+    # Sheets sync jobs: edits within the debounce window share one job, which is
+    # pushed back by each edit but never past SHEETS_SYNC_MAX_DELAY_SECONDS
+    SHEETS_SYNC_DEBOUNCE_SECONDS: int = 10
+    SHEETS_SYNC_MAX_DELAY_SECONDS: int = 60
+    # worker's telegram_id → row index; rebuilt from column A after this long
+    SHEETS_ROW_INDEX_TTL_SECONDS: int = 600
+    # jobs claimed per worker round; a crashed worker's batch is retaken after the lease
+    SHEETS_BATCH_SIZE: int = 50
+    SHEETS_JOB_LEASE_SECONDS: int = 300
+
+    # Idempotency-Key replay window for POST /api/profile, /api/extra, /api/family/save
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+
+    # Shared outbound HTTP client (services/http_client.py)
+    HTTP_TIMEOUT_SECONDS: float = 8.0
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 4.0
+    HTTP_CONNECT_RETRIES: int = 2
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+
+    # Bot API pacing (services/send_scheduler.py)
+    TG_GLOBAL_RATE: float = 25.0
+    TG_GLOBAL_BURST: int = 5
+    TG_PER_CHAT_INTERVAL_SECONDS: float = 1.1
+
     @property
     def admin_id_set(self) -> set[int]:
         ids = [x.strip() for x in self.ADMIN_IDS.split(",") if x.strip()]
@@ -1,14 +1,67 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
 
 from .config import settings
 
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
 connect_args = {}
-if settings.DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+if IS_SQLITE:
+    connect_args = {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
 
 engine = create_engine(settings.DATABASE_URL, connect_args=connect_args, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+# expire_on_commit=False: handlers keep using loaded rows after commit without re-SELECTs
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
+
+def _async_database_url() -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = settings.DATABASE_URL
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    # e.g. postgresql+psycopg is async-capable as is
+    return url
+
+# async engine for async routes; sync routes stay on `engine` in the thread pool
+async_engine = create_async_engine(
+    _async_database_url(),
+    connect_args={"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000} if IS_SQLITE else {},
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+def sqlite_pragmas() -> list[tuple[str, str]]:
+    return [
+        ("journal_mode", settings.SQLITE_JOURNAL_MODE),
+        ("busy_timeout", str(settings.SQLITE_BUSY_TIMEOUT_MS)),
+        ("synchronous", settings.SQLITE_SYNCHRONOUS),
+        # negative cache_size is in KiB
+        ("cache_size", str(-abs(settings.SQLITE_CACHE_SIZE_KB))),
+        ("mmap_size", str(settings.SQLITE_MMAP_SIZE)),
+        ("temp_store", settings.SQLITE_TEMP_STORE),
+        ("foreign_keys", "ON" if settings.SQLITE_FOREIGN_KEYS else "OFF"),
+    ]
+
+def apply_sqlite_pragmas(dbapi_connection) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in sqlite_pragmas():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, _connection_record):
+        apply_sqlite_pragmas(dbapi_connection)
+
+def dialect_insert(db: Session):
+    """
+    `insert` with on_conflict_do_nothing/do_update for the session's backend.
+    """
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
 
 class Base(DeclarativeBase):
     pass
@@ -19,3 +72,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
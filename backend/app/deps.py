@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from typing import Any
+import logging
+
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+
+from .config import settings
+from .db import get_db, get_async_db
+from .models import Guest
+from .services.telegram_auth import (
+    verify_telegram_init_data,
+    verify_session_token,
+    get_guest_from_invite,
+    get_or_create_guest,
+    ensure_profile,
+)
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Caller:
+    guest_id: int
+    telegram_user_id: int
+    # verified Telegram user dict when resolved from initData
+    user: dict[str, Any] | None = None
+    # credentials sent alongside a session token, for when its guest has been deleted
+    fallback_initdata: str | None = None
+    fallback_invite_token: str | None = None
+
+def _resolve_caller(
+    session_token: str | None,
+    initdata: str | None,
+    invite_token: str | None,
+    db: Session,
+) -> Caller:
+    if session_token:
+        try:
+            claims = verify_session_token(session_token)
+            return Caller(
+                guest_id=claims["guest_id"],
+                telegram_user_id=claims["telegram_user_id"],
+                fallback_initdata=initdata,
+                fallback_invite_token=invite_token,
+            )
+        except ValueError as e:
+            # bad signature or expired: fall back to initData / invite below. A valid
+            # token whose guest was deleted falls back in load_guest instead.
+            if not initdata and not invite_token:
+                raise HTTPException(401, str(e))
+    try:
+        if initdata:
+            user = verify_telegram_init_data(initdata, settings.BOT_TOKEN)
+        elif invite_token:
+            guest = get_guest_from_invite(invite_token, db)
+            return Caller(guest_id=guest.id, telegram_user_id=guest.telegram_user_id)
+        else:
+            raise ValueError("Missing initData")
+    except ValueError as e:
+        if invite_token:
+            try:
+                guest = get_guest_from_invite(invite_token, db)
+                return Caller(guest_id=guest.id, telegram_user_id=guest.telegram_user_id)
+            except ValueError as e2:
+                logger.warning("auth failed: %s (len=%s)", str(e2), len(initdata or ""))
+                raise HTTPException(401, str(e2))
+        logger.warning("auth failed: %s (len=%s)", str(e), len(initdata or ""))
+        raise HTTPException(401, str(e))
+    guest = get_or_create_guest(db, user)
+    return Caller(guest_id=guest.id, telegram_user_id=guest.telegram_user_id, user=user)
+
+def get_caller(
+    x_session_token: str | None = Header(default=None),
+    x_tg_initdata: str | None = Header(default=None),
+    x_invite_token: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+) -> Caller:
+    """
+    Resolves the calling guest. A valid x-session-token needs no DB access;
+    otherwise falls back to initData (get-or-create guest) or invite token.
+    """
+    return _resolve_caller(x_session_token, x_tg_initdata, x_invite_token, db)
+
+def get_optional_caller(
+    x_session_token: str | None = Header(default=None),
+    x_tg_initdata: str | None = Header(default=None),
+    x_invite_token: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+) -> Caller | None:
+    if not (x_session_token or x_tg_initdata or x_invite_token):
+        return None
+    return _resolve_caller(x_session_token, x_tg_initdata, x_invite_token, db)
+
+def _fallback_caller(caller: Caller):
+    """
+    For a session token whose guest is gone: a function resolving the caller again
+    from the initData / invite token sent with it, or None if there were none.
+    """
+    if not (caller.fallback_initdata or caller.fallback_invite_token):
+        return None
+    return lambda db: _resolve_caller(None, caller.fallback_initdata, caller.fallback_invite_token, db)
+
+def load_guest(db: Session, caller: Caller) -> Guest:
+    """
+    Loads the caller's Guest with Profile and FamilyProfile in one joined query.
+    """
+    guest = (
+        db.query(Guest)
+        .options(joinedload(Guest.profile), joinedload(Guest.family_profile))
+        .filter(Guest.id == caller.guest_id)
+        .one_or_none()
+    )
+    if not guest or guest.telegram_user_id != caller.telegram_user_id:
+        fallback = _fallback_caller(caller)
+        if fallback is None:
+            raise HTTPException(401, "Guest not found")
+        # e.g. an admin deleted the guest: initData re-creates it, as on first contact
+        return load_guest(db, fallback(db))
+    if not guest.profile:
+        ensure_profile(db, guest.id)
+        db.commit()
+        db.refresh(guest, ["profile"])
+    return guest
+
+def get_current_guest(
+    caller: Caller = Depends(get_caller),
+    db: Session = Depends(get_db),
+) -> Guest:
+    # cached by FastAPI per request: every dependant gets the same row
+    return load_guest(db, caller)
+
+async def load_guest_async(db: AsyncSession, caller: Caller) -> Guest:
+    result = await db.execute(
+        select(Guest)
+        .options(joinedload(Guest.profile), joinedload(Guest.family_profile))
+        .where(Guest.id == caller.guest_id)
+    )
+    guest = result.scalar_one_or_none()
+    if not guest or guest.telegram_user_id != caller.telegram_user_id:
+        fallback = _fallback_caller(caller)
+        if fallback is None:
+            raise HTTPException(401, "Guest not found")
+        return await load_guest_async(db, await db.run_sync(fallback))
+    if not guest.profile:
+        await db.run_sync(ensure_profile, guest.id)
+        await db.commit()
+        await db.refresh(guest, ["profile"])
+    return guest
+
+async def get_current_guest_async(
+    caller: Caller = Depends(get_caller),
+    db: AsyncSession = Depends(get_async_db),
+) -> Guest:
+    """
+    Same as get_current_guest, bound to the request's AsyncSession for async routes.
+    """
+    return await load_guest_async(db, caller)
@@ -0,0 +1,205 @@
+"""
+Local stand-in for the Telegram Bot API, for offline tests and benchmarks.
+
+Implements sendMessage, getChat, getMe and getUpdates under /bot<token>/<method>
+and records every call. Point the backend (TELEGRAM_API_BASE) and the bot
+(TELEGRAM_API_BASE) at it:
+
+    python -m app.fake_bot_api --port 8089 --latency-ms 40 --rate-limit
+
+Control endpoints:
+    GET  /_calls            recorded calls (?method=sendMessage to filter)
+    DELETE /_calls          clear the record
+    GET/POST /_config       read / change latency, 429 injection, limits
+    POST /_updates          queue an update for getUpdates ({"message": {...}} or a text)
+
+getChat("@name") answers with a stable id derived from the name; names listed in
+unknown_usernames answer "chat not found".
+"""
+import argparse
+import asyncio
+import random
+import time
+import zlib
+from collections import defaultdict, deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Telegram Bot API")
+
+config = {
+    "latency_ms": 0.0,
+    # probability of answering 429 regardless of load
+    "error_429_rate": 0.0,
+    "retry_after": 1,
+    # answer 429 like Telegram when over 30 msg/s overall or 1 msg/s per chat
+    "rate_limit": False,
+    "global_rate": 30,
+    "per_chat_interval": 1.0,
+    "bot_username": "fake_wedding_bot",
+    "unknown_usernames": [],
+}
+calls: list[dict] = []
+updates: list[dict] = []
+_updates_changed = asyncio.Event()
+_recent_sends: deque = deque()
+_last_chat_send: dict = defaultdict(float)
+_message_ids = iter(range(1, 1 << 62))
+_update_ids = iter(range(1, 1 << 62))
+
+def _ok(result) -> JSONResponse:
+    return JSONResponse({"ok": True, "result": result})
+
+def _error(code: int, description: str, retry_after: int | None = None) -> JSONResponse:
+    body = {"ok": False, "error_code": code, "description": description}
+    if retry_after is not None:
+        body["parameters"] = {"retry_after": retry_after}
+    return JSONResponse(body, status_code=code)
+
+def _too_many() -> JSONResponse:
+    retry_after = int(config["retry_after"])
+    return _error(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+
+def _over_limit(chat_id) -> bool:
+    now = time.monotonic()
+    while _recent_sends and _recent_sends[0] < now - 1:
+        _recent_sends.popleft()
+    if len(_recent_sends) >= config["global_rate"]:
+        return True
+    if now - _last_chat_send[chat_id] < config["per_chat_interval"]:
+        return True
+    _recent_sends.append(now)
+    _last_chat_send[chat_id] = now
+    return False
+
+def _chat_id(username: str) -> int:
+    return 10_000_000 + zlib.crc32(username.lower().encode()) % 1_000_000_000
+
+async def _params(request: Request) -> dict:
+    params = dict(request.query_params)
+    if request.method == "POST":
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            params.update(await request.json() or {})
+        elif content_type.startswith(("application/x-www-form-urlencoded", "multipart/form-data")):
+            params.update({k: v for k, v in (await request.form()).items() if isinstance(v, str)})
+    return params
+
+def _send_message(params: dict):
+    chat_id = params.get("chat_id")
+    if chat_id is None or params.get("text") in (None, ""):
+        return _error(400, "Bad Request: message text is empty")
+    if config["rate_limit"] and _over_limit(str(chat_id)):
+        return _too_many()
+    return _ok({
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else chat_id, "type": "private"},
+        "text": params.get("text"),
+    })
+
+def _get_chat(params: dict):
+    chat = str(params.get("chat_id") or "")
+    if chat.startswith("@"):
+        username = chat[1:]
+        if username.lower() in {u.lower() for u in config["unknown_usernames"]}:
+            return _error(400, "Bad Request: chat not found")
+        return _ok({"id": _chat_id(username), "type": "private", "username": username, "first_name": username})
+    if not chat.lstrip("-").isdigit():
+        return _error(400, "Bad Request: chat not found")
+    return _ok({"id": int(chat), "type": "private", "first_name": f"user{chat}"})
+
+async def _get_updates(params: dict):
+    offset = int(params.get("offset") or 0)
+    timeout = min(float(params.get("timeout") or 0), 50.0)
+    if offset:
+        updates[:] = [u for u in updates if u["update_id"] >= offset]
+    if not updates and timeout:
+        _updates_changed.clear()
+        try:
+            await asyncio.wait_for(_updates_changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+    limit = int(params.get("limit") or 100)
+    return _ok(updates[:limit])
+
+@app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+async def bot_method(token: str, method: str, request: Request):
+    params = await _params(request)
+    calls.append({"at": time.time(), "token": token, "method": method, "params": params})
+    if config["latency_ms"]:
+        await asyncio.sleep(config["latency_ms"] / 1000)
+    if method != "getUpdates" and config["error_429_rate"] and random.random() < config["error_429_rate"]:
+        return _too_many()
+    if method == "sendMessage":
+        return _send_message(params)
+    if method == "getChat":
+        return _get_chat(params)
+    if method == "getMe":
+        return _ok({"id": 1, "is_bot": True, "first_name": "Fake bot", "username": config["bot_username"]})
+    if method == "getUpdates":
+        return await _get_updates(params)
+    # telebot calls these on start/stop; harmless to accept
+    if method in ("deleteWebhook", "setMyCommands", "answerCallbackQuery", "close", "logOut"):
+        return _ok(True)
+    return _error(404, "Not Found: method not found")
+
+@app.get("/_calls")
+def get_calls(method: str | None = None):
+    return [c for c in calls if method is None or c["method"] == method]
+
+@app.delete("/_calls")
+def clear_calls():
+    calls.clear()
+    return {"ok": True}
+
+@app.get("/_config")
+def get_config():
+    return config
+
+@app.post("/_config")
+def set_config(body: dict):
+    config.update({k: v for k, v in body.items() if k in config})
+    return config
+
+@app.post("/_updates")
+def push_update(body: dict):
+    """
+    Queues an update. {"text": "...", "user_id": 1} builds a private message.
+    """
+    if "message" not in body and "callback_query" not in body:
+        user_id = int(body.get("user_id") or 1)
+        body = {"message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": body.get("text") or "",
+        }}
+    update = {"update_id": next(_update_ids), **body}
+    updates.append(update)
+    _updates_changed.set()
+    return update
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rate-limit", action="store_true", help="enforce 30 msg/s and 1 msg/s per chat")
+    args = parser.parse_args()
+    config.update(
+        latency_ms=args.latency_ms,
+        error_429_rate=args.error_429_rate,
+        retry_after=args.retry_after,
+        rate_limit=args.rate_limit,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
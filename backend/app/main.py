@@ -1,11 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
 
-from .db import Base, engine
+from .config import settings
+from .db import engine
+from .migrations import run_migrations
 from .routers import auth, profile, event_info, admin, family, questions
+from .services.http_client import close_http_client, open_http_client
+from .services.outbox import run_dispatcher
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await open_http_client()
+    dispatcher = asyncio.create_task(run_dispatcher()) if settings.OUTBOX_DISPATCHER_ENABLED else None
+    yield
+    if dispatcher:
+        dispatcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await dispatcher
+    await close_http_client()
 
-app = FastAPI(title="Wedding TG Backend")
+app = FastAPI(title="Wedding TG Backend", lifespan=lifespan)
 
 # CORS: allow WebApp to call API locally
 app.add_middleware(
@@ -16,7 +33,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-Base.metadata.create_all(bind=engine)
+# one version check per start; pending steps run under a write lock
+run_migrations(engine)
 
 app.include_router(auth.router)
 app.include_router(profile.router)
@@ -42,43 +60,6 @@ app.add_api_route("/event-info/timing/me", event_info.get_timing_for_user, metho
 
 app.add_api_route("/api/ui-settings", admin.get_ui_settings_public, methods=["GET"])
 
-def _ensure_family_group_column():
-    if not engine.url.get_backend_name().startswith("sqlite"):
-        return
-    with engine.begin() as conn:
-        cols = conn.execute(text("PRAGMA table_info(guests)")).fetchall()
-        col_names = {row[1] for row in cols}
-        if "family_group_id" not in col_names:
-            conn.execute(text("ALTER TABLE guests ADD COLUMN family_group_id INTEGER"))
-
-        cols = conn.execute(text("PRAGMA table_info(profiles)")).fetchall()
-        col_names = {row[1] for row in cols}
-        if "welcome_seen_at" not in col_names:
-            conn.execute(text("ALTER TABLE profiles ADD COLUMN welcome_seen_at DATETIME"))
-        if "is_best_friend" not in col_names:
-            conn.execute(text("ALTER TABLE profiles ADD COLUMN is_best_friend BOOLEAN DEFAULT 0"))
-        if "has_plus_one_requested" not in col_names:
-            conn.execute(text("ALTER TABLE profiles ADD COLUMN has_plus_one_requested BOOLEAN DEFAULT 0"))
-        if "plus_one_partner_username" not in col_names:
-            conn.execute(text("ALTER TABLE profiles ADD COLUMN plus_one_partner_username VARCHAR(64)"))
-        if "plus_one_invite_sent_at" not in col_names:
-            conn.execute(text("ALTER TABLE profiles ADD COLUMN plus_one_invite_sent_at DATETIME"))
-
-        cols = conn.execute(text("PRAGMA table_info(invite_tokens)")).fetchall()
-        col_names = {row[1] for row in cols}
-        if col_names and "expires_at" not in col_names:
-            conn.execute(text("ALTER TABLE invite_tokens ADD COLUMN expires_at DATETIME"))
-        if col_names and "invitee_telegram_user_id" not in col_names:
-            conn.execute(text("ALTER TABLE invite_tokens ADD COLUMN invitee_telegram_user_id INTEGER"))
-        if col_names and "status" not in col_names:
-            conn.execute(text("ALTER TABLE invite_tokens ADD COLUMN status VARCHAR(16)"))
-        if col_names and "accepted_at" not in col_names:
-            conn.execute(text("ALTER TABLE invite_tokens ADD COLUMN accepted_at DATETIME"))
-        if col_names and "declined_at" not in col_names:
-            conn.execute(text("ALTER TABLE invite_tokens ADD COLUMN declined_at DATETIME"))
-
-_ensure_family_group_column()
-
 @app.get("/health")
 def health():
     return {"ok": True}
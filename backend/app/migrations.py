@@ -0,0 +1,274 @@
+"""
+Versioned schema migrations.
+
+Startup runs a single `SELECT MAX(version) FROM schema_version`; only when it is
+behind MIGRATIONS does it take the write lock (BEGIN IMMEDIATE on SQLite), re-check
+the version and apply the pending steps, so concurrent workers never race on ALTERs.
+A fresh database gets `create_all` (plus POST_CREATE) and is stamped with the latest version.
+"""
+import json
+import logging
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from .db import Base
+from . import models  # noqa: F401  (register tables on Base.metadata)
+from .services.guest_search import create_guest_search
+
+logger = logging.getLogger(__name__)
+
+def _column_names(conn: Connection, table: str) -> set[str]:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _add_columns(conn: Connection, table: str, columns: dict[str, str]) -> None:
+    existing = _column_names(conn, table)
+    for name, ddl in columns.items():
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+def _m001_baseline(conn: Connection) -> None:
+    # databases created before schema_version: missing tables + columns added over time
+    Base.metadata.create_all(conn)
+    _add_columns(conn, "guests", {"family_group_id": "INTEGER"})
+    _add_columns(conn, "profiles", {
+        "welcome_seen_at": "DATETIME",
+        "is_best_friend": "BOOLEAN DEFAULT 0",
+        "has_plus_one_requested": "BOOLEAN DEFAULT 0",
+        "plus_one_partner_username": "VARCHAR(64)",
+        "plus_one_invite_sent_at": "DATETIME",
+    })
+    _add_columns(conn, "invite_tokens", {
+        "expires_at": "DATETIME",
+        "invitee_telegram_user_id": "INTEGER",
+        "status": "VARCHAR(16)",
+        "accepted_at": "DATETIME",
+        "declined_at": "DATETIME",
+    })
+
+def _create_indexes(conn: Connection, *ddl: str) -> None:
+    # spelled out per migration: the model's index list describes the latest schema,
+    # whose columns may not exist yet at this step
+    for statement in ddl:
+        conn.execute(text(statement))
+
+def _m002_query_indexes(conn: Connection) -> None:
+    _add_columns(conn, "guests", {"username_lc": "VARCHAR(64)"})
+    conn.execute(text("UPDATE guests SET username_lc = lower(username) WHERE username IS NOT NULL"))
+    # single-column indexes superseded by the composites below
+    conn.execute(text("DROP INDEX IF EXISTS ix_invite_tokens_invitee_telegram_user_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_change_log_guest_id"))
+    _create_indexes(
+        conn,
+        "CREATE INDEX IF NOT EXISTS ix_guests_username_lc ON guests (username_lc)",
+        "CREATE INDEX IF NOT EXISTS ix_profiles_full_name_birth_date ON profiles (full_name, birth_date)",
+        "CREATE INDEX IF NOT EXISTS ix_profiles_rsvp_status ON profiles (rsvp_status)",
+        "CREATE INDEX IF NOT EXISTS ix_invite_tokens_invitee_status_created "
+        "ON invite_tokens (invitee_telegram_user_id, status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_change_log_guest_created ON change_log (guest_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_sheet_sync_jobs_status_created ON sheet_sync_jobs (status, created_at)",
+    )
+
+def _m004_family_group_index(conn: Connection) -> None:
+    _create_indexes(conn, "CREATE INDEX IF NOT EXISTS ix_guests_family_group_id ON guests (family_group_id)")
+
+def _csv_items(value: str | None) -> list[str]:
+    return [x for x in (s.strip() for s in (value or "").split(",")) if x]
+
+def _m005_child_tables(conn: Connection) -> None:
+    # profiles.alcohol_prefs_csv / photos_csv and family_profiles.children_json stay in the
+    # file as dead columns; the ORM no longer maps them
+    for model in (models.ProfileAlcohol, models.ProfilePhoto, models.FamilyChild):
+        model.__table__.create(conn, checkfirst=True)
+    profile_cols = _column_names(conn, "profiles")
+    if {"alcohol_prefs_csv", "photos_csv"} <= profile_cols:
+        rows = conn.execute(text("SELECT id, alcohol_prefs_csv, photos_csv FROM profiles")).fetchall()
+        alcohol, photos = [], []
+        for profile_id, alcohol_csv, photos_csv in rows:
+            for i, value in enumerate(_csv_items(alcohol_csv)):
+                value = "Не пью алкоголь" if value == "Не пью" else value
+                alcohol.append({"profile_id": profile_id, "position": i, "value": value})
+            for i, file_id in enumerate(_csv_items(photos_csv)[:5]):
+                photos.append({"profile_id": profile_id, "position": i, "file_id": file_id})
+        if alcohol:
+            conn.execute(models.ProfileAlcohol.__table__.insert(), alcohol)
+        if photos:
+            conn.execute(models.ProfilePhoto.__table__.insert(), photos)
+    if "children_json" in _column_names(conn, "family_profiles"):
+        rows = conn.execute(text("SELECT id, children_json FROM family_profiles WHERE children_json IS NOT NULL")).fetchall()
+        children = []
+        for family_profile_id, raw in rows:
+            try:
+                items = json.loads(raw)
+            except ValueError:
+                continue
+            for i, ch in enumerate(x for x in items if isinstance(x, dict)):
+                children.append({
+                    "family_profile_id": family_profile_id,
+                    "position": i,
+                    "client_id": None if ch.get("id") is None else str(ch.get("id")),
+                    "name": ch.get("name"),
+                    "age": None if ch.get("age") is None else str(ch.get("age")),
+                    "note": ch.get("note"),
+                    "contact": ch.get("child_contact"),
+                    "telegram_username": ch.get("child_telegram_username"),
+                    "telegram_user_id": ch.get("child_telegram_user_id"),
+                })
+        if children:
+            conn.execute(models.FamilyChild.__table__.insert(), children)
+
+def _m006_notification_outbox(conn: Connection) -> None:
+    models.NotificationOutbox.__table__.create(conn, checkfirst=True)
+
+def _m007_admin_digests(conn: Connection) -> None:
+    _add_columns(conn, "admin_settings", {"digest_window_seconds": "INTEGER NOT NULL DEFAULT 120"})
+    _add_columns(conn, "notification_outbox", {"guest_id": "INTEGER"})
+
+def _m008_username_cache(conn: Connection) -> None:
+    models.TelegramUsernameCache.__table__.create(conn, checkfirst=True)
+
+def _m009_idempotency_keys(conn: Connection) -> None:
+    models.IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+def _m010_sheet_sync_dedupe(conn: Connection) -> None:
+    _add_columns(conn, "sheet_sync_jobs", {"dedupe_key": "VARCHAR(64)", "not_before": "DATETIME"})
+    # keep the newest pending job per (type, telegram_id) so the unique index can be built
+    conn.execute(text(
+        "UPDATE sheet_sync_jobs SET status = 'superseded' WHERE status = 'pending' AND id NOT IN "
+        "(SELECT MAX(id) FROM sheet_sync_jobs WHERE status = 'pending' GROUP BY type, telegram_id)"
+    ))
+    conn.execute(text(
+        "UPDATE sheet_sync_jobs SET dedupe_key = type || ':' || COALESCE(CAST(telegram_id AS TEXT), '') "
+        "WHERE status = 'pending'"
+    ))
+    _create_indexes(
+        conn,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_sheet_sync_jobs_pending_dedupe "
+        "ON sheet_sync_jobs (dedupe_key) WHERE status = 'pending'",
+    )
+
+_INVITE_TOKENS_COLUMNS = (
+    "id, token, family_group_id, inviter_guest_id, used_by_guest_id, invitee_telegram_user_id, "
+    "status, accepted_at, declined_at, expires_at, created_at"
+)
+
+def _m011_invite_tokens_autoincrement(conn: Connection) -> None:
+    # SQLite hands out max(id) + 1 without AUTOINCREMENT, so deleting the newest invite
+    # let its id (and its pseudo guest, telegram_user_id = -id) be given out again
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text("ALTER TABLE invite_tokens RENAME TO invite_tokens_old"))
+    for (name,) in conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'invite_tokens_old' AND sql IS NOT NULL"
+    )).all():
+        conn.execute(text(f"DROP INDEX {name}"))
+    conn.execute(text(
+        "CREATE TABLE invite_tokens ("
+        "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+        "token VARCHAR(64) NOT NULL, "
+        "family_group_id INTEGER NOT NULL REFERENCES family_groups (id), "
+        "inviter_guest_id INTEGER NOT NULL REFERENCES guests (id), "
+        "used_by_guest_id INTEGER REFERENCES guests (id), "
+        "invitee_telegram_user_id INTEGER, "
+        "status VARCHAR(16) NOT NULL, "
+        "accepted_at DATETIME, declined_at DATETIME, expires_at DATETIME, "
+        "created_at DATETIME NOT NULL)"
+    ))
+    conn.execute(text(
+        f"INSERT INTO invite_tokens ({_INVITE_TOKENS_COLUMNS}) SELECT {_INVITE_TOKENS_COLUMNS} FROM invite_tokens_old"
+    ))
+    conn.execute(text("DROP TABLE invite_tokens_old"))
+    _create_indexes(
+        conn,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_invite_tokens_token ON invite_tokens (token)",
+        "CREATE INDEX IF NOT EXISTS ix_invite_tokens_family_group_id ON invite_tokens (family_group_id)",
+        "CREATE INDEX IF NOT EXISTS ix_invite_tokens_inviter_guest_id ON invite_tokens (inviter_guest_id)",
+        "CREATE INDEX IF NOT EXISTS ix_invite_tokens_invitee_status_created "
+        "ON invite_tokens (invitee_telegram_user_id, status, created_at)",
+    )
+    # start past every id already used, including those of deleted invites whose pseudo guests remain
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'invite_tokens'"))
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'invite_tokens', MAX("
+        "(SELECT COALESCE(MAX(id), 0) FROM invite_tokens), "
+        "(SELECT COALESCE(MAX(-telegram_user_id), 0) FROM guests WHERE telegram_user_id < 0))"
+    ))
+
+# (version, description, step) — append only, never reorder
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline: legacy columns", _m001_baseline),
+    (2, "indexes for hot queries, guests.username_lc", _m002_query_indexes),
+    (3, "guest_search FTS5 table and triggers", create_guest_search),
+    (4, "index guests.family_group_id", _m004_family_group_index),
+    (5, "profile_alcohol, profile_photos, family_children from CSV/JSON columns", _m005_child_tables),
+    (6, "notification_outbox", _m006_notification_outbox),
+    (7, "admin change digests", _m007_admin_digests),
+    (8, "telegram_username_cache", _m008_username_cache),
+    (9, "idempotency_keys", _m009_idempotency_keys),
+    (10, "sheet_sync_jobs dedupe_key, not_before", _m010_sheet_sync_dedupe),
+    (11, "invite_tokens AUTOINCREMENT", _m011_invite_tokens_autoincrement),
+]
+
+# objects create_all cannot express; a fresh database gets them right after create_all
+POST_CREATE: list[Callable[[Connection], None]] = [create_guest_search]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_CREATE_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "version INTEGER PRIMARY KEY, description VARCHAR(128), applied_at DATETIME)"
+)
+
+def _current_version(conn: Connection) -> int:
+    return int(conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0)
+
+def _stamp(conn: Connection, version: int, description: str) -> None:
+    conn.execute(
+        text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+        {"v": version, "d": description, "t": datetime.utcnow()},
+    )
+
+def _migrate_locked(conn: Connection) -> None:
+    conn.execute(text(_CREATE_VERSION_TABLE))
+    version = _current_version(conn)
+    if version >= LATEST_VERSION:
+        return
+    if version == 0 and not inspect(conn).has_table("guests"):
+        Base.metadata.create_all(conn)
+        for step in POST_CREATE:
+            step(conn)
+        _stamp(conn, LATEST_VERSION, "fresh database")
+        logger.info("schema created at version %s", LATEST_VERSION)
+        return
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        logger.info("applying migration %s: %s", step_version, description)
+        step(conn)
+        _stamp(conn, step_version, description)
+
+def run_migrations(engine: Engine) -> None:
+    try:
+        with engine.connect() as conn:
+            if _current_version(conn) >= LATEST_VERSION:
+                return
+    except DBAPIError:
+        pass  # no schema_version table yet
+
+    if engine.url.get_backend_name().startswith("sqlite"):
+        # BEGIN IMMEDIATE takes the write lock up front; other workers wait (busy_timeout)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("BEGIN IMMEDIATE"))
+            try:
+                _migrate_locked(conn)
+                conn.execute(text("COMMIT"))
+            except Exception:
+                conn.execute(text("ROLLBACK"))
+                raise
+        return
+
+    with engine.begin() as conn:
+        _migrate_locked(conn)
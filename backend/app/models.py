@@ -1,5 +1,5 @@
-from sqlalchemy import String, Integer, Boolean, Date, DateTime, ForeignKey, Text, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Integer, Boolean, Date, DateTime, ForeignKey, Text, UniqueConstraint, Index, text
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 from datetime import datetime, date
 
 from .db import Base
@@ -10,10 +10,12 @@ class Guest(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     telegram_user_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
     username: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # lower(username), kept in sync by _sync_username_lc; username lookups use this index
+    username_lc: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
     first_name: Mapped[str | None] = mapped_column(String(128), nullable=True)
     last_name: Mapped[str | None] = mapped_column(String(128), nullable=True)
     phone: Mapped[str | None] = mapped_column(String(32), nullable=True)
-    family_group_id: Mapped[int | None] = mapped_column(ForeignKey("family_groups.id"), nullable=True)
+    family_group_id: Mapped[int | None] = mapped_column(ForeignKey("family_groups.id"), nullable=True, index=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -26,16 +28,31 @@ class Guest(Base):
         foreign_keys="Profile.guest_id",
     )
 
+    family_profile = relationship(
+        "FamilyProfile",
+        back_populates="guest",
+        uselist=False,
+        cascade="all, delete-orphan",
+    )
+
     family_group = relationship("FamilyGroup", back_populates="members", foreign_keys=[family_group_id])
 
+    @validates("username")
+    def _sync_username_lc(self, _key, value):
+        self.username_lc = value.lower() if value else None
+        return value
+
 class Profile(Base):
     __tablename__ = "profiles"
-    __table_args__ = (UniqueConstraint("guest_id"),)
+    __table_args__ = (
+        UniqueConstraint("guest_id"),
+        Index("ix_profiles_full_name_birth_date", "full_name", "birth_date"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     guest_id: Mapped[int] = mapped_column(ForeignKey("guests.id"), index=True)
 
-    rsvp_status: Mapped[str] = mapped_column(String(16), default="unknown")  # yes/no/maybe/unknown
+    rsvp_status: Mapped[str] = mapped_column(String(16), default="unknown", index=True)  # yes/no/maybe/unknown
 
     full_name: Mapped[str | None] = mapped_column(String(256), nullable=True)
     birth_date: Mapped[date | None] = mapped_column(Date, nullable=True)
@@ -50,13 +67,10 @@ class Profile(Base):
     food_pref: Mapped[str | None] = mapped_column(String(16), nullable=True)  # fish/meat/vegan
     food_allergies: Mapped[str | None] = mapped_column(Text, nullable=True)
 
-    alcohol_prefs_csv: Mapped[str | None] = mapped_column(Text, nullable=True) # multi: "wine,beer,..."
-
     extra_known_since: Mapped[str | None] = mapped_column(String(32), nullable=True)  # groom/bride/both -> drives questions
     extra_memory: Mapped[str | None] = mapped_column(Text, nullable=True)
     extra_fact: Mapped[str | None] = mapped_column(Text, nullable=True)
 
-    photos_csv: Mapped[str | None] = mapped_column(Text, nullable=True)  # up to 5 Telegram file_id
     welcome_seen_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     # Partner/children linking
@@ -66,6 +80,42 @@ class Profile(Base):
 
     guest = relationship("Guest", back_populates="profile", foreign_keys=[guest_id])
 
+    # multi-valued answers; selectin so they are loaded with the profile, also under AsyncSession
+    alcohol = relationship(
+        "ProfileAlcohol",
+        order_by="ProfileAlcohol.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+    photos = relationship(
+        "ProfilePhoto",
+        order_by="ProfilePhoto.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+    @property
+    def alcohol_prefs(self) -> list[str]:
+        return [a.value for a in self.alcohol]
+
+    @property
+    def photo_ids(self) -> list[str]:
+        return [ph.file_id for ph in self.photos]
+
+class ProfileAlcohol(Base):
+    __tablename__ = "profile_alcohol"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id", ondelete="CASCADE"), index=True)
+    position: Mapped[int] = mapped_column(Integer, default=0)
+    value: Mapped[str] = mapped_column(String(64), index=True)  # wine/beer/... or "Не пью алкоголь"
+
+class ProfilePhoto(Base):
+    __tablename__ = "profile_photos"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    profile_id: Mapped[int] = mapped_column(ForeignKey("profiles.id", ondelete="CASCADE"), index=True)
+    position: Mapped[int] = mapped_column(Integer, default=0)
+    file_id: Mapped[str] = mapped_column(String(256))  # Telegram file_id, up to 5 per profile
+
 class EventInfo(Base):
     __tablename__ = "event_info"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -93,12 +143,17 @@ class FamilyGroup(Base):
 
 class InviteToken(Base):
     __tablename__ = "invite_tokens"
+    __table_args__ = (
+        Index("ix_invite_tokens_invitee_status_created", "invitee_telegram_user_id", "status", "created_at"),
+        # ids are never reused: -id is the telegram_user_id of the invite's browser-mode guest
+        {"sqlite_autoincrement": True},
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     token: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     family_group_id: Mapped[int] = mapped_column(ForeignKey("family_groups.id"), index=True)
     inviter_guest_id: Mapped[int] = mapped_column(ForeignKey("guests.id"), index=True)
     used_by_guest_id: Mapped[int | None] = mapped_column(ForeignKey("guests.id"), nullable=True)
-    invitee_telegram_user_id: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+    invitee_telegram_user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
     status: Mapped[str] = mapped_column(String(16), default="pending")
     accepted_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     declined_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
@@ -114,10 +169,42 @@ class FamilyProfile(Base):
 
     with_partner: Mapped[bool] = mapped_column(Boolean, default=False)
     partner_name: Mapped[str | None] = mapped_column(String(256), nullable=True)
-    children_json: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    guest = relationship("Guest", back_populates="family_profile")
+    children = relationship(
+        "FamilyChild",
+        order_by="FamilyChild.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+class FamilyChild(Base):
+    __tablename__ = "family_children"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    family_profile_id: Mapped[int] = mapped_column(ForeignKey("family_profiles.id", ondelete="CASCADE"), index=True)
+    position: Mapped[int] = mapped_column(Integer, default=0)
+    client_id: Mapped[str | None] = mapped_column(String(64), nullable=True)  # "id" from the WebApp form
+    name: Mapped[str | None] = mapped_column(String(256), nullable=True)
+    age: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    note: Mapped[str | None] = mapped_column(Text, nullable=True)
+    contact: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    telegram_username: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    telegram_user_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+
+    def to_dict(self) -> dict:
+        # same shape the API returned when children were stored as JSON
+        return {
+            "id": self.client_id,
+            "name": self.name,
+            "age": self.age,
+            "note": self.note,
+            "child_contact": self.contact,
+            "child_telegram_username": self.telegram_username,
+            "child_telegram_user_id": self.telegram_user_id,
+        }
+
 class Group(Base):
     __tablename__ = "groups"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -131,8 +218,9 @@ class GroupMember(Base):
 
 class ChangeLog(Base):
     __tablename__ = "change_log"
+    __table_args__ = (Index("ix_change_log_guest_created", "guest_id", "created_at"),)
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    guest_id: Mapped[int] = mapped_column(Integer, index=True)
+    guest_id: Mapped[int] = mapped_column(Integer)
     field: Mapped[str] = mapped_column(String(128))
     old_value: Mapped[str | None] = mapped_column(Text, nullable=True)
     new_value: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -142,6 +230,8 @@ class AdminSettings(Base):
     __tablename__ = "admin_settings"
     admin_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     system_notifications_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
+    # guest change diffs are merged into one message per guest per window; 0 sends each save
+    digest_window_seconds: Mapped[int] = mapped_column(Integer, default=120, server_default="120")
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class AppSettings(Base):
@@ -152,11 +242,83 @@ class AppSettings(Base):
 
 class SheetSyncJob(Base):
     __tablename__ = "sheet_sync_jobs"
+    __table_args__ = (
+        # worker poll: WHERE status = 'pending' AND not_before <= now ORDER BY created_at
+        Index("ix_sheet_sync_jobs_status_created", "status", "created_at"),
+        # one pending job per (type, telegram_id); enqueue upserts into it
+        Index(
+            "ux_sheet_sync_jobs_pending_dedupe",
+            "dedupe_key",
+            unique=True,
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    type: Mapped[str] = mapped_column(String(32), default="sync_guest")  # sync_guest | sync_all
+    type: Mapped[str] = mapped_column(String(32), default="sync_guest")  # sync_guest | sync_all | delete_guest | clear_all
     telegram_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
-    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending/processing/done/failed
+    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending/processing/done/failed/superseded
     attempts: Mapped[int] = mapped_column(Integer, default=0)
     payload: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # "<type>:<telegram_id>"; NULL on jobs queued before coalescing
+    dedupe_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # debounce: not picked up before this time; pushed back by further edits
+    not_before: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # dispatcher claim: status IN ('pending', 'retry', 'sending') AND next_attempt_at <= now
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+        # the same message to the same chat is queued once while it is pending
+        Index(
+            "ux_notification_outbox_pending_dedupe",
+            "dedupe_key",
+            unique=True,
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(Integer)
+    category: Mapped[str] = mapped_column(String(16), default="user")  # user | system | question | digest
+    text: Mapped[str] = mapped_column(Text)
+    dedupe_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # pending/sending/retry/sent/failed/skipped; "retry" is outside the dedupe index so a
+    # failed send can wait for its next attempt next to a newer identical pending row
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # digest rows: text is rendered at send time from this guest's ChangeLog since created_at
+    guest_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+class TelegramUsernameCache(Base):
+    """
+    getChat answers for @usernames; telegram_user_id is NULL for "not found".
+    """
+    __tablename__ = "telegram_username_cache"
+    username: Mapped[str] = mapped_column(String(64), primary_key=True)  # lowercase, no "@"
+    resolved_username: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    telegram_user_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    resolved_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """
+    First response to a guest's mutating request sent with an Idempotency-Key header;
+    retries with the same key replay it instead of running the write again.
+    """
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("guest_id", "scope", "key"),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    guest_id: Mapped[int] = mapped_column(Integer)
+    scope: Mapped[str] = mapped_column(String(32))  # profile / extra / family_save
+    key: Mapped[str] = mapped_column(String(128))
+    request_hash: Mapped[str] = mapped_column(String(64))
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    response_body: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,70 @@
+"""
+EXPLAIN QUERY PLAN over the hot queries; flags any that fall back to a full table scan.
+
+Reported by /api/admin/db-health; `python -m app.query_plans` exits 1 on a scan.
+"""
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+from .models import Guest, Profile, InviteToken, ChangeLog
+from .services.outbox import due_messages
+from .services.sheets_queue import due_jobs
+
+def hot_queries() -> dict[str, object]:
+    return {
+        "list_guests_by_rsvp": (
+            select(Guest, Profile).join(Profile, Profile.guest_id == Guest.id).where(Profile.rsvp_status == "yes")
+        ),
+        "link_partner": (
+            select(Profile).where(Profile.full_name == "x", Profile.birth_date == date(2000, 1, 1))
+        ),
+        "guest_by_username": (
+            select(Guest, Profile).join(Profile, Profile.guest_id == Guest.id).where(Guest.username_lc == "x")
+        ),
+        "incoming_invite": (
+            select(InviteToken)
+            .where(InviteToken.invitee_telegram_user_id == 1, InviteToken.status == "pending")
+            .order_by(InviteToken.created_at.desc())
+            .limit(1)
+        ),
+        "sheet_worker_poll": due_jobs(datetime(2000, 1, 1), 50),
+        "change_log_by_guest": (
+            select(ChangeLog).where(ChangeLog.guest_id == 1).order_by(ChangeLog.created_at.desc())
+        ),
+        "outbox_due": due_messages(datetime(2000, 1, 1), 20),
+    }
+
+def explain(conn: Connection, stmt) -> list[str]:
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = [compiled.params[name] for name in compiled.positiontup]
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", tuple(params)).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans(conn: Connection) -> dict[str, dict]:
+    """
+    SQLite only. A "SCAN <table>" step (with or without an index) means a full pass.
+    """
+    out = {}
+    for name, stmt in hot_queries().items():
+        plan = explain(conn, stmt)
+        scans = [step for step in plan if step.startswith("SCAN ")]
+        out[name] = {"ok": not scans, "plan": plan}
+    return out
+
+def main() -> int:
+    from .db import engine
+    from .migrations import run_migrations
+
+    run_migrations(engine)
+    with engine.connect() as conn:
+        results = check_query_plans(conn)
+    failed = [name for name, r in results.items() if not r["ok"]]
+    for name, r in results.items():
+        print(f"{'ok  ' if r['ok'] else 'SCAN'} {name}: {' | '.join(r['plan'])}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,21 @@
 from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from sqlalchemy import select, text, func
 import os
 
-from ..db import get_db, engine
-from ..models import Guest, Profile, EventInfo, Group, GroupMember, FamilyGroup, InviteToken, ChangeLog, FamilyProfile, AdminSettings, AppSettings, EventContent, EventTiming
+from ..db import get_db, get_async_db, engine, IS_SQLITE, sqlite_pragmas
+from ..models import (
+    Guest, Profile, ProfileAlcohol, ProfilePhoto, EventInfo, Group, GroupMember, FamilyGroup, InviteToken, ChangeLog,
+    FamilyProfile, FamilyChild, AdminSettings, AppSettings, EventContent, EventTiming, NotificationOutbox,
+)
 from ..schemas import AdminEventInfoIn, BroadcastIn
 from ..config import settings
+from ..query_plans import check_query_plans
 from ..services.telegram_auth import verify_telegram_init_data
-from ..services.notifier import notify_admins, send_admin_message
+from ..services import guest_search
+from ..services.notifier import notify_admins
+from ..services.outbox import enqueue_admin_message
 from ..services.sheets_queue import enqueue_sheet_sync, enqueue_delete_guest, enqueue_clear_all
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -33,6 +40,19 @@ def _assert_admin_or_internal(initdata: str | None, internal: str | None):
     if int(user["id"]) not in settings.admin_id_set:
         raise HTTPException(403, "Admin only")
 
+def _encode_cursor(direction: str, guest_id: int) -> str:
+    # "a" = rows after guest_id, "b" = rows before it
+    return f"{direction}{guest_id:x}"
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        direction, guest_id = cursor[0], int(cursor[1:], 16)
+    except (IndexError, ValueError):
+        raise HTTPException(400, "Bad cursor")
+    if direction not in ("a", "b"):
+        raise HTTPException(400, "Bad cursor")
+    return direction, guest_id
+
 @router.get("/guests")
 def list_guests(
     x_tg_initdata: str | None = Header(default=None),
@@ -41,42 +61,89 @@ def list_guests(
     q: str | None = Query(default=None),
     page: int = Query(default=1, ge=1),
     page_size: int = Query(default=10, ge=1, le=100),
+    ranked: bool = Query(default=False),
+    cursor: str | None = Query(default=None),
+    include_total: bool = Query(default=True),
     db: Session = Depends(get_db)
 ):
+    """
+    `q` goes through the guest_search FTS index when available (ranked=true orders
+    by relevance); queries shorter than 3 characters use ILIKE.
+
+    Rows are ordered by guest id. `cursor` (next_cursor/prev_cursor from a previous
+    response) pages by keyset instead of OFFSET; it cannot be combined with ranked.
+    Without a cursor the total comes from a window count in the same query; with one
+    it costs an extra COUNT, so pass include_total=false when it is not needed.
+    """
     _assert_admin_or_internal(x_tg_initdata, x_internal_secret)
     query = db.query(Guest, Profile, FamilyProfile).join(Profile, Profile.guest_id == Guest.id).outerjoin(
         FamilyProfile, FamilyProfile.guest_id == Guest.id
     )
     if rsvp:
         query = query.filter(Profile.rsvp_status == rsvp)
-    if q:
+    expression = guest_search.match_expression(q) if q and guest_search.available(db) else None
+    ranked = ranked and expression is not None
+    if cursor and ranked:
+        raise HTTPException(400, "cursor is not supported with ranked")
+    if expression:
+        hits = guest_search.search_hits(expression)
+        query = query.join(hits, hits.c.guest_id == Guest.id)
+    elif q:
         like = f"%{q.strip()}%"
         query = query.filter(
             (Profile.full_name.ilike(like)) |
             (Guest.username.ilike(like)) |
             (Guest.phone.ilike(like))
         )
-    total = query.count()
+
+    total = None
+    direction = None
+    if cursor:
+        direction, boundary = _decode_cursor(cursor)
+        if include_total:
+            total = query.count()
+        if direction == "a":
+            query = query.filter(Guest.id > boundary).order_by(Guest.id.asc())
+        else:
+            query = query.filter(Guest.id < boundary).order_by(Guest.id.desc())
+    else:
+        if include_total:
+            query = query.add_columns(func.count().over().label("total"))
+        query = query.order_by(hits.c.rank, Guest.id) if ranked else query.order_by(Guest.id)
+        query = query.offset((page - 1) * page_size)
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "b":
+        rows.reverse()
+    if include_total and not cursor:
+        total = rows[0].total if rows else (0 if page == 1 else query.limit(None).offset(None).count())
+
+    next_cursor = prev_cursor = None
+    if rows and not ranked:
+        first_id, last_id = rows[0][0].id, rows[-1][0].id
+        if has_more or direction == "b":
+            next_cursor = _encode_cursor("a", last_id)
+        if (direction == "b" and has_more) or direction == "a" or (direction is None and page > 1):
+            prev_cursor = _encode_cursor("b", first_id)
+
+    # member counts only for the family groups on this page
+    family_ids = {row[0].family_group_id for row in rows if row[0].family_group_id}
     family_counts = {}
-    rows_counts = (
-        db.query(Guest.family_group_id, func.count(Guest.id))
-        .filter(Guest.family_group_id.isnot(None))
-        .group_by(Guest.family_group_id)
-        .all()
-    )
-    for fg_id, cnt in rows_counts:
-        family_counts[int(fg_id)] = int(cnt)
-    rows = query.offset((page - 1) * page_size).limit(page_size).all()
+    if family_ids:
+        rows_counts = (
+            db.query(Guest.family_group_id, func.count(Guest.id))
+            .filter(Guest.family_group_id.in_(family_ids))
+            .group_by(Guest.family_group_id)
+            .all()
+        )
+        for fg_id, cnt in rows_counts:
+            family_counts[int(fg_id)] = int(cnt)
     out = []
-    for g, p, fp in rows:
-        alcohol = p.alcohol_prefs_csv or ""
-        children_count = 0
-        if fp and fp.children_json:
-            try:
-                import json as _json
-                children_count = len(_json.loads(fp.children_json))
-            except Exception:
-                children_count = 0
+    for row in rows:
+        g, p, fp = row[0], row[1], row[2]
+        alcohol = ",".join(p.alcohol_prefs)
+        children_count = len(fp.children) if fp else 0
         out.append({
             "guest_id": g.id,
             "telegram_user_id": g.telegram_user_id,
@@ -96,7 +163,52 @@ def list_guests(
             "best_friend": _as_bool(getattr(p, "is_best_friend", False)),
             "updated_at": g.updated_at.isoformat() if g.updated_at else None,
         })
-    return {"items": out, "total": total, "page": page, "page_size": page_size}
+    return {
+        "items": out,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
+
+@router.get("/catering")
+def catering_summary(
+    x_tg_initdata: str | None = Header(default=None),
+    x_internal_secret: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+):
+    """
+    Food/alcohol/children counts over guests with rsvp=yes, as SQL aggregates.
+    """
+    _assert_admin_or_internal(x_tg_initdata, x_internal_secret)
+    attending = Profile.rsvp_status == "yes"
+    food = (
+        db.query(Profile.food_pref, func.count(Profile.id))
+        .filter(attending)
+        .group_by(Profile.food_pref)
+        .all()
+    )
+    alcohol = (
+        db.query(ProfileAlcohol.value, func.count(ProfileAlcohol.id))
+        .join(Profile, Profile.id == ProfileAlcohol.profile_id)
+        .filter(attending)
+        .group_by(ProfileAlcohol.value)
+        .all()
+    )
+    children = (
+        db.query(func.count(FamilyChild.id))
+        .join(FamilyProfile, FamilyProfile.id == FamilyChild.family_profile_id)
+        .join(Profile, Profile.guest_id == FamilyProfile.guest_id)
+        .filter(attending)
+        .scalar()
+    )
+    return {
+        "guests": sum(cnt for _value, cnt in food),
+        "food": {value or "—": cnt for value, cnt in food},
+        "alcohol": {value: cnt for value, cnt in alcohol},
+        "children": int(children or 0),
+    }
 
 @router.post("/best-friend")
 def set_best_friend(
@@ -242,24 +354,20 @@ async def update_event_info(
     body: AdminEventInfoIn,
     x_tg_initdata: str | None = Header(default=None),
     x_internal_secret: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     _assert_admin_or_internal(x_tg_initdata, x_internal_secret)
-    row = db.query(EventInfo).first()
+    row = await db.scalar(select(EventInfo).limit(1))
     if not row:
         row = EventInfo(content=body.content)
         db.add(row)
     else:
         row.content = body.content
-    db.commit()
-    try:
-        await send_admin_message(
-            f"<b>Информация о мероприятии обновлена</b>\nДлина: {len(body.content)}",
-            category="system",
-            db=db,
-        )
-    except Exception:
-        pass
+    await db.run_sync(
+        enqueue_admin_message,
+        f"<b>Информация о мероприятии обновлена</b>\nДлина: {len(body.content)}",
+    )
+    await db.commit()
     return {"ok": True}
 
 @router.post("/broadcast")
@@ -267,7 +375,6 @@ async def broadcast(
     body: BroadcastIn,
     x_tg_initdata: str | None = Header(default=None),
     x_internal_secret: str | None = Header(default=None),
-    db: Session = Depends(get_db),
 ):
     _assert_admin_or_internal(x_tg_initdata, x_internal_secret)
     # backend only forwards request to bot; bot resolves recipients by group_ids
@@ -286,6 +393,14 @@ def delete_guest(
     if not guest:
         raise HTTPException(404, "Guest not found")
     telegram_id = guest.telegram_user_id
+    # drop rows that still reference this guest (foreign_keys=ON)
+    db.query(Profile).filter(Profile.partner_guest_id == guest.id).update(
+        {Profile.partner_guest_id: None}, synchronize_session=False
+    )
+    db.query(InviteToken).filter(
+        (InviteToken.inviter_guest_id == guest.id) | (InviteToken.used_by_guest_id == guest.id)
+    ).delete(synchronize_session=False)
+    db.query(GroupMember).filter(GroupMember.guest_id == guest.id).delete(synchronize_session=False)
     db.delete(guest)
     db.commit()
     if telegram_id:
@@ -316,7 +431,10 @@ def clear_db(
     db.query(InviteToken).delete()
     db.query(GroupMember).delete()
     db.query(Group).delete()
+    db.query(FamilyChild).delete()
     db.query(FamilyProfile).delete()
+    db.query(ProfileAlcohol).delete()
+    db.query(ProfilePhoto).delete()
     db.query(Profile).delete()
     db.query(Guest).delete()
     db.query(FamilyGroup).delete()
@@ -387,7 +505,8 @@ def get_notification_settings(
         raise HTTPException(403, "Forbidden")
     row = db.query(AdminSettings).filter(AdminSettings.admin_id == admin_id).one_or_none()
     enabled = False if not row else bool(row.system_notifications_enabled)
-    return {"admin_id": admin_id, "system_notifications_enabled": enabled}
+    window = AdminSettings.digest_window_seconds.default.arg if not row else row.digest_window_seconds
+    return {"admin_id": admin_id, "system_notifications_enabled": enabled, "digest_window_seconds": window}
 
 @router.post("/notification-settings")
 def set_notification_settings(
@@ -398,18 +517,28 @@ def set_notification_settings(
     if not x_internal_secret or x_internal_secret != settings.INTERNAL_SECRET:
         raise HTTPException(403, "Forbidden")
     admin_id = int(body.get("admin_id") or 0)
-    enabled = bool(body.get("system_notifications_enabled", True))
     if admin_id <= 0:
         raise HTTPException(400, "Missing admin_id")
     row = db.query(AdminSettings).filter(AdminSettings.admin_id == admin_id).one_or_none()
     if not row:
-        row = AdminSettings(admin_id=admin_id, system_notifications_enabled=enabled)
-        db.add(row)
-    else:
-        row.system_notifications_enabled = enabled
+        row = AdminSettings(admin_id=admin_id, system_notifications_enabled=False)
         db.add(row)
+    if "system_notifications_enabled" in body or "digest_window_seconds" not in body:
+        row.system_notifications_enabled = bool(body.get("system_notifications_enabled", True))
+    if "digest_window_seconds" in body:
+        try:
+            window = int(body["digest_window_seconds"])
+        except (TypeError, ValueError):
+            raise HTTPException(400, "Bad digest_window_seconds")
+        if window < 0:
+            raise HTTPException(400, "Bad digest_window_seconds")
+        row.digest_window_seconds = window
     db.commit()
-    return {"admin_id": admin_id, "system_notifications_enabled": enabled}
+    return {
+        "admin_id": admin_id,
+        "system_notifications_enabled": bool(row.system_notifications_enabled),
+        "digest_window_seconds": row.digest_window_seconds,
+    }
 
 def _get_app_setting(db: Session, key: str, default: bool) -> bool:
     row = db.query(AppSettings).filter(AppSettings.key == key).one_or_none()
@@ -477,6 +606,12 @@ def db_health(
     size_bytes = os.path.getsize(db_path) if exists else 0
     with engine.begin() as conn:
         tables = [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))]
+        pragmas = {}
+        query_plans = {}
+        if IS_SQLITE:
+            for name, _value in sqlite_pragmas():
+                pragmas[name] = conn.execute(text(f"PRAGMA {name}")).scalar()
+            query_plans = check_query_plans(conn)
     counts = {
         "guests": db.query(Guest).count(),
         "profiles": db.query(Profile).count(),
@@ -484,10 +619,15 @@ def db_health(
         "invite_tokens": db.query(InviteToken).count(),
         "family_profiles": db.query(FamilyProfile).count(),
     }
+    outbox = dict(db.query(NotificationOutbox.status, func.count()).group_by(NotificationOutbox.status).all())
     return {
         "path": db_path,
         "exists": exists,
         "size_bytes": size_bytes,
         "tables": tables,
         "counts": counts,
+        "outbox": outbox,
+        "pragmas": pragmas,
+        "query_plans": query_plans,
+        "full_scans": [name for name, r in query_plans.items() if not r["ok"]],
     }
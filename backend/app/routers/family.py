@@ -1,70 +1,76 @@
 from fastapi import APIRouter, Depends, Header, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import delete, select
 import secrets
 from datetime import datetime, timedelta
-import json
 import logging
-import httpx
 
-from ..db import get_db
-from ..models import Guest, Profile, FamilyGroup, InviteToken, FamilyProfile
+from ..db import get_db, get_async_db
+from ..models import Guest, Profile, FamilyGroup, InviteToken, FamilyProfile, FamilyChild, ChangeLog
 from ..config import settings
-from ..services.telegram_auth import verify_telegram_init_data, get_guest_from_invite
+from ..deps import Caller, get_current_guest, get_current_guest_async, get_optional_caller, load_guest
+from ..services.telegram_auth import issue_invite_token, is_signed_invite_token, verify_invite_token, upsert_guest
 from ..schemas import FamilyAcceptIn, FamilyInviteOut, FamilyStatusOut, FamilySaveIn, FamilyOut, FamilyInviteByUsernameIn, FamilyCheckUsernameIn, FamilyIncomingInviteOut, FamilyRemovePartnerIn
-from ..services.notifier import send_admin_message, send_user_message
+from ..services import idempotency
+from ..services.changes import FAMILY_LABELS
+from ..services.outbox import enqueue_admin_changes, enqueue_user_message
 from ..services.sheets_queue import enqueue_sheet_sync
+from ..services.username_cache import resolve_usernames
 
 router = APIRouter(prefix="/api/family", tags=["family"])
 legacy_router = APIRouter(tags=["family-legacy"])
 logger = logging.getLogger(__name__)
 
 
-def _guest_from_initdata(initdata: str | None, invite_token: str | None, db: Session) -> Guest:
-    if not initdata and invite_token:
-        return get_guest_from_invite(invite_token, db)
-    user = verify_telegram_init_data(initdata or "", settings.BOT_TOKEN)
-    tg_id = int(user["id"])
-    guest = db.query(Guest).filter(Guest.telegram_user_id == tg_id).one_or_none()
-    if not guest:
-        guest = Guest(
-            telegram_user_id=tg_id,
-            username=user.get("username"),
-            first_name=user.get("first_name"),
-            last_name=user.get("last_name"),
-        )
-        db.add(guest)
-        db.flush()
-        db.add(Profile(guest_id=guest.id))
-        db.commit()
-        db.refresh(guest)
-    return guest
-
-
 def _guest_from_internal(telegram_user_id: int, db: Session) -> Guest:
     guest = db.query(Guest).filter(Guest.telegram_user_id == telegram_user_id).one_or_none()
     if not guest:
-        guest = Guest(telegram_user_id=telegram_user_id)
-        db.add(guest)
-        db.flush()
-        db.add(Profile(guest_id=guest.id))
+        guest_id = upsert_guest(db, telegram_user_id)
         db.commit()
-        db.refresh(guest)
+        guest = db.get(Guest, guest_id)
     return guest
 
 
+def _create_invite(db: Session, guest: Guest, invitee_telegram_user_id: int | None = None) -> InviteToken:
+    expires_at = datetime.utcnow() + timedelta(days=settings.INVITE_TTL_DAYS)
+    invite = InviteToken(
+        # placeholder until the row id is known and the signed token can be built
+        token=secrets.token_urlsafe(16),
+        family_group_id=guest.family_group_id,
+        inviter_guest_id=guest.id,
+        invitee_telegram_user_id=invitee_telegram_user_id,
+        status="pending",
+        expires_at=expires_at,
+    )
+    db.add(invite)
+    db.flush()
+    invite.token = issue_invite_token(invite.family_group_id, guest.id, invite.id, expires_at)
+    db.commit()
+    return invite
+
+def _reject_bad_signed_invite(token: str) -> None:
+    # signed tokens: expired / forged ones are rejected without a DB lookup
+    if not is_signed_invite_token(token):
+        return
+    try:
+        verify_invite_token(token)
+    except ValueError as e:
+        if str(e) == "Invite expired":
+            raise HTTPException(400, "Invite expired")
+        raise HTTPException(404, "Invite not found")
+
 @router.post("/invite", response_model=FamilyInviteOut)
 def invite_family(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
     x_internal_secret: str | None = Header(default=None),
     telegram_user_id: int | None = None,
+    caller: Caller | None = Depends(get_optional_caller),
     db: Session = Depends(get_db),
 ):
     if x_internal_secret == settings.INTERNAL_SECRET and telegram_user_id:
         guest = _guest_from_internal(telegram_user_id, db)
-    elif x_tg_initdata or x_invite_token:
-        guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
+    elif caller:
+        guest = load_guest(db, caller)
     else:
         raise HTTPException(401, "Missing auth")
 
@@ -80,38 +86,30 @@ def invite_family(
         if member_count >= 2:
             raise HTTPException(409, "Family already has 2 adults")
 
-    token = secrets.token_urlsafe(16)
-    invite = InviteToken(
-        token=token,
-        family_group_id=guest.family_group_id,
-        inviter_guest_id=guest.id,
-        expires_at=datetime.utcnow() + timedelta(days=7),
-    )
-    db.add(invite)
-    db.commit()
+    invite = _create_invite(db, guest)
     try:
         enqueue_sheet_sync(db, guest.telegram_user_id, reason="family_save")
     except Exception:
         pass
-    return FamilyInviteOut(token=token)
+    return FamilyInviteOut(token=invite.token)
 
 
 @router.post("/accept")
 def accept_invite(
     body: FamilyAcceptIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
     x_internal_secret: str | None = Header(default=None),
     telegram_user_id: int | None = None,
+    caller: Caller | None = Depends(get_optional_caller),
     db: Session = Depends(get_db),
 ):
     if x_internal_secret == settings.INTERNAL_SECRET and telegram_user_id:
         guest = _guest_from_internal(telegram_user_id, db)
-    elif x_tg_initdata or x_invite_token:
-        guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
+    elif caller:
+        guest = load_guest(db, caller)
     else:
         raise HTTPException(401, "Missing auth")
 
+    _reject_bad_signed_invite(body.token)
     invite = db.query(InviteToken).filter(InviteToken.token == body.token).one_or_none()
     if not invite:
         raise HTTPException(404, "Invite not found")
@@ -130,11 +128,9 @@ def accept_invite(
 
 @router.get("/status", response_model=FamilyStatusOut)
 def family_status(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
+    guest: Guest = Depends(get_current_guest),
     db: Session = Depends(get_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     if not guest.family_group_id:
         return FamilyStatusOut(family_group_id=None, members=[])
 
@@ -155,22 +151,17 @@ def family_status(
 
 @router.get("/me", response_model=FamilyOut)
 def get_family(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
-    row = db.query(FamilyProfile).filter(FamilyProfile.guest_id == guest.id).one_or_none()
+    row = guest.family_profile
     if not row:
         return FamilyOut(with_partner=False, partner_name=None, children=[])
-    children = []
-    if row.children_json:
-        try:
-            children = json.loads(row.children_json)
-        except Exception:
-            children = []
+    children = [child.to_dict() for child in row.children]
     return FamilyOut(with_partner=row.with_partner, partner_name=row.partner_name, children=children)
 
+def _str_or_none(value) -> str | None:
+    return None if value is None else str(value)
+
 def _normalize_child_contact(value: str | None) -> str:
     if not value:
         return ""
@@ -183,79 +174,75 @@ def _normalize_child_contact(value: str | None) -> str:
         v = v.replace("t.me/", "", 1)
     return v.lstrip("@")
 
-async def _resolve_username(username: str) -> tuple[str | None, int | None]:
-    if not settings.BOT_TOKEN or not username:
-        return None, None
-    url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/getChat"
-    async with httpx.AsyncClient(timeout=6) as client:
-        try:
-            resp = await client.get(url, params={"chat_id": f"@{username}"})
-            data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
-            if not data.get("ok"):
-                return None, None
-            result = data.get("result") or {}
-            return result.get("username") or username, result.get("id")
-        except Exception as e:
-            logger.warning("resolve username failed: %s", str(e))
-            return None, None
-
 @router.post("/save", response_model=FamilyOut)
 async def save_family(
     body: FamilySaveIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: str | None = Header(default=None),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
-    row = db.query(FamilyProfile).filter(FamilyProfile.guest_id == guest.id).one_or_none()
+    row = guest.family_profile
     before = {
         "with_partner": bool(row.with_partner) if row else False,
         "partner_name": row.partner_name if row else None,
-        "children_count": len(json.loads(row.children_json)) if row and row.children_json else 0,
+        "children_count": len(row.children) if row else 0,
     }
-    children_input = body.children or []
+    children_input = [child for child in (body.children or []) if isinstance(child, dict)]
+    contacts = [_normalize_child_contact(child.get("child_contact") or child.get("contact")) for child in children_input]
+    resolved = await resolve_usernames(db, contacts)
+    # claimed after the getChat calls so no write lock is held across them; a retry
+    # finds its usernames cached
+    replay = await idempotency.claim(db, idempotency_key, guest.id, "family_save", body)
+    if replay:
+        return replay
+    # only contacts new to this family hear about it, once each
+    notified = {ch.telegram_user_id for ch in row.children if ch.telegram_user_id} if row else set()
     normalized_children = []
-    for child in children_input:
-        if not isinstance(child, dict):
-            continue
-        contact = _normalize_child_contact(child.get("child_contact") or child.get("contact"))
-        username = None
-        user_id = None
-        if contact:
-            username, user_id = await _resolve_username(contact)
-            if user_id:
-                try:
-                    await send_user_message(
-                        user_id,
-                        "Вас добавили в семейную группу приглашения на свадьбу. Подтверждение не требуется."
-                    )
-                except Exception:
-                    pass
+    for child, contact in zip(children_input, contacts):
+        username, user_id = resolved.get(contact, (None, None))
+        if user_id and user_id not in notified:
+            notified.add(user_id)
+            await db.run_sync(
+                enqueue_user_message,
+                user_id,
+                "Вас добавили в семейную группу приглашения на свадьбу. Подтверждение не требуется."
+            )
         normalized_child = {
-            "id": child.get("id"),
-            "name": child.get("name"),
-            "age": child.get("age"),
-            "note": child.get("note"),
+            "id": _str_or_none(child.get("id")),
+            "name": _str_or_none(child.get("name")),
+            "age": _str_or_none(child.get("age")),
+            "note": _str_or_none(child.get("note")),
             "child_contact": contact or None,
             "child_telegram_username": username or None,
             "child_telegram_user_id": user_id,
         }
         normalized_children.append(normalized_child)
-    children_json = json.dumps(normalized_children)
+    children = [
+        FamilyChild(
+            position=i,
+            client_id=ch["id"],
+            name=ch["name"],
+            age=ch["age"],
+            note=ch["note"],
+            contact=ch["child_contact"],
+            telegram_username=ch["child_telegram_username"],
+            telegram_user_id=ch["child_telegram_user_id"],
+        )
+        for i, ch in enumerate(normalized_children)
+    ]
     if not row:
         row = FamilyProfile(
             guest_id=guest.id,
             with_partner=body.with_partner,
             partner_name=body.partner_name,
-            children_json=children_json,
+            children=children,
         )
-        db.add(row)
+        guest.family_profile = row
     else:
         row.with_partner = body.with_partner
         row.partner_name = body.partner_name
-        row.children_json = children_json
+        row.children = children
         db.add(row)
-    db.commit()
     after = {
         "with_partner": bool(row.with_partner),
         "partner_name": row.partner_name,
@@ -263,23 +250,22 @@ async def save_family(
     }
     changes = []
     if before["with_partner"] != after["with_partner"]:
-        changes.append(("Пара", "Да" if before["with_partner"] else "Нет", "Да" if after["with_partner"] else "Нет"))
+        changes.append((FAMILY_LABELS["with_partner"], "Да" if before["with_partner"] else "Нет", "Да" if after["with_partner"] else "Нет"))
     if before["partner_name"] != after["partner_name"]:
-        changes.append(("Партнёр", before["partner_name"] or "—", after["partner_name"] or "—"))
+        changes.append((FAMILY_LABELS["partner_name"], before["partner_name"] or "—", after["partner_name"] or "—"))
     if before["children_count"] != after["children_count"]:
-        changes.append(("Дети (кол-во)", str(before["children_count"]), str(after["children_count"])))
+        changes.append((FAMILY_LABELS["children_count"], str(before["children_count"]), str(after["children_count"])))
+    for label, old, new in changes:
+        db.add(ChangeLog(guest_id=guest.id, field=label, old_value=old, new_value=new))
     if changes:
-        try:
-            name = guest.profile.full_name if guest.profile else ""
-            if not name:
-                name = f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
-            lines = [f"<b>Семья обновлена</b>", f"{name} (id {guest.id})", ""]
-            for label, old, new in changes:
-                lines.append(f"{label}: {old} → {new}")
-            await send_admin_message("\n".join(lines), category="system", db=db)
-        except Exception:
-            pass
-    return FamilyOut(with_partner=row.with_partner, partner_name=row.partner_name, children=normalized_children)
+        name = guest.profile.full_name if guest.profile else ""
+        if not name:
+            name = f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
+        await db.run_sync(enqueue_admin_changes, guest.id, name, changes)
+    out = FamilyOut(with_partner=row.with_partner, partner_name=row.partner_name, children=normalized_children)
+    await idempotency.remember(db, idempotency_key, guest.id, "family_save", out)
+    await db.commit()
+    return out
 
 def _normalize_username(username: str) -> str:
     value = (username or "").strip().lower()
@@ -299,16 +285,14 @@ def _webapp_family_link() -> str:
 @router.post("/check-username")
 def check_username(
     body: FamilyCheckUsernameIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
+    _guest: Guest = Depends(get_current_guest),
     db: Session = Depends(get_db),
 ):
-    _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     username = _normalize_username(body.username or "")
     if not username:
         raise HTTPException(400, "Missing username")
     rows = db.query(Guest, Profile).join(Profile, Profile.guest_id == Guest.id).filter(
-        Guest.username.ilike(username)
+        Guest.username_lc == username
     ).all()
     if not rows:
         return {"found": False}
@@ -321,21 +305,20 @@ def check_username(
 @router.post("/invite-by-username")
 async def invite_by_username(
     body: FamilyInviteByUsernameIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     username = _normalize_username(body.username or "")
     if not username:
         raise HTTPException(400, "Missing username")
 
     candidates = (
-        db.query(Guest, Profile)
-        .join(Profile, Profile.guest_id == Guest.id)
-        .filter(Guest.username.ilike(username))
-        .all()
-    )
+        await db.execute(
+            select(Guest, Profile)
+            .join(Profile, Profile.guest_id == Guest.id)
+            .where(Guest.username_lc == username)
+        )
+    ).all()
     if not candidates:
         raise HTTPException(404, "User not found")
     if len(candidates) > 1:
@@ -345,50 +328,37 @@ async def invite_by_username(
     if guest.family_group_id is None:
         group = FamilyGroup()
         db.add(group)
-        db.flush()
+        await db.flush()
         guest.family_group_id = group.id
         db.add(guest)
-        db.commit()
+        await db.commit()
 
-    token = secrets.token_urlsafe(16)
-    invite = InviteToken(
-        token=token,
-        family_group_id=guest.family_group_id,
-        inviter_guest_id=guest.id,
-        invitee_telegram_user_id=other_guest.telegram_user_id,
-        status="pending",
-        expires_at=datetime.utcnow() + timedelta(days=7),
-    )
-    db.add(invite)
-    db.commit()
+    invite = await db.run_sync(_create_invite, guest, invitee_telegram_user_id=other_guest.telegram_user_id)
 
     inviter_name = guest.profile.full_name if guest.profile else ""
     if not inviter_name:
         inviter_name = f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
     inviter_bd = guest.profile.birth_date.isoformat() if guest.profile and guest.profile.birth_date else "не указана"
     link = _webapp_family_link()
-    try:
-        await send_user_message(
-            other_guest.telegram_user_id,
-            (
-                "<b>Приглашение в семью</b>\n"
-                f"Пригласил(а): {inviter_name}\n"
-                f"Дата рождения: {inviter_bd}\n\n"
-                "Откройте мини‑приложение и перейдите в раздел «Семья».\n"
-                + (f"Ссылка: {link}" if link else "Откройте через меню бота → Открыть приложение → Семья.")
-            )
+    await db.run_sync(
+        enqueue_user_message,
+        other_guest.telegram_user_id,
+        (
+            "<b>Приглашение в семью</b>\n"
+            f"Пригласил(а): {inviter_name}\n"
+            f"Дата рождения: {inviter_bd}\n\n"
+            "Откройте мини‑приложение и перейдите в раздел «Семья».\n"
+            + (f"Ссылка: {link}" if link else "Откройте через меню бота → Открыть приложение → Семья.")
         )
-    except Exception:
-        pass
-    return {"ok": True, "token": token}
+    )
+    await db.commit()
+    return {"ok": True, "token": invite.token}
 
 @router.get("/invites/incoming", response_model=FamilyIncomingInviteOut | None)
 def incoming_invite(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
+    guest: Guest = Depends(get_current_guest),
     db: Session = Depends(get_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     invite = db.query(InviteToken).filter(
         InviteToken.invitee_telegram_user_id == guest.telegram_user_id,
         InviteToken.status == "pending"
@@ -409,12 +379,10 @@ def incoming_invite(
 @router.post("/invite/{token}/accept")
 async def accept_invite(
     token: str,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
-    invite = db.query(InviteToken).filter(InviteToken.token == token).one_or_none()
+    invite = (await db.execute(select(InviteToken).where(InviteToken.token == token))).scalar_one_or_none()
     if not invite:
         raise HTTPException(404, "Invite not found")
     if invite.status != "pending":
@@ -425,7 +393,7 @@ async def accept_invite(
         invite.status = "declined"
         invite.declined_at = datetime.utcnow()
         db.add(invite)
-        db.commit()
+        await db.commit()
         raise HTTPException(400, "Invite expired")
     if guest.family_group_id and guest.family_group_id != invite.family_group_id:
         raise HTTPException(409, "Already in another family")
@@ -435,14 +403,16 @@ async def accept_invite(
     invite.used_by_guest_id = guest.id
     db.add(guest)
     db.add(invite)
-    db.commit()
+    await db.commit()
 
-    inviter = db.query(Guest).filter(Guest.id == invite.inviter_guest_id).one_or_none()
+    inviter = await db.get(Guest, invite.inviter_guest_id)
     invitee_name = guest.profile.full_name if guest.profile else ""
     if not invitee_name:
         invitee_name = f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
     if inviter:
-        inviter_profile = db.query(Profile).filter(Profile.guest_id == inviter.id).one_or_none()
+        inviter_profile = (
+            await db.execute(select(Profile).where(Profile.guest_id == inviter.id))
+        ).scalar_one_or_none()
         if inviter_profile:
             inviter_profile.has_plus_one_requested = True
             inviter_profile.plus_one_partner_username = guest.username
@@ -451,18 +421,12 @@ async def accept_invite(
             guest.profile.has_plus_one_requested = True
             guest.profile.plus_one_partner_username = inviter.username
             db.add(guest.profile)
-        db.commit()
-        try:
-            await send_user_message(
-                inviter.telegram_user_id,
-                f"✅ Приглашение принято: {invitee_name}"
-            )
-        except Exception:
-            pass
+        await db.run_sync(enqueue_user_message, inviter.telegram_user_id, f"✅ Приглашение принято: {invitee_name}")
+        await db.commit()
     try:
-        enqueue_sheet_sync(db, guest.telegram_user_id, reason="family_accept")
+        await db.run_sync(enqueue_sheet_sync, guest.telegram_user_id, reason="family_accept")
         if inviter:
-            enqueue_sheet_sync(db, inviter.telegram_user_id, reason="family_accept")
+            await db.run_sync(enqueue_sheet_sync, inviter.telegram_user_id, reason="family_accept")
     except Exception:
         pass
     return {"ok": True, "family_group_id": guest.family_group_id}
@@ -470,12 +434,10 @@ async def accept_invite(
 @router.post("/invite/{token}/decline")
 async def decline_invite(
     token: str,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
-    invite = db.query(InviteToken).filter(InviteToken.token == token).one_or_none()
+    invite = (await db.execute(select(InviteToken).where(InviteToken.token == token))).scalar_one_or_none()
     if not invite:
         raise HTTPException(404, "Invite not found")
     if invite.status != "pending":
@@ -485,24 +447,18 @@ async def decline_invite(
     invite.status = "declined"
     invite.declined_at = datetime.utcnow()
     db.add(invite)
-    db.commit()
 
-    inviter = db.query(Guest).filter(Guest.id == invite.inviter_guest_id).one_or_none()
+    inviter = await db.get(Guest, invite.inviter_guest_id)
     invitee_name = guest.profile.full_name if guest.profile else ""
     if not invitee_name:
         invitee_name = f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
     if inviter:
-        try:
-            await send_user_message(
-                inviter.telegram_user_id,
-                f"❌ Приглашение отклонено: {invitee_name}"
-            )
-        except Exception:
-            pass
+        await db.run_sync(enqueue_user_message, inviter.telegram_user_id, f"❌ Приглашение отклонено: {invitee_name}")
+    await db.commit()
     try:
-        enqueue_sheet_sync(db, guest.telegram_user_id, reason="family_decline")
+        await db.run_sync(enqueue_sheet_sync, guest.telegram_user_id, reason="family_decline")
         if inviter:
-            enqueue_sheet_sync(db, inviter.telegram_user_id, reason="family_decline")
+            await db.run_sync(enqueue_sheet_sync, inviter.telegram_user_id, reason="family_decline")
     except Exception:
         pass
     return {"ok": True}
@@ -510,11 +466,9 @@ async def decline_invite(
 @router.post("/invite/{token}/cancel")
 def cancel_invite(
     token: str,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
+    guest: Guest = Depends(get_current_guest),
     db: Session = Depends(get_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     invite = db.query(InviteToken).filter(InviteToken.token == token).one_or_none()
     if not invite:
         raise HTTPException(404, "Invite not found")
@@ -531,56 +485,59 @@ def cancel_invite(
 @router.post("/invite-by-username/cancel")
 async def cancel_invite_by_username(
     body: FamilyInviteByUsernameIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     username = _normalize_username(body.username or "")
     if not username:
         raise HTTPException(400, "Missing username")
     invite = (
-        db.query(InviteToken, Guest)
-        .join(Guest, Guest.telegram_user_id == InviteToken.invitee_telegram_user_id)
-        .filter(
-            InviteToken.inviter_guest_id == guest.id,
-            InviteToken.status == "pending",
-            Guest.username.ilike(username),
+        await db.execute(
+            select(InviteToken, Guest)
+            .join(Guest, Guest.telegram_user_id == InviteToken.invitee_telegram_user_id)
+            .where(
+                InviteToken.inviter_guest_id == guest.id,
+                InviteToken.status == "pending",
+                Guest.username_lc == username,
+            )
+            .order_by(InviteToken.created_at.desc())
+            .limit(1)
         )
-        .order_by(InviteToken.created_at.desc())
-        .first()
-    )
+    ).first()
     if not invite:
         raise HTTPException(404, "Invite not found")
     token_row, invitee = invite
     token_row.status = "canceled"
     token_row.declined_at = datetime.utcnow()
     db.add(token_row)
-    db.commit()
-    try:
-        await send_user_message(
-            invitee.telegram_user_id,
-            "Приглашение в семью отменено отправителем."
-        )
-    except Exception:
-        pass
+    await db.run_sync(enqueue_user_message, invitee.telegram_user_id, "Приглашение в семью отменено отправителем.")
+    await db.commit()
     return {"ok": True}
 
+def _drop_family_group(db: Session, group_id: int) -> None:
+    # with foreign_keys=ON nothing may still reference the group when it is deleted
+    db.flush()
+    db.query(Guest).filter(Guest.family_group_id == group_id).update({Guest.family_group_id: None})
+    db.query(InviteToken).filter(InviteToken.family_group_id == group_id).delete()
+    db.query(FamilyGroup).filter(FamilyGroup.id == group_id).delete()
+
 @router.post("/remove-partner")
 async def remove_partner(
     body: FamilyRemovePartnerIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     if not guest.family_group_id:
         return {"ok": True}
-    members = db.query(Guest).filter(Guest.family_group_id == guest.family_group_id).all()
+    members = (
+        await db.execute(
+            select(Guest).options(selectinload(Guest.profile)).where(Guest.family_group_id == guest.family_group_id)
+        )
+    ).scalars().all()
     if len(members) <= 1:
         guest.family_group_id = None
         db.add(guest)
-        db.commit()
+        await db.commit()
         return {"ok": True}
     partner = None
     if body.partner_telegram_user_id:
@@ -608,36 +565,23 @@ async def remove_partner(
         db.add(partner.profile)
     db.add(guest)
     db.add(partner)
-    # cancel pending invites for this group
-    db.query(InviteToken).filter(
-        InviteToken.family_group_id == group_id,
-        InviteToken.status == "pending"
-    ).delete()
-    # remove group if empty or one member
-    db.query(FamilyGroup).filter(FamilyGroup.id == group_id).delete()
-    db.commit()
+    # cancel invites and remove the group
+    await db.run_sync(_drop_family_group, group_id)
+    await db.run_sync(enqueue_user_message, partner.telegram_user_id, "Партнёр разъединил семью. Теперь вы не связаны.")
+    await db.commit()
 
     try:
-        await send_user_message(
-            partner.telegram_user_id,
-            "Партнёр разъединил семью. Теперь вы не связаны."
-        )
-    except Exception:
-        pass
-    try:
-        enqueue_sheet_sync(db, guest.telegram_user_id, reason="family_remove")
-        enqueue_sheet_sync(db, partner.telegram_user_id, reason="family_remove")
+        await db.run_sync(enqueue_sheet_sync, guest.telegram_user_id, reason="family_remove")
+        await db.run_sync(enqueue_sheet_sync, partner.telegram_user_id, reason="family_remove")
     except Exception:
         pass
     return {"ok": True}
 
 @router.post("/leave")
 async def leave_family(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     if not guest.family_group_id:
         return {"ok": True, "family_group_id": None}
     group_id = guest.family_group_id
@@ -648,14 +592,20 @@ async def leave_family(
         guest.profile.has_plus_one_requested = False
         db.add(guest.profile)
     db.add(guest)
-    db.commit()
+    await db.commit()
     # cancel pending invites for this group
-    db.query(InviteToken).filter(
-        InviteToken.family_group_id == group_id,
-        InviteToken.status == "pending"
-    ).delete()
+    await db.execute(
+        delete(InviteToken).where(
+            InviteToken.family_group_id == group_id,
+            InviteToken.status == "pending",
+        )
+    )
     # check remaining members
-    remaining = db.query(Guest).filter(Guest.family_group_id == group_id).all()
+    remaining = (
+        await db.execute(
+            select(Guest).options(selectinload(Guest.profile)).where(Guest.family_group_id == group_id)
+        )
+    ).scalars().all()
     if len(remaining) <= 1:
         for g in remaining:
             g.family_group_id = None
@@ -664,37 +614,30 @@ async def leave_family(
                 g.profile.has_plus_one_requested = False
                 db.add(g.profile)
             db.add(g)
-        db.query(FamilyGroup).filter(FamilyGroup.id == group_id).delete()
-    db.commit()
+        await db.run_sync(_drop_family_group, group_id)
     # notify remaining member if exists
     if len(remaining) == 1:
-        other = remaining[0]
-        try:
-            await send_user_message(
-                other.telegram_user_id,
-                "Партнёр разъединил семью. Теперь вы не связаны."
-            )
-        except Exception:
-            pass
+        await db.run_sync(enqueue_user_message, remaining[0].telegram_user_id, "Партнёр разъединил семью. Теперь вы не связаны.")
+    await db.commit()
     try:
-        enqueue_sheet_sync(db, guest.telegram_user_id, reason="family_leave")
+        await db.run_sync(enqueue_sheet_sync, guest.telegram_user_id, reason="family_leave")
     except Exception:
         pass
     return {"ok": True, "family_group_id": None}
 
 # legacy alias
 @router.post("/invite-by-name")
-def invite_by_name_legacy(
+async def invite_by_name_legacy(
     body: dict,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
     username = body.get("username") or body.get("full_name") or ""
-    return invite_by_username(FamilyInviteByUsernameIn(username=username), x_tg_initdata, x_invite_token, db)
+    return await invite_by_username(FamilyInviteByUsernameIn(username=username), guest, db)
 
 @router.get("/invite/{token}")
 def invite_info(token: str, db: Session = Depends(get_db)):
+    _reject_bad_signed_invite(token)
     invite = db.query(InviteToken).filter(InviteToken.token == token).one_or_none()
     if not invite:
         raise HTTPException(404, "Invite not found")
@@ -1,64 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, Header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import date, datetime
 import logging
 
-from ..db import get_db
-from ..models import Guest, Profile, ChangeLog
+from ..db import get_db, get_async_db
+from ..models import Guest, Profile, ProfileAlcohol, ProfilePhoto, ChangeLog
 from ..schemas import ProfileIn, ProfileOut, ExtraIn, PartnerLinkIn, ProfileExistsOut
 from ..config import settings
-from ..services.telegram_auth import verify_telegram_init_data, get_guest_from_invite
-from ..services.notifier import send_admin_message, send_user_message
+from ..deps import get_current_guest, get_current_guest_async
+from ..services.telegram_auth import verify_telegram_init_data
+from ..services import idempotency
+from ..services.changes import EXTRA_LABELS, PARTNER_LABELS, PROFILE_LABELS
+from ..services.outbox import enqueue_admin_changes, enqueue_user_message
 from ..services.sheets_queue import enqueue_sheet_sync
 
 router = APIRouter(prefix="/api", tags=["profile"])
 legacy_router = APIRouter(tags=["profile-legacy"])
 logger = logging.getLogger(__name__)
 
-def _guest_from_initdata(initdata: str | None, invite_token: str | None, db: Session) -> Guest:
-    try:
-        if initdata:
-            user = verify_telegram_init_data(initdata, settings.BOT_TOKEN)
-        elif invite_token:
-            return get_guest_from_invite(invite_token, db)
-        else:
-            raise ValueError("Missing initData")
-    except ValueError as e:
-        if invite_token:
-            try:
-                return get_guest_from_invite(invite_token, db)
-            except ValueError as e2:
-                logger.warning("profile auth failed: %s (len=%s)", str(e2), len(initdata or ""))
-                raise HTTPException(401, str(e2))
-        logger.warning("profile auth failed: %s (len=%s)", str(e), len(initdata or ""))
-        raise HTTPException(401, str(e))
-    tg_id = int(user["id"])
-    guest = db.query(Guest).filter(Guest.telegram_user_id == tg_id).one_or_none()
-    if not guest:
-        guest = Guest(
-            telegram_user_id=tg_id,
-            username=user.get("username"),
-            first_name=user.get("first_name"),
-            last_name=user.get("last_name"),
-        )
-        db.add(guest)
-        db.flush()
-        db.add(Profile(guest_id=guest.id))
-        db.commit()
-        db.refresh(guest)
-    elif not guest.profile:
-        db.add(Profile(guest_id=guest.id))
-        db.commit()
-        db.refresh(guest)
-    return guest
-
-def _split_csv(v: str | None) -> list[str]:
-    if not v:
-        return []
-    out = [x for x in (s.strip() for s in v.split(",")) if x]
-    return ["Не пью алкоголь" if x == "Не пью" else x for x in out]
-
-def _join_csv(v: list[str]) -> str:
+def _normalize_items(v: list[str]) -> list[str]:
     normalized = []
     for item in v:
         value = item.strip()
@@ -67,7 +29,7 @@ def _join_csv(v: list[str]) -> str:
         if value == "Не пью":
             value = "Не пью алкоголь"
         normalized.append(value)
-    return ",".join(normalized)
+    return normalized
 
 def _fmt_value(value) -> str:
     if value is None or value == "":
@@ -87,13 +49,7 @@ def _diff(before: dict, after: dict, labels: dict) -> list[tuple[str, str, str]]
             changes.append((label, _fmt_value(before.get(key)), _fmt_value(after.get(key))))
     return changes
 
-@router.get("/profile", response_model=ProfileOut)
-def get_profile(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
-):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
+def _profile_out(guest: Guest) -> ProfileOut:
     p = guest.profile
     return ProfileOut(
         rsvp_status=p.rsvp_status,
@@ -108,17 +64,21 @@ def get_profile(
         plus_one_partner_username=p.plus_one_partner_username,
         food_pref=p.food_pref,
         food_allergies=p.food_allergies,
-        alcohol_prefs=_split_csv(p.alcohol_prefs_csv),
+        alcohol_prefs=p.alcohol_prefs,
         partner_guest_id=p.partner_guest_id,
         partner_pending_full_name=p.partner_pending_full_name,
         partner_pending_birth_date=p.partner_pending_birth_date,
-        photos=_split_csv(p.photos_csv),
+        photos=p.photo_ids,
         extra_known_since=p.extra_known_since,
         extra_memory=p.extra_memory,
         extra_fact=p.extra_fact,
         welcome_seen_at=p.welcome_seen_at.isoformat() if p.welcome_seen_at else None,
     )
 
+@router.get("/profile", response_model=ProfileOut)
+def get_profile(guest: Guest = Depends(get_current_guest)):
+    return _profile_out(guest)
+
 @router.get("/profile/exists", response_model=ProfileExistsOut)
 def profile_exists(
     x_tg_initdata: str | None = Header(default=None),
@@ -140,11 +100,13 @@ def profile_exists(
 @router.post("/profile", response_model=ProfileOut)
 async def upsert_profile(
     body: ProfileIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: str | None = Header(default=None),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
+    replay = await idempotency.claim(db, idempotency_key, guest.id, "profile", body)
+    if replay:
+        return replay
     p: Profile = guest.profile
 
     before = {
@@ -156,7 +118,7 @@ async def upsert_profile(
         "is_relative": p.is_relative,
         "food_pref": p.food_pref,
         "food_allergies": p.food_allergies,
-        "alcohol_prefs": _split_csv(p.alcohol_prefs_csv),
+        "alcohol_prefs": p.alcohol_prefs,
         "phone": guest.phone,
         "has_plus_one_requested": p.has_plus_one_requested,
     }
@@ -181,8 +143,10 @@ async def upsert_profile(
     # phone on Guest
     guest.phone = body.phone
 
-    # alcohol
-    p.alcohol_prefs_csv = _join_csv(body.alcohol_prefs)
+    # alcohol: rewrite the child rows only when the list changed
+    alcohol_prefs = _normalize_items(body.alcohol_prefs)
+    if alcohol_prefs != p.alcohol_prefs:
+        p.alcohol = [ProfileAlcohol(position=i, value=v) for i, v in enumerate(alcohol_prefs)]
 
     db.add(guest)
     db.add(p)
@@ -195,69 +159,44 @@ async def upsert_profile(
         "is_relative": p.is_relative,
         "food_pref": p.food_pref,
         "food_allergies": p.food_allergies,
-        "alcohol_prefs": _split_csv(p.alcohol_prefs_csv),
+        "alcohol_prefs": p.alcohol_prefs,
         "phone": guest.phone,
         "has_plus_one_requested": p.has_plus_one_requested,
     }
-    labels = {
-        "rsvp_status": "RSVP",
-        "full_name": "ФИО",
-        "birth_date": "Дата рождения",
-        "gender": "Пол",
-        "side": "Сторона",
-        "is_relative": "Родственник",
-        "food_pref": "Еда",
-        "food_allergies": "Аллергии",
-        "alcohol_prefs": "Алкоголь",
-        "phone": "Телефон",
-        "has_plus_one_requested": "+1",
-    }
-    changes = _diff(before, after, labels)
+    changes = _diff(before, after, PROFILE_LABELS)
     for label, old, new in changes:
         db.add(ChangeLog(guest_id=guest.id, field=label, old_value=old, new_value=new))
-    db.commit()
+
+    # notifications go to the outbox in the same transaction as the change
+    name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
+    # Send +1 invite reminder once per save when enabled
+    if before.get("has_plus_one_requested") is False and p.has_plus_one_requested:
+        msg = (
+            f"{name} приглашает вас пойти с ним/ней на свадьбу Капитоновых 💍\n"
+            f"Дата: 25.07.2026\n"
+            f"Откройте приглашение и заполните анкету: https://t.me/kapa_vedding_bot/welcome_to_wedding"
+        )
+        await db.run_sync(enqueue_user_message, guest.telegram_user_id, msg)
+        p.plus_one_invite_sent_at = datetime.utcnow()
+    if changes:
+        await db.run_sync(enqueue_admin_changes, guest.id, name, changes)
+    out = _profile_out(guest)
+    await idempotency.remember(db, idempotency_key, guest.id, "profile", out)
+    await db.commit()
 
     # enqueue sheet sync (non-blocking)
     try:
-        enqueue_sheet_sync(db, guest.telegram_user_id, reason="profile_save")
+        await db.run_sync(enqueue_sheet_sync, guest.telegram_user_id, reason="profile_save")
     except Exception:
         pass
 
-    # Send +1 invite reminder once per save when enabled
-    if before.get("has_plus_one_requested") is False and p.has_plus_one_requested:
-        try:
-            name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
-            msg = (
-                f"{name} приглашает вас пойти с ним/ней на свадьбу Капитоновых 💍\n"
-                f"Дата: 25.07.2026\n"
-                f"Откройте приглашение и заполните анкету: https://t.me/kapa_vedding_bot/welcome_to_wedding"
-            )
-            await send_user_message(guest.telegram_user_id, msg)
-            p.plus_one_invite_sent_at = datetime.utcnow()
-            db.add(p)
-            db.commit()
-        except Exception:
-            pass
-
-    if changes:
-        try:
-            name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
-            lines = [f"<b>Анкета обновлена</b>", f"{name} (id {guest.id})", ""]
-            for label, old, new in changes:
-                lines.append(f"{label}: {old} → {new}")
-            await send_admin_message("\n".join(lines), category="system", db=db)
-        except Exception:
-            pass
-
-    return get_profile(x_tg_initdata, x_invite_token, db)
+    return out
 
 @router.post("/profile/welcome-seen")
 def mark_welcome_seen(
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
+    guest: Guest = Depends(get_current_guest),
     db: Session = Depends(get_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     p: Profile = guest.profile
     p.welcome_seen_at = datetime.utcnow()
     db.add(p)
@@ -266,18 +205,20 @@ def mark_welcome_seen(
 @router.post("/extra", response_model=ProfileOut)
 async def save_extra(
     body: ExtraIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
+    idempotency_key: str | None = Header(default=None),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
+    replay = await idempotency.claim(db, idempotency_key, guest.id, "extra", body)
+    if replay:
+        return replay
     p: Profile = guest.profile
 
     before = {
         "extra_known_since": p.extra_known_since,
         "extra_memory": p.extra_memory,
         "extra_fact": p.extra_fact,
-        "photos": _split_csv(p.photos_csv),
+        "photos": p.photo_ids,
     }
 
     for field, value in [
@@ -288,36 +229,27 @@ async def save_extra(
         setattr(p, field, value)
 
     # photos max 5
-    photos = body.photos[:5]
-    p.photos_csv = _join_csv(photos)
+    photos = _normalize_items(body.photos[:5])
+    if photos != p.photo_ids:
+        p.photos = [ProfilePhoto(position=i, file_id=v) for i, v in enumerate(photos)]
 
     db.add(p)
     after = {
         "extra_known_since": p.extra_known_since,
         "extra_memory": p.extra_memory,
         "extra_fact": p.extra_fact,
-        "photos": _split_csv(p.photos_csv),
-    }
-    labels = {
-        "extra_known_since": "Кого знаете ближе",
-        "extra_memory": "Воспоминание",
-        "extra_fact": "Факт",
-        "photos": "Фото",
+        "photos": p.photo_ids,
     }
-    changes = _diff(before, after, labels)
+    changes = _diff(before, after, EXTRA_LABELS)
     for label, old, new in changes:
         db.add(ChangeLog(guest_id=guest.id, field=label, old_value=old, new_value=new))
-    db.commit()
     if changes:
-        try:
-            name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
-            lines = [f"<b>Доп. информация обновлена</b>", f"{name} (id {guest.id})", ""]
-            for label, old, new in changes:
-                lines.append(f"{label}: {old} → {new}")
-            await send_admin_message("\n".join(lines), category="system", db=db)
-        except Exception:
-            pass
-    return get_profile(x_tg_initdata, x_invite_token, db)
+        name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
+        await db.run_sync(enqueue_admin_changes, guest.id, name, changes)
+    out = _profile_out(guest)
+    await idempotency.remember(db, idempotency_key, guest.id, "extra", out)
+    await db.commit()
+    return out
 
 # Legacy routes (no /api prefix) for cached clients
 legacy_router.add_api_route("/profile", get_profile, methods=["GET"], response_model=ProfileOut)
@@ -329,20 +261,19 @@ legacy_router.add_api_route("/extra", save_extra, methods=["POST"], response_mod
 @router.post("/partner/link", response_model=ProfileOut)
 async def link_partner(
     body: PartnerLinkIn,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    guest: Guest = Depends(get_current_guest_async),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    guest = _guest_from_initdata(x_tg_initdata, x_invite_token, db)
     p: Profile = guest.profile
 
     # search by exact full_name + birth_date
     candidate = (
-        db.query(Profile)
-        .filter(Profile.full_name == body.full_name)
-        .filter(Profile.birth_date == body.birth_date)
-        .one_or_none()
-    )
+        await db.execute(
+            select(Profile)
+            .where(Profile.full_name == body.full_name)
+            .where(Profile.birth_date == body.birth_date)
+        )
+    ).scalar_one_or_none()
 
     before = {
         "partner_guest_id": p.partner_guest_id,
@@ -371,22 +302,11 @@ async def link_partner(
         "partner_pending_full_name": p.partner_pending_full_name,
         "partner_pending_birth_date": p.partner_pending_birth_date,
     }
-    labels = {
-        "partner_guest_id": "Партнёр (ID)",
-        "partner_pending_full_name": "Партнёр (ожид.)",
-        "partner_pending_birth_date": "ДР партнёра (ожид.)",
-    }
-    changes = _diff(before, after, labels)
+    changes = _diff(before, after, PARTNER_LABELS)
     for label, old, new in changes:
         db.add(ChangeLog(guest_id=guest.id, field=label, old_value=old, new_value=new))
-    db.commit()
     if changes:
-        try:
-            name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
-            lines = [f"<b>Партнёр обновлён</b>", f"{name} (id {guest.id})", ""]
-            for label, old, new in changes:
-                lines.append(f"{label}: {old} → {new}")
-            await send_admin_message("\n".join(lines), category="system", db=db)
-        except Exception:
-            pass
-    return get_profile(x_tg_initdata, x_invite_token, db)
+        name = p.full_name or f"{guest.first_name or ''} {guest.last_name or ''}".strip() or "Гость"
+        await db.run_sync(enqueue_admin_changes, guest.id, name, changes)
+    await db.commit()
+    return _profile_out(guest)
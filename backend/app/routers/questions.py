@@ -1,12 +1,11 @@
-from fastapi import APIRouter, Header, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends
 import logging
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..config import settings
-from ..services.telegram_auth import verify_telegram_init_data, get_guest_from_invite
-from ..services.notifier import send_admin_message
-from ..db import get_db
+from ..deps import Caller, get_caller, load_guest_async
+from ..services.outbox import enqueue_admin_message
+from ..db import get_async_db
 
 router = APIRouter(prefix="/api/questions", tags=["questions"])
 logger = logging.getLogger(__name__)
@@ -25,30 +24,18 @@ def _build_sender_link(user: dict) -> str:
 @router.post("")
 async def send_question(
     body: dict,
-    x_tg_initdata: str | None = Header(default=None),
-    x_invite_token: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    caller: Caller = Depends(get_caller),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user: dict | None = None
-    if x_tg_initdata:
-        try:
-            user = verify_telegram_init_data(x_tg_initdata, settings.BOT_TOKEN)
-        except ValueError as e:
-            logger.warning("questions: invalid initData (%s)", str(e))
-            raise HTTPException(401, str(e))
-    elif x_invite_token:
-        try:
-            guest = get_guest_from_invite(x_invite_token, db)
-            name = guest.first_name or ""
-            if guest.last_name:
-                name = f"{name} {guest.last_name}".strip()
-            user = {"id": guest.telegram_user_id, "first_name": name or "Гость"}
-        except Exception:
-            logger.warning("questions: invalid invite token")
-            raise HTTPException(401, "Invalid invite token")
-    if not user:
-        logger.warning("questions: missing initData")
-        raise HTTPException(401, "Missing initData")
+    user = caller.user
+    if user is None:
+        guest = await load_guest_async(db, caller)
+        user = {
+            "id": guest.telegram_user_id,
+            "first_name": guest.first_name,
+            "last_name": guest.last_name,
+            "username": guest.username,
+        }
     text = (body.get("text") or "").strip()
     if not text:
         logger.warning("questions: empty text")
@@ -71,8 +58,10 @@ async def send_question(
         f"ID: {user_id}{link_part}"
     )
 
-    sent = await send_admin_message(message, category="question", db=db)
-    if not sent:
+    results = await db.run_sync(enqueue_admin_message, message, "question")
+    await db.commit()
+    logger.info("questions: admin delivery %s", results)
+    if not results:
         logger.error("questions: notify failed")
         raise HTTPException(500, "Notify failed")
 
@@ -10,6 +10,8 @@ class MeOut(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     username: Optional[str] = None
+    session_token: Optional[str] = None
+    session_expires_at: Optional[int] = None
 
 class ProfileIn(BaseModel):
     rsvp_status: str = Field(pattern="^(yes|no|maybe)$")
@@ -101,10 +103,20 @@ class FamilySaveIn(BaseModel):
     partner_name: Optional[str] = None
     children: List[dict] = []
 
+class FamilyChildOut(BaseModel):
+    # the WebApp form keeps id and age as strings, whatever the client sent
+    id: Optional[str] = None
+    name: Optional[str] = None
+    age: Optional[str] = None
+    note: Optional[str] = None
+    child_contact: Optional[str] = None
+    child_telegram_username: Optional[str] = None
+    child_telegram_user_id: Optional[int] = None
+
 class FamilyOut(BaseModel):
     with_partner: bool = False
     partner_name: Optional[str] = None
-    children: List[dict] = []
+    children: List[FamilyChildOut] = []
 
 class FamilyInviteByUsernameIn(BaseModel):
     username: str
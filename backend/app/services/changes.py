@@ -0,0 +1,65 @@
+"""
+Labels for the ChangeLog and the admin notifications about a guest's edits.
+
+ChangeLog.field holds the label, so a digest merged from several saves can tell
+which form each change came from and pick its header from SECTIONS.
+"""
+
+PROFILE_LABELS = {
+    "rsvp_status": "RSVP",
+    "full_name": "ФИО",
+    "birth_date": "Дата рождения",
+    "gender": "Пол",
+    "side": "Сторона",
+    "is_relative": "Родственник",
+    "food_pref": "Еда",
+    "food_allergies": "Аллергии",
+    "alcohol_prefs": "Алкоголь",
+    "phone": "Телефон",
+    "has_plus_one_requested": "+1",
+}
+
+EXTRA_LABELS = {
+    "extra_known_since": "Кого знаете ближе",
+    "extra_memory": "Воспоминание",
+    "extra_fact": "Факт",
+    "photos": "Фото",
+}
+
+PARTNER_LABELS = {
+    "partner_guest_id": "Партнёр (ID)",
+    "partner_pending_full_name": "Партнёр (ожид.)",
+    "partner_pending_birth_date": "ДР партнёра (ожид.)",
+}
+
+FAMILY_LABELS = {
+    "with_partner": "Пара",
+    "partner_name": "Партнёр",
+    "children_count": "Дети (кол-во)",
+}
+
+# header, labels; in the order a mixed digest lists them
+SECTIONS = [
+    ("Анкета обновлена", PROFILE_LABELS),
+    ("Доп. информация обновлена", EXTRA_LABELS),
+    ("Партнёр обновлён", PARTNER_LABELS),
+    ("Семья обновлена", FAMILY_LABELS),
+]
+
+def render_changes(name: str, guest_id: int, changes: list[tuple[str, str, str]]) -> str:
+    """
+    Admin message for (label, old, new) changes. The header names every form the
+    changes came from, so a digest of a profile and a family save says both.
+    """
+    headers, ordered = [], []
+    for header, labels in SECTIONS:
+        section = [c for c in changes if c[0] in labels.values()]
+        if section:
+            headers.append(header)
+            ordered += section
+    # labels no form uses any more (older ChangeLog rows) go last
+    ordered += [c for c in changes if c not in ordered]
+    lines = [f"<b>{', '.join(headers) or SECTIONS[0][0]}</b>", f"{name} (id {guest_id})", ""]
+    for label, old, new in ordered:
+        lines.append(f"{label}: {old} → {new}")
+    return "\n".join(lines)
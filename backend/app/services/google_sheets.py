@@ -1,9 +1,14 @@
+import hashlib
+import json
 import logging
+import re
+import time
 from datetime import datetime
 from typing import Any
 
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 from ..config import settings
 
@@ -34,29 +39,70 @@ HEADERS = [
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
+COLUMN_WIDTHS = [110, 140, 200, 140, 100, 100, 140, 120, 130, 150, 220, 220, 180, 140, 220, 160, 160]
+HEADER_COLOR = {"red": 0.95, "green": 0.92, "blue": 0.88}
+BAND_COLORS = ({"red": 0.98, "green": 0.96, "blue": 0.94}, {"red": 0.99, "green": 0.98, "blue": 0.96})
+
+# per worker process: the client, the sheet's id and the layout last applied to it
+_service = None
+_sheet_id: int | None = None
+_formatted_checksum: str | None = None
+
 def _get_service():
-    path = settings.GOOGLE_SA_JSON_PATH
-    if not path:
-        raise RuntimeError("GOOGLE_SA_JSON_PATH not set")
-    creds = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
-    return build("sheets", "v4", credentials=creds, cache_discovery=False)
+    """
+    Built once per process. The credentials refresh their access token on their
+    own (google-auth's authorized http), so the client can live as long as the worker.
+    """
+    global _service
+    if _service is None:
+        path = settings.GOOGLE_SA_JSON_PATH
+        if not path:
+            raise RuntimeError("GOOGLE_SA_JSON_PATH not set")
+        creds = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
+        _service = build("sheets", "v4", credentials=creds, cache_discovery=False)
+    return _service
 
 def _sheet_meta(service) -> tuple[int, bool]:
+    global _sheet_id
     meta = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
     for sheet in meta.get("sheets", []):
         props = sheet.get("properties", {})
         if props.get("title") == SHEET_NAME:
             sheet_id = int(props.get("sheetId"))
             banded = bool(sheet.get("bandedRanges"))
+            _sheet_id = sheet_id
             return sheet_id, banded
     raise RuntimeError("Sheet 'Guest TG' not found")
 
-def ensure_formatting(service) -> None:
+def _get_sheet_id(service) -> int:
+    return _sheet_id if _sheet_id is not None else _sheet_meta(service)[0]
+
+def _layout_checksum() -> str:
+    layout = [SHEET_NAME, HEADERS, COLUMN_WIDTHS, HEADER_COLOR, BAND_COLORS]
+    return hashlib.sha256(json.dumps(layout, sort_keys=True).encode()).hexdigest()[:16]
+
+def ensure_formatting_once(service) -> None:
+    """
+    ensure_formatting on the first job of the process, and again only after the
+    layout changed or the header row was found edited (RowIndex.rebuild).
+    """
+    global _formatted_checksum
+    checksum = _layout_checksum()
+    if _formatted_checksum == checksum:
+        return
+    if ensure_formatting(service):
+        _formatted_checksum = checksum
+
+def _header_changed() -> None:
+    global _formatted_checksum
+    _formatted_checksum = None
+
+def ensure_formatting(service) -> bool:
     try:
         sheet_id, has_banding = _sheet_meta(service)
     except Exception as e:
         logger.warning("sheets: cannot get sheet id: %s", e)
-        return
+        return False
 
     # Ensure header row
     service.spreadsheets().values().update(
@@ -83,7 +129,7 @@ def ensure_formatting(service) -> None:
             "range": {"sheetId": sheet_id, "startRowIndex": 0, "endRowIndex": 1},
             "cell": {
                 "userEnteredFormat": {
-                    "backgroundColor": {"red": 0.95, "green": 0.92, "blue": 0.88},
+                    "backgroundColor": HEADER_COLOR,
                     "horizontalAlignment": "CENTER",
                     "textFormat": {"bold": True},
                     "wrapStrategy": "WRAP",
@@ -93,8 +139,7 @@ def ensure_formatting(service) -> None:
         }
     })
     # Column widths
-    widths = [110, 140, 200, 140, 100, 100, 140, 120, 130, 150, 220, 220, 180, 140, 220, 160, 160]
-    for idx, w in enumerate(widths):
+    for idx, w in enumerate(COLUMN_WIDTHS):
         requests.append({
             "updateDimensionProperties": {
                 "range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": idx, "endIndex": idx + 1},
@@ -109,8 +154,8 @@ def ensure_formatting(service) -> None:
                 "bandedRange": {
                     "range": {"sheetId": sheet_id, "startRowIndex": 0},
                     "rowProperties": {
-                        "firstBandColor": {"red": 0.98, "green": 0.96, "blue": 0.94},
-                        "secondBandColor": {"red": 0.99, "green": 0.98, "blue": 0.96},
+                        "firstBandColor": BAND_COLORS[0],
+                        "secondBandColor": BAND_COLORS[1],
                     },
                 }
             }
@@ -126,73 +171,222 @@ def ensure_formatting(service) -> None:
         spreadsheetId=SPREADSHEET_ID,
         body={"requests": requests},
     ).execute()
+    return True
 
-def _read_rows(service) -> list[list[str]]:
-    res = service.spreadsheets().values().get(
-        spreadsheetId=SPREADSHEET_ID,
-        range=f"{SHEET_NAME}!A2:Q",
-    ).execute()
-    return res.get("values", []) or []
+class RowIndex:
+    """
+    telegram_id → sheet row number, built from one read of column A and kept
+    in step with our own appends and deletes. Rebuilt every
+    SHEETS_ROW_INDEX_TTL_SECONDS (to pick up manual edits) and whenever the
+    sheet disagrees with it.
 
-def delete_row_by_telegram_id(service, telegram_id: int) -> bool:
-    rows = _read_rows(service)
-    target_row_idx = None
-    for i, r in enumerate(rows, start=2):
-        if r and str(r[0]) == str(telegram_id):
-            target_row_idx = i
-            break
-    if not target_row_idx:
-        return False
-    sheet_id, _ = _sheet_meta(service)
-    service.spreadsheets().batchUpdate(
-        spreadsheetId=SPREADSHEET_ID,
-        body={
-            "requests": [
-                {
-                    "deleteDimension": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "ROWS",
-                            "startIndex": target_row_idx - 1,
-                            "endIndex": target_row_idx,
-                        }
-                    }
-                }
-            ]
-        },
-    ).execute()
-    return True
+    layout_changed is set when our own writes moved rows (append, delete, clear,
+    rewrite), so the worker can tell other workers their indexes are stale.
+    """
+    def __init__(self) -> None:
+        self.rows: dict[str, int] = {}
+        self.built_at: float | None = None
+        self.layout_changed = False
 
-def clear_sheet_data(service) -> None:
-    service.spreadsheets().values().clear(
+    def invalidate(self) -> None:
+        self.built_at = None
+
+    def ensure(self, service) -> None:
+        if self.built_at is None or time.monotonic() - self.built_at > settings.SHEETS_ROW_INDEX_TTL_SECONDS:
+            self.rebuild(service)
+
+    def rebuild(self, service) -> None:
+        # the header row rides along so an edited header gets reformatted
+        res = service.spreadsheets().values().batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"{SHEET_NAME}!A1:Q1", f"{SHEET_NAME}!A2:A"],
+        ).execute()
+        header, column = [r.get("values", []) or [] for r in res.get("valueRanges", [{}, {}])]
+        if not header or [str(v) for v in header[0]] != HEADERS:
+            _header_changed()
+        previous, self.rows = self.rows, {}
+        duplicates = 0
+        for i, r in enumerate(column, start=2):
+            if r and str(r[0]):
+                # first occurrence wins, as the old full scan did
+                duplicates += str(r[0]) in self.rows
+                self.rows.setdefault(str(r[0]), i)
+        # our own writes keep the index in step, so any difference is a manual edit
+        moved = sum(1 for key, i in previous.items() if self.rows.get(key, i) != i)
+        if moved or duplicates:
+            logger.warning(
+                "sheets: column A disagreed with the row index (%s moved, %s duplicate ids); "
+                "upserts since the last rebuild may have landed on the wrong rows",
+                moved, duplicates,
+            )
+        self.built_at = time.monotonic()
+
+    def reset(self, rows: dict[str, int] | None = None) -> None:
+        self.rows = rows or {}
+        self.built_at = time.monotonic()
+        self.layout_changed = True
+
+    def appended(self, telegram_id: str, row_idx: int) -> None:
+        self.layout_changed = True
+        if any(i >= row_idx for i in self.rows.values()):
+            # the append landed inside rows we know about: the sheet was edited
+            self.invalidate()
+            return
+        self.rows[telegram_id] = row_idx
+
+    def deleted(self, telegram_id: str, row_idx: int) -> None:
+        self.layout_changed = True
+        self.rows.pop(telegram_id, None)
+        for key, i in self.rows.items():
+            if i > row_idx:
+                self.rows[key] = i - 1
+
+# one per worker process
+row_index = RowIndex()
+
+def _updated_rows(response: dict) -> tuple[int, int] | None:
+    # "'Guest TG'!A57:Q59" → (57, 59)
+    m = re.search(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?", (response.get("updates") or {}).get("updatedRange") or "")
+    return (int(m.group(1)), int(m.group(2) or m.group(1))) if m else None
+
+def _rows_hold(service, targets: dict[str, int]) -> bool:
+    res = service.spreadsheets().values().batchGet(
         spreadsheetId=SPREADSHEET_ID,
-        range=f"{SHEET_NAME}!A2:Q",
-        body={},
+        ranges=[f"{SHEET_NAME}!A{i}" for i in targets.values()],
     ).execute()
+    for key, value_range in zip(targets, res.get("valueRanges", [])):
+        values = value_range.get("values") or []
+        if not (values and values[0] and str(values[0][0]) == key):
+            return False
+    return True
 
-def upsert_row(service, row: list[str]) -> None:
-    # row[0] is telegram_id
-    rows = _read_rows(service)
-    target_row_idx = None
-    for i, r in enumerate(rows, start=2):
-        if r and str(r[0]) == str(row[0]):
-            target_row_idx = i
-            break
-    if target_row_idx is None:
-        service.spreadsheets().values().append(
+def delete_rows_by_telegram_id(service, telegram_ids) -> int:
+    """
+    Deletes the rows of these guests in one batchUpdate; returns how many were found.
+    """
+    keys = {str(t) for t in telegram_ids}
+    row_index.ensure(service)
+    targets = {k: row_index.rows[k] for k in keys if k in row_index.rows}
+    if not targets:
+        return 0
+    # a wrong guess here deletes someone else's rows
+    if not _rows_hold(service, targets):
+        row_index.rebuild(service)
+        targets = {k: row_index.rows[k] for k in keys if k in row_index.rows}
+        if not targets:
+            return 0
+    sheet_id = _get_sheet_id(service)
+    # bottom-up, so each deletion leaves the rows above it where they were
+    ordered = sorted(targets.items(), key=lambda item: item[1], reverse=True)
+    try:
+        service.spreadsheets().batchUpdate(
             spreadsheetId=SPREADSHEET_ID,
-            range=f"{SHEET_NAME}!A:Q",
-            valueInputOption="RAW",
-            insertDataOption="INSERT_ROWS",
-            body={"values": [row]},
+            body={
+                "requests": [
+                    {
+                        "deleteDimension": {
+                            "range": {
+                                "sheetId": sheet_id,
+                                "dimension": "ROWS",
+                                "startIndex": row_idx - 1,
+                                "endIndex": row_idx,
+                            }
+                        }
+                    }
+                    for _, row_idx in ordered
+                ]
+            },
         ).execute()
-    else:
-        service.spreadsheets().values().update(
+    except Exception:
+        row_index.invalidate()
+        raise
+    for key, row_idx in ordered:
+        row_index.deleted(key, row_idx)
+    return len(ordered)
+
+def clear_sheet_data(service) -> None:
+    try:
+        service.spreadsheets().values().clear(
             spreadsheetId=SPREADSHEET_ID,
-            range=f"{SHEET_NAME}!A{target_row_idx}:Q{target_row_idx}",
-            valueInputOption="RAW",
-            body={"values": [row]},
+            range=f"{SHEET_NAME}!A2:Q",
+            body={},
         ).execute()
+    except Exception:
+        row_index.invalidate()
+        raise
+    row_index.reset()
+
+def write_all_rows(service, rows: list[list[str]]) -> None:
+    """
+    Replaces the data rows with `rows`: one write over A2:Q{n+1}, then one clear
+    of whatever is left below.
+    """
+    last = len(rows) + 1
+    try:
+        if rows:
+            service.spreadsheets().values().update(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{SHEET_NAME}!A2:Q{last}",
+                valueInputOption="RAW",
+                body={"values": rows},
+            ).execute()
+        try:
+            service.spreadsheets().values().clear(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{SHEET_NAME}!A{last + 1}:Q",
+                body={},
+            ).execute()
+        except HttpError as e:
+            # the range starts past the end of the grid: nothing below to clear
+            if e.resp.status != 400:
+                raise
+    except Exception:
+        row_index.invalidate()
+        raise
+    index: dict[str, int] = {}
+    for i, r in enumerate(rows, start=2):
+        index.setdefault(str(r[0]), i)
+    row_index.reset(index)
+
+def upsert_rows(service, rows: list[list[str]]) -> None:
+    """
+    Writes guest rows (row[0] is telegram_id): known rows in one values.batchUpdate,
+    new ones in one append, with no read in between. The index is trusted until
+    SHEETS_ROW_INDEX_TTL_SECONDS runs out: a sheet sorted by hand inside that
+    window can get a guest written over another's row. The next rebuild logs the
+    mismatch, and a sync_all rewrites the sheet. Deletes still check column A
+    first, since they remove rows rather than rewrite them.
+    """
+    row_index.ensure(service)
+    known = [(row_index.rows[str(r[0])], r) for r in rows if str(r[0]) in row_index.rows]
+    new = [r for r in rows if str(r[0]) not in row_index.rows]
+    try:
+        if known:
+            service.spreadsheets().values().batchUpdate(
+                spreadsheetId=SPREADSHEET_ID,
+                body={
+                    "valueInputOption": "RAW",
+                    "data": [{"range": f"{SHEET_NAME}!A{i}:Q{i}", "values": [r]} for i, r in known],
+                },
+            ).execute()
+        if new:
+            res = service.spreadsheets().values().append(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{SHEET_NAME}!A:Q",
+                valueInputOption="RAW",
+                insertDataOption="INSERT_ROWS",
+                body={"values": new},
+            ).execute()
+            row_index.layout_changed = True
+            span = _updated_rows(res)
+            if span is None or span[1] - span[0] + 1 != len(new):
+                row_index.invalidate()
+            else:
+                for i, r in enumerate(new, start=span[0]):
+                    row_index.appended(str(r[0]), i)
+    except Exception:
+        row_index.invalidate()
+        raise
 
 def to_row(data: dict) -> list[str]:
     def _b(v):
@@ -0,0 +1,98 @@
+"""
+Admin guest search over an FTS5 trigram index (SQLite only).
+
+guest_search(rowid = guests.id) holds profiles.full_name, guests.username and the
+digits of guests.phone; triggers on guests/profiles keep it in sync with every write.
+Trigram matching needs at least 3 characters; shorter queries fall back to ILIKE.
+"""
+import logging
+import re
+
+from sqlalchemy import column, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_PHONE_DIGITS = "replace(replace(replace(replace(replace(replace(coalesce({p}, ''), '+', ''), ' ', ''), '-', ''), '(', ''), ')', ''), '.', '')"
+
+_REFRESH = (
+    "DELETE FROM guest_search WHERE rowid = {gid}; "
+    "INSERT INTO guest_search (rowid, name, username, phone) "
+    "SELECT g.id, coalesce(p.full_name, ''), coalesce(g.username, ''), " + _PHONE_DIGITS.format(p="g.phone") + " "
+    "FROM guests g LEFT JOIN profiles p ON p.guest_id = g.id WHERE g.id = {gid};"
+)
+
+_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS guest_search USING fts5(name, username, phone, tokenize = 'trigram')",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_guests_ai AFTER INSERT ON guests BEGIN "
+    + _REFRESH.format(gid="NEW.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_guests_au AFTER UPDATE OF username, phone ON guests BEGIN "
+    + _REFRESH.format(gid="NEW.id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_guests_ad AFTER DELETE ON guests BEGIN "
+    "DELETE FROM guest_search WHERE rowid = OLD.id; END",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_profiles_ai AFTER INSERT ON profiles BEGIN "
+    + _REFRESH.format(gid="NEW.guest_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_profiles_au AFTER UPDATE OF full_name, guest_id ON profiles BEGIN "
+    + _REFRESH.format(gid="OLD.guest_id") + " " + _REFRESH.format(gid="NEW.guest_id") + " END",
+    "CREATE TRIGGER IF NOT EXISTS guest_search_profiles_ad AFTER DELETE ON profiles BEGIN "
+    + _REFRESH.format(gid="OLD.guest_id") + " END",
+]
+
+_guest_search = table("guest_search", column("rowid"), column("rank"))
+_available: bool | None = None
+
+def create_guest_search(conn: Connection) -> None:
+    """
+    Creates the FTS table and triggers and (re)fills it from guests/profiles.
+    Skipped with a warning when SQLite lacks FTS5 or the trigram tokenizer (< 3.34).
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    try:
+        for ddl in _DDL:
+            conn.exec_driver_sql(ddl)
+    except OperationalError as e:
+        logger.warning("guest_search unavailable, admin search stays on ILIKE: %s", e)
+        return
+    conn.exec_driver_sql("DELETE FROM guest_search")
+    conn.exec_driver_sql(
+        "INSERT INTO guest_search (rowid, name, username, phone) "
+        "SELECT g.id, coalesce(p.full_name, ''), coalesce(g.username, ''), " + _PHONE_DIGITS.format(p="g.phone") + " "
+        "FROM guests g LEFT JOIN profiles p ON p.guest_id = g.id"
+    )
+
+def available(db: Session) -> bool:
+    global _available
+    if _available is None:
+        _available = bool(db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'guest_search'")
+        ).scalar()) if db.get_bind().dialect.name == "sqlite" else False
+    return _available
+
+def _phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+def match_expression(q: str) -> str | None:
+    """
+    FTS5 MATCH string for a free-text query, or None when it is too short for trigrams.
+    """
+    q = (q or "").strip().lstrip("@")
+    digits = re.sub(r"\D", "", q)
+    parts = []
+    if len(q) >= 3:
+        parts.append("{name username} : " + _phrase(q))
+    if len(digits) >= 3:
+        parts.append("phone : " + _phrase(digits))
+    return " OR ".join(parts) or None
+
+def search_hits(expression: str):
+    """
+    Subquery of (guest_id, rank) for the MATCH expression; lower rank is better (bm25).
+    """
+    return (
+        select(_guest_search.c.rowid.label("guest_id"), _guest_search.c.rank.label("rank"))
+        .where(text("guest_search MATCH :fts_q").bindparams(fts_q=expression))
+        .subquery("hits")
+    )
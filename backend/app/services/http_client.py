@@ -0,0 +1,49 @@
+"""
+Process-wide pooled httpx.AsyncClient for Bot API and bot-service calls.
+
+Opened and closed by the app lifespan so connections (and TLS sessions to
+api.telegram.org) are kept alive between requests. HTTP/2 is used when the h2
+package is installed. Connect failures are retried by the transport; read
+timeouts are not, so a slow sendMessage is never sent twice.
+"""
+import asyncio
+import importlib.util
+
+import httpx
+
+from ..config import settings
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+def _build() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    http2 = importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS),
+        transport=httpx.AsyncHTTPTransport(retries=settings.HTTP_CONNECT_RETRIES, limits=limits, http2=http2),
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    The shared client. Outside the lifespan (scripts, tests) one is created for the
+    running loop, since pooled connections cannot move between event loops.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client, _client_loop = _build(), loop
+    return _client
+
+async def open_http_client() -> None:
+    get_http_client()
+
+async def close_http_client() -> None:
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client, _client_loop = None, None
@@ -0,0 +1,90 @@
+"""
+Idempotency-Key support for guest write endpoints.
+
+claim() runs before the first write of a request. A known key replays the stored
+response with one indexed read. A new key inserts its row in the request's own
+transaction, so concurrent retries queue on that row and then replay the winner.
+remember() stores the response just before the handler commits.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..db import dialect_insert
+from ..models import IdempotencyKey
+
+MAX_KEY_LENGTH = 128
+
+def _request_hash(body: BaseModel) -> str:
+    return hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+
+def _lookup(guest_id: int, scope: str, key: str):
+    return select(IdempotencyKey).where(
+        IdempotencyKey.guest_id == guest_id,
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.created_at >= datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+    )
+
+def _replay(row: IdempotencyKey, request_hash: str) -> JSONResponse:
+    if row.request_hash != request_hash:
+        raise HTTPException(422, "Idempotency-Key reused with a different request")
+    if row.response_body is None:
+        raise HTTPException(409, "Request with this Idempotency-Key is still in progress")
+    return JSONResponse(json.loads(row.response_body), status_code=row.status_code or 200)
+
+async def claim(db: AsyncSession, key: str | None, guest_id: int, scope: str, body: BaseModel) -> JSONResponse | None:
+    """
+    Returns the stored response for a repeated key, or None when the request should
+    run (no key, or the key is new and now held by this transaction).
+    """
+    if not key:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, "Bad Idempotency-Key")
+    request_hash = _request_hash(body)
+    row = await db.scalar(_lookup(guest_id, scope, key))
+    if row:
+        return _replay(row, request_hash)
+    # expired keys (this one included) make room for new ones
+    await db.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.created_at < datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        )
+    )
+    inserted = (await db.execute(
+        dialect_insert(db)(IdempotencyKey)
+        .values(guest_id=guest_id, scope=scope, key=key, request_hash=request_hash, created_at=datetime.utcnow())
+        .on_conflict_do_nothing()
+    )).rowcount == 1
+    if inserted:
+        return None
+    # a concurrent retry committed first
+    row = await db.scalar(_lookup(guest_id, scope, key).execution_options(populate_existing=True))
+    response = _replay(row, request_hash) if row else None
+    await db.rollback()
+    if response is None:
+        raise HTTPException(409, "Request with this Idempotency-Key is still in progress")
+    return response
+
+async def remember(db: AsyncSession, key: str | None, guest_id: int, scope: str, response, status_code: int = 200) -> None:
+    """
+    Stores the response for a claimed key; call before the handler's commit.
+    """
+    if not key or not key.strip():
+        return
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.guest_id == guest_id, IdempotencyKey.scope == scope, IdempotencyKey.key == key.strip())
+        .values(status_code=status_code, response_body=json.dumps(jsonable_encoder(response), ensure_ascii=False))
+        .execution_options(synchronize_session=False)
+    )
@@ -1,13 +1,15 @@
 import httpx
 import logging
-from sqlalchemy.orm import Session
+from dataclasses import dataclass
 
 from ..config import settings
-from ..db import SessionLocal
-from ..models import AdminSettings
+from .http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
+def bot_api_url(method: str) -> str:
+    return f"{settings.TELEGRAM_API_BASE.rstrip('/')}/bot{settings.BOT_TOKEN}/{method}"
+
 async def notify_admins(event: str, payload: dict):
     """
     Simple approach: backend calls bot HTTP endpoint.
@@ -15,72 +17,49 @@ async def notify_admins(event: str, payload: dict):
     """
     url = "http://bot:8081/internal/notify"
     headers = {"x-internal-secret": settings.INTERNAL_SECRET}
-    async with httpx.AsyncClient(timeout=5) as client:
-        try:
-            await client.post(url, json={"event": event, "payload": payload}, headers=headers)
-        except Exception as e:
-            logger.warning("notify_admins failed: %s", str(e))
-            # non-fatal
-            pass
+    try:
+        await get_http_client().post(url, json={"event": event, "payload": payload}, headers=headers)
+    except Exception as e:
+        logger.warning("notify_admins failed: %s", str(e))
+        # non-fatal
+        pass
 
-def _system_notifications_enabled(db: Session, admin_id: int) -> bool:
-    row = db.query(AdminSettings).filter(AdminSettings.admin_id == admin_id).one_or_none()
-    if not row:
-        return False
-    return bool(row.system_notifications_enabled)
+@dataclass
+class SendResult:
+    ok: bool
+    error: str | None = None
+    # seconds Telegram asked us to wait (429)
+    retry_after: float | None = None
+    # chat not found / bot blocked: retrying will not help
+    permanent: bool = False
 
-async def send_admin_message(text: str, category: str = "system", db: Session | None = None) -> bool:
+async def send_message(client: httpx.AsyncClient, chat_id: int, text: str) -> SendResult:
     """
-    Send direct Telegram messages to admins via Bot API.
+    One Bot API sendMessage call; used by the outbox dispatcher.
     """
     if not settings.BOT_TOKEN:
-        logger.warning("send_admin_message: missing BOT_TOKEN")
-        return False
-    url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage"
-    admin_ids = settings.admin_id_set
-    if not admin_ids:
-        return False
-    close_db = False
-    if db is None:
-        db = SessionLocal()
-        close_db = True
-    sent_any = False
-    async with httpx.AsyncClient(timeout=8) as client:
-        for admin_id in admin_ids:
-            if category != "question" and not _system_notifications_enabled(db, admin_id):
-                continue
-            try:
-                resp = await client.post(url, json={
-                    "chat_id": admin_id,
-                    "text": text,
-                    "parse_mode": "HTML",
-                    "disable_web_page_preview": True,
-                })
-                if resp.status_code >= 200 and resp.status_code < 300:
-                    sent_any = True
-                else:
-                    logger.warning("send_admin_message status=%s body=%s", resp.status_code, resp.text[:200])
-            except Exception as e:
-                logger.warning("send_admin_message failed: %s", str(e))
-                continue
-    if close_db:
-        db.close()
-    return sent_any
-
-async def send_user_message(telegram_user_id: int, text: str) -> bool:
-    if not settings.BOT_TOKEN:
-        logger.warning("send_user_message: missing BOT_TOKEN")
-        return False
-    url = f"https://api.telegram.org/bot{settings.BOT_TOKEN}/sendMessage"
-    async with httpx.AsyncClient(timeout=8) as client:
+        return SendResult(False, error="missing BOT_TOKEN", permanent=True)
+    url = bot_api_url("sendMessage")
+    try:
+        resp = await client.post(url, json={
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True,
+        })
+    except httpx.HTTPError as e:
+        return SendResult(False, error=str(e) or type(e).__name__)
+    if 200 <= resp.status_code < 300:
+        return SendResult(True)
+    retry_after = None
+    if resp.status_code == 429:
         try:
-            resp = await client.post(url, json={
-                "chat_id": telegram_user_id,
-                "text": text,
-                "parse_mode": "HTML",
-                "disable_web_page_preview": True,
-            })
-            return 200 <= resp.status_code < 300
-        except Exception as e:
-            logger.warning("send_user_message failed: %s", str(e))
-            return False
+            retry_after = float((resp.json().get("parameters") or {}).get("retry_after") or 0) or None
+        except ValueError:
+            retry_after = None
+    return SendResult(
+        False,
+        error=f"status={resp.status_code} body={resp.text[:200]}",
+        retry_after=retry_after,
+        permanent=resp.status_code in (400, 403),
+    )
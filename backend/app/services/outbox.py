@@ -0,0 +1,302 @@
+"""
+Durable outbox for Telegram messages.
+
+Request handlers only insert notification_outbox rows (enqueue_*), inside their own
+transaction; run_dispatcher drains the table in the background, retrying with
+exponential backoff. Claims are a single UPDATE ... RETURNING, so several workers
+can run a dispatcher against the same database without double-sending.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import case, event, select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..db import AsyncSessionLocal, dialect_insert
+from ..models import AdminSettings, ChangeLog, Guest, NotificationOutbox, Profile
+from .changes import render_changes
+from .http_client import get_http_client
+from .notifier import send_message
+from .send_scheduler import PRIORITY, scheduler
+
+logger = logging.getLogger(__name__)
+
+_loop: asyncio.AbstractEventLoop | None = None
+_wakeup: asyncio.Event | None = None
+
+def _dedupe_key(chat_id: int, text: str) -> str:
+    return hashlib.sha256(f"{chat_id}:{text}".encode()).hexdigest()[:32]
+
+def _enqueue(
+    db: Session,
+    chat_id: int,
+    text: str,
+    category: str,
+    dedupe_key: str | None,
+    delay_seconds: int = 0,
+    guest_id: int | None = None,
+) -> bool:
+    stmt = dialect_insert(db)(NotificationOutbox).values(
+        chat_id=chat_id,
+        category=category,
+        text=text,
+        dedupe_key=dedupe_key or _dedupe_key(chat_id, text),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+        guest_id=guest_id,
+    ).on_conflict_do_nothing()
+    inserted = db.execute(stmt).rowcount == 1
+    db.info["outbox_enqueued"] = True
+    return inserted
+
+def enqueue_user_message(db: Session, telegram_user_id: int, text: str, dedupe_key: str | None = None) -> bool:
+    """
+    Queues a message to one chat; delivered after the caller commits. An identical
+    message still pending for the same chat is not queued twice.
+    """
+    return _enqueue(db, telegram_user_id, text, "user", dedupe_key)
+
+def _system_enabled(admin_ids: set[int], *columns):
+    return select(AdminSettings.admin_id, *columns).where(
+        AdminSettings.admin_id.in_(admin_ids),
+        AdminSettings.system_notifications_enabled.is_(True),
+    )
+
+def enqueue_admin_message(db: Session, text: str, category: str = "system") -> dict[int, str]:
+    """
+    Queues one row per admin and returns each admin's outcome: "queued", "duplicate"
+    (same text still pending) or "muted" (system notifications off). One AdminSettings
+    query covers all admins.
+    """
+    admin_ids = settings.admin_id_set
+    enabled = admin_ids
+    if category == "system" and admin_ids:
+        enabled = set(db.scalars(_system_enabled(admin_ids)).all())
+    results = {}
+    for admin_id in sorted(admin_ids):
+        if admin_id not in enabled:
+            results[admin_id] = "muted"
+        elif _enqueue(db, admin_id, text, category, None):
+            results[admin_id] = "queued"
+        else:
+            results[admin_id] = "duplicate"
+    return results
+
+def enqueue_admin_changes(db: Session, guest_id: int, name: str, changes: list[tuple[str, str, str]]) -> dict[int, str]:
+    """
+    Reports a guest's saved (label, old, new) changes, already written to ChangeLog,
+    to admins with system notifications on. Admins with a digest window get one pending digest per
+    guest that absorbs every save until the window ends; the rest get text right away.
+    """
+    admin_ids = settings.admin_id_set
+    if not admin_ids:
+        return {}
+    windows = dict(db.execute(_system_enabled(admin_ids, AdminSettings.digest_window_seconds)).all())
+    text = render_changes(name, guest_id, changes)
+    results = {}
+    for admin_id in sorted(admin_ids):
+        window = windows.get(admin_id)
+        if window is None:
+            results[admin_id] = "muted"
+        elif window <= 0:
+            results[admin_id] = "queued" if _enqueue(db, admin_id, text, "system", None) else "duplicate"
+        else:
+            inserted = _enqueue(
+                db, admin_id, "", "digest", f"digest:{admin_id}:{guest_id}",
+                delay_seconds=window, guest_id=guest_id,
+            )
+            results[admin_id] = "queued" if inserted else "merged"
+    return results
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session) -> None:
+    if session.info.pop("outbox_enqueued", False):
+        wake_dispatcher()
+
+def wake_dispatcher() -> None:
+    # safe from request threads: hops onto the dispatcher's loop
+    if _loop is not None and _wakeup is not None:
+        try:
+            _loop.call_soon_threadsafe(_wakeup.set)
+        except RuntimeError:
+            pass
+
+def _backoff(attempts: int, retry_after: float | None) -> timedelta:
+    delay = settings.OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return timedelta(seconds=min(delay, settings.OUTBOX_BACKOFF_MAX_SECONDS))
+
+def due_messages(now: datetime, limit: int):
+    """
+    Ids of messages due for sending, questions first, then user messages, then system.
+    """
+    lane = case(PRIORITY, value=NotificationOutbox.category, else_=PRIORITY["system"])
+    return (
+        select(NotificationOutbox.id)
+        .where(
+            NotificationOutbox.status.in_(("pending", "retry", "sending")),
+            NotificationOutbox.next_attempt_at <= now,
+        )
+        .order_by(lane, NotificationOutbox.id)
+        .limit(limit)
+    )
+
+async def _claim(limit: int, now: datetime) -> list:
+    due = due_messages(now, limit)
+    # rows left in "sending" by a crashed dispatcher become due again once the lease ends
+    stmt = (
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(due.scalar_subquery()))
+        .values(status="sending", next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS))
+        .returning(
+            NotificationOutbox.id,
+            NotificationOutbox.chat_id,
+            NotificationOutbox.category,
+            NotificationOutbox.text,
+            NotificationOutbox.attempts,
+            NotificationOutbox.guest_id,
+            NotificationOutbox.created_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+        await db.commit()
+    return rows
+
+async def _muted_admins(chat_ids: set[int]) -> set[int]:
+    # admins may have muted system notifications since the rows were queued
+    if not chat_ids:
+        return set()
+    async with AsyncSessionLocal() as db:
+        enabled = set((await db.scalars(_system_enabled(chat_ids))).all())
+    return chat_ids - enabled
+
+def _merge_changes(entries: list[ChangeLog]) -> list[tuple[str, str, str]]:
+    # consecutive edits of one field collapse to first old value → last new value
+    merged: dict[str, list] = {}
+    for entry in entries:
+        if entry.field in merged:
+            merged[entry.field][1] = entry.new_value
+        else:
+            merged[entry.field] = [entry.old_value, entry.new_value]
+    return [(field, old or "—", new or "—") for field, (old, new) in merged.items() if old != new]
+
+async def _render_digests(rows: list, claimed_at: datetime) -> dict[int, str]:
+    """
+    Text for each unrendered digest row: the guest's ChangeLog entries from the row's
+    creation up to the claim. Saves committed after the claim open a new digest.
+    Digests whose edits cancel out render as "".
+    """
+    digests = [r for r in rows if r.category == "digest" and not r.text]
+    if not digests:
+        return {}
+    guest_ids = {r.guest_id for r in digests}
+    async with AsyncSessionLocal() as db:
+        entries = (await db.scalars(
+            select(ChangeLog)
+            .where(
+                ChangeLog.guest_id.in_(guest_ids),
+                ChangeLog.created_at >= min(r.created_at for r in digests),
+                ChangeLog.created_at < claimed_at,
+            )
+            .order_by(ChangeLog.id)
+        )).all()
+        names = {
+            gid: (full_name or f"{first or ''} {last or ''}".strip() or "Гость")
+            for gid, full_name, first, last in (await db.execute(
+                select(Guest.id, Profile.full_name, Guest.first_name, Guest.last_name)
+                .outerjoin(Profile, Profile.guest_id == Guest.id)
+                .where(Guest.id.in_(guest_ids))
+            )).all()
+        }
+    texts = {}
+    for row in digests:
+        changes = _merge_changes([e for e in entries if e.guest_id == row.guest_id and e.created_at >= row.created_at])
+        if not changes:
+            texts[row.id] = ""
+            continue
+        texts[row.id] = render_changes(names.get(row.guest_id, "Гость"), row.guest_id, changes)
+    return texts
+
+async def _deliver(client: httpx.AsyncClient, row, text: str, muted: set[int], slots: asyncio.Semaphore) -> dict:
+    if row.category in ("system", "digest") and row.chat_id in muted:
+        return {"id": row.id, "status": "skipped"}
+    if not text:
+        return {"id": row.id, "status": "skipped"}
+    await scheduler.acquire(row.chat_id, PRIORITY.get(row.category, PRIORITY["system"]))
+    async with slots:
+        res = await send_message(client, row.chat_id, text)
+    now = datetime.utcnow()
+    attempts = row.attempts + 1
+    if res.retry_after:
+        scheduler.defer(row.chat_id, res.retry_after)
+    if res.ok:
+        return {"id": row.id, "status": "sent", "attempts": attempts, "sent_at": now}
+    if res.permanent or attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        logger.error("outbox: giving up on message %s to %s after %s attempts: %s", row.id, row.chat_id, attempts, res.error)
+        return {"id": row.id, "status": "failed", "attempts": attempts, "last_error": res.error}
+    logger.warning("outbox: message %s to %s failed (attempt %s): %s", row.id, row.chat_id, attempts, res.error)
+    return {
+        "id": row.id,
+        "status": "retry",
+        "attempts": attempts,
+        "last_error": res.error,
+        "next_attempt_at": now + _backoff(attempts, res.retry_after),
+    }
+
+async def dispatch_batch(client: httpx.AsyncClient) -> int:
+    """
+    Claims up to OUTBOX_BATCH_SIZE due messages and sends them through the scheduler,
+    which paces them per chat and globally. Returns how many were claimed.
+    """
+    claimed_at = datetime.utcnow()
+    rows = await _claim(settings.OUTBOX_BATCH_SIZE, claimed_at)
+    if not rows:
+        return 0
+    muted = await _muted_admins({r.chat_id for r in rows if r.category in ("system", "digest")})
+    digests = await _render_digests(rows, claimed_at)
+    # rows to one chat keep their order: the scheduler is FIFO per lane
+    slots = asyncio.Semaphore(settings.OUTBOX_SEND_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _deliver(client, row, digests.get(row.id, row.text), muted, slots) for row in rows
+    ))
+    logger.info("outbox: batch of %s: %s", len(rows), dict(Counter(r["status"] for r in results)))
+    async with AsyncSessionLocal() as db:
+        for values in results:
+            row_id = values.pop("id")
+            if row_id in digests:
+                # a retried digest resends the same text instead of re-rendering
+                values["text"] = digests[row_id]
+            await db.execute(update(NotificationOutbox).where(NotificationOutbox.id == row_id).values(**values))
+        await db.commit()
+    return len(rows)
+
+async def run_dispatcher() -> None:
+    """
+    Background task (started from the app lifespan): drains due messages, then sleeps
+    until woken by a commit that enqueued something or OUTBOX_POLL_SECONDS pass.
+    """
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            if await dispatch_batch(get_http_client()):
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("outbox dispatch failed")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.OUTBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
@@ -0,0 +1,109 @@
+"""
+Pacing for outbound Bot API messages.
+
+Telegram allows about 30 messages/s per bot and 1 message/s per chat, and answers
+429 with retry_after when either is exceeded. SendScheduler hands out send slots
+under a global token bucket and a per-chat spacing; waiters are served by priority
+lane (guest questions, then user messages, then system diffs) and FIFO within a lane.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+from ..config import settings
+
+PRIORITY = {"question": 0, "user": 1, "system": 2}
+
+class SendScheduler:
+    def __init__(self, rate: float, burst: int, per_chat_interval: float):
+        self.rate = rate
+        self.burst = burst
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        # chat_id -> monotonic time of its next allowed send
+        self._chat_ready: dict[int, float] = {}
+        # (priority, seq, chat_id, future)
+        self._waiters: list[tuple[int, int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._changed: asyncio.Event | None = None
+        self._pump: asyncio.Task | None = None
+
+    async def acquire(self, chat_id: int, priority: int = PRIORITY["system"]) -> None:
+        """
+        Waits until a message to chat_id may be sent.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), chat_id, fut))
+        self._kick()
+        # a cancelled waiter is dropped by the pump on its next pass
+        await fut
+
+    def defer(self, chat_id: int, retry_after: float) -> None:
+        """
+        Telegram answered 429 for this chat: hold it for retry_after seconds.
+        """
+        until = time.monotonic() + retry_after
+        self._chat_ready[chat_id] = max(self._chat_ready.get(chat_id, 0.0), until)
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        self._changed.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.get_running_loop().create_task(self._run())
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _grant_ready(self, now: float) -> float | None:
+        """
+        Grants every slot available right now; returns seconds until the next one
+        could open, or None when nobody is waiting.
+        """
+        while self._waiters:
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            chat_wait = None
+            for entry in sorted(self._waiters):
+                if entry[3].done():
+                    # cancelled while waiting
+                    self._waiters.remove(entry)
+                    continue
+                ready_at = self._chat_ready.get(entry[2], 0.0)
+                if ready_at <= now:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._tokens -= 1
+                    self._chat_ready[entry[2]] = now + self.per_chat_interval
+                    if not entry[3].done():
+                        entry[3].set_result(None)
+                    break
+                chat_wait = ready_at - now if chat_wait is None else min(chat_wait, ready_at - now)
+            else:
+                heapq.heapify(self._waiters)
+                return chat_wait
+        if len(self._chat_ready) > 1000:
+            self._chat_ready = {k: v for k, v in self._chat_ready.items() if v > now}
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            delay = self._grant_ready(time.monotonic())
+            if delay is None and not self._waiters:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+scheduler = SendScheduler(
+    rate=settings.TG_GLOBAL_RATE,
+    burst=settings.TG_GLOBAL_BURST,
+    per_chat_interval=settings.TG_PER_CHAT_INTERVAL_SECONDS,
+)
@@ -1,30 +1,107 @@
+"""
+Google Sheets sync jobs, drained by workers/google_sheets_worker.py.
+
+There is at most one pending job per (type, telegram_id): enqueueing again
+upserts into it and pushes its not_before back by SHEETS_SYNC_DEBOUNCE_SECONDS,
+capped at SHEETS_SYNC_MAX_DELAY_SECONDS after the job was first queued. A
+pending sync_all covers every guest, so per-guest syncs are absorbed into it.
+"""
 import json
 import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, or_, select, update
 from sqlalchemy.orm import Session
 
+from ..config import settings
+from ..db import dialect_insert
 from ..models import SheetSyncJob
 
 logger = logging.getLogger(__name__)
 
-def _enqueue(db: Session, job_type: str, telegram_id: int | None, reason: str) -> None:
-    job = SheetSyncJob(
+def _dedupe_key(job_type: str, telegram_id: int | None) -> str:
+    return f"{job_type}:{telegram_id or ''}"
+
+def _upsert(db: Session, job_type: str, telegram_id: int | None, reason: str, debounce: bool) -> None:
+    now = datetime.utcnow()
+    not_before = now + timedelta(seconds=settings.SHEETS_SYNC_DEBOUNCE_SECONDS if debounce else 0)
+    stmt = dialect_insert(db)(SheetSyncJob).values(
         type=job_type,
         telegram_id=telegram_id,
         status="pending",
         attempts=0,
         payload=json.dumps({"reason": reason}),
+        dedupe_key=_dedupe_key(job_type, telegram_id),
+        not_before=not_before,
+        created_at=now,
+        updated_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["dedupe_key"],
+        index_where=SheetSyncJob.status == "pending",
+        set_={
+            # keep pushing the job back until it has waited SHEETS_SYNC_MAX_DELAY_SECONDS
+            "not_before": case(
+                (SheetSyncJob.created_at > now - timedelta(seconds=settings.SHEETS_SYNC_MAX_DELAY_SECONDS), not_before),
+                else_=SheetSyncJob.not_before,
+            ),
+            "payload": stmt.excluded.payload,
+            "updated_at": now,
+        },
+    )
+    db.execute(stmt)
+
+def _supersede(db: Session, *conditions) -> None:
+    db.execute(
+        update(SheetSyncJob)
+        .where(SheetSyncJob.status == "pending", *conditions)
+        .values(status="superseded", updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+def _sync_all_pending(db: Session) -> bool:
+    return db.scalar(
+        select(SheetSyncJob.id).where(
+            SheetSyncJob.status == "pending",
+            SheetSyncJob.dedupe_key == _dedupe_key("sync_all", None),
+        )
+    ) is not None
+
+def due_jobs(now: datetime, limit: int):
+    """
+    Ids of jobs for the worker's next batch, oldest first: pending jobs past their
+    debounce, and "processing" jobs whose worker's lease ran out.
+    """
+    return (
+        select(SheetSyncJob.id)
+        .where(
+            SheetSyncJob.status.in_(("pending", "processing")),
+            or_(SheetSyncJob.not_before.is_(None), SheetSyncJob.not_before <= now),
+        )
+        .order_by(SheetSyncJob.created_at.asc())
+        .limit(limit)
     )
-    db.add(job)
-    db.commit()
 
 def enqueue_sheet_sync(db: Session, telegram_id: int | None, reason: str = "update") -> None:
-    _enqueue(db, "sync_guest" if telegram_id else "sync_all", telegram_id, reason)
+    if not telegram_id:
+        enqueue_sync_all(db, reason=reason)
+        return
+    if not _sync_all_pending(db):
+        _upsert(db, "sync_guest", telegram_id, reason, debounce=True)
+    db.commit()
 
 def enqueue_sync_all(db: Session, reason: str = "admin") -> None:
-    enqueue_sheet_sync(db, None, reason=reason)
+    _upsert(db, "sync_all", None, reason, debounce=True)
+    _supersede(db, SheetSyncJob.type == "sync_guest")
+    db.commit()
 
 def enqueue_delete_guest(db: Session, telegram_id: int, reason: str = "delete") -> None:
-    _enqueue(db, "delete_guest", telegram_id, reason)
+    _upsert(db, "delete_guest", telegram_id, reason, debounce=False)
+    _supersede(db, SheetSyncJob.type == "sync_guest", SheetSyncJob.telegram_id == telegram_id)
+    db.commit()
 
 def enqueue_clear_all(db: Session, reason: str = "clear") -> None:
-    _enqueue(db, "clear_all", None, reason)
+    # the guests are gone from the database, so anything else pending is moot
+    _upsert(db, "clear_all", None, reason, debounce=False)
+    _supersede(db, SheetSyncJob.type != "clear_all")
+    db.commit()
@@ -1,23 +1,70 @@
-import hmac, hashlib, urllib.parse
+import base64, hmac, hashlib, json, threading, time, urllib.parse
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from ..config import settings
+from ..db import dialect_insert
 from ..models import InviteToken, Guest, Profile
 
+# digest(initData) -> (user dict, expires_at unix ts)
+_VERIFIED: "OrderedDict[bytes, tuple[Dict[str, Any], float]]" = OrderedDict()
+_VERIFIED_LOCK = threading.Lock()
+
 def _parse_init_data(init_data: str) -> Dict[str, str]:
     parsed = dict(urllib.parse.parse_qsl(init_data, strict_parsing=True))
     return parsed
 
+@lru_cache(maxsize=4)
+def _secret_key(bot_token: str) -> bytes:
+    # Telegram WebApp uses HMAC-SHA256 with key "WebAppData"
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+def _cache_get(key: bytes) -> Dict[str, Any] | None:
+    with _VERIFIED_LOCK:
+        hit = _VERIFIED.get(key)
+        if not hit:
+            return None
+        user, expires_at = hit
+        if expires_at <= time.time():
+            del _VERIFIED[key]
+            return None
+        _VERIFIED.move_to_end(key)
+        return dict(user)
+
+def _cache_put(key: bytes, user: Dict[str, Any], auth_date: str | None) -> None:
+    if settings.INITDATA_CACHE_SIZE <= 0:
+        return
+    try:
+        expires_at = int(auth_date or 0) + settings.INITDATA_CACHE_TTL_SECONDS
+    except ValueError:
+        return
+    if expires_at <= time.time():
+        return
+    with _VERIFIED_LOCK:
+        _VERIFIED[key] = (dict(user), float(expires_at))
+        _VERIFIED.move_to_end(key)
+        while len(_VERIFIED) > settings.INITDATA_CACHE_SIZE:
+            _VERIFIED.popitem(last=False)
+
 def verify_telegram_init_data(init_data: str, bot_token: str) -> Dict[str, Any]:
     """
     Returns user dict if valid.
     DEV MODE: allow empty init_data or "dev" when ALLOW_DEV_AUTH is enabled.
+    Successful results are cached per initData until auth_date + INITDATA_CACHE_TTL_SECONDS.
     """
     if settings.ALLOW_DEV_AUTH and (not init_data or init_data == "dev"):
         return {"id": settings.DEV_USER_ID, "first_name": "Dev", "last_name": "User", "username": "dev_user"}
 
+    secret_key = _secret_key(bot_token)
+    cache_key = hashlib.sha256(secret_key + init_data.encode()).digest()
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
     data = _parse_init_data(init_data)
     if "hash" not in data:
         raise ValueError("Missing hash")
@@ -26,8 +73,6 @@ def verify_telegram_init_data(init_data: str, bot_token: str) -> Dict[str, Any]:
     pairs = [f"{k}={v}" for k, v in sorted(data.items())]
     data_check_string = "\n".join(pairs)
 
-    # Telegram WebApp uses HMAC-SHA256 with key "WebAppData"
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
     computed_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
 
     if not hmac.compare_digest(computed_hash, received_hash):
@@ -36,11 +81,160 @@ def verify_telegram_init_data(init_data: str, bot_token: str) -> Dict[str, Any]:
     if "user" not in data:
         raise ValueError("Missing user")
 
-    import json
     user = json.loads(data["user"])
+    _cache_put(cache_key, user, data.get("auth_date"))
     return user
 
+@lru_cache(maxsize=8)
+def _signing_key(purpose: str, secret: str) -> bytes:
+    return hmac.new(purpose.encode(), secret.encode(), hashlib.sha256).digest()
+
+def _session_sig(payload: str) -> str:
+    secret = settings.SESSION_SECRET or f"{settings.BOT_TOKEN}:{settings.INTERNAL_SECRET}"
+    digest = hmac.new(_signing_key("SessionToken", secret), payload.encode(), hashlib.sha256).digest()[:18]
+    return base64.urlsafe_b64encode(digest).decode()
+
+def issue_session_token(guest_id: int, telegram_user_id: int) -> tuple[str, int]:
+    """
+    Returns (token, expires_at). Token format: "<guest_id>.<telegram_user_id>.<exp>.<sig>".
+    """
+    expires_at = int(time.time()) + settings.SESSION_TTL_SECONDS
+    payload = f"{guest_id}.{telegram_user_id}.{expires_at}"
+    return f"{payload}.{_session_sig(payload)}", expires_at
+
+def verify_session_token(token: str) -> Dict[str, int]:
+    parts = (token or "").split(".")
+    if len(parts) != 4:
+        raise ValueError("Malformed session token")
+    payload = ".".join(parts[:3])
+    if not hmac.compare_digest(_session_sig(payload), parts[3]):
+        raise ValueError("Invalid session token")
+    try:
+        guest_id, telegram_user_id, expires_at = (int(x) for x in parts[:3])
+    except ValueError:
+        raise ValueError("Malformed session token")
+    if expires_at < time.time():
+        raise ValueError("Session expired")
+    return {"guest_id": guest_id, "telegram_user_id": telegram_user_id, "expires_at": expires_at}
+
+def ensure_profile(db: Session, guest_id: int) -> None:
+    insert = dialect_insert(db)
+    db.execute(insert(Profile).values(guest_id=guest_id).on_conflict_do_nothing(index_elements=[Profile.guest_id]))
+
+def upsert_guest(
+    db: Session,
+    telegram_user_id: int,
+    username: str | None = None,
+    first_name: str | None = None,
+    last_name: str | None = None,
+    family_group_id: int | None = None,
+) -> int:
+    """
+    Creates the Guest and its Profile, or returns the existing guest id, without a
+    SELECT-then-INSERT race: concurrent first requests converge on one row instead of
+    hitting the telegram_user_id unique constraint. Non-null values refresh the row.
+    The caller commits.
+    """
+    insert = dialect_insert(db)
+    stmt = insert(Guest).values(
+        telegram_user_id=telegram_user_id,
+        username=username,
+        username_lc=username.lower() if username else None,
+        first_name=first_name,
+        last_name=last_name,
+        family_group_id=family_group_id,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Guest.telegram_user_id],
+        set_={
+            name: func.coalesce(getattr(stmt.excluded, name), getattr(Guest, name))
+            for name in ("username", "username_lc", "first_name", "last_name", "family_group_id")
+        },
+    ).returning(Guest.id)
+    guest_id = db.execute(stmt).scalar_one()
+    ensure_profile(db, guest_id)
+    return guest_id
+
+def get_or_create_guest(db: Session, user: Dict[str, Any]) -> Guest:
+    tg_id = int(user["id"])
+    guest = db.query(Guest).filter(Guest.telegram_user_id == tg_id).one_or_none()
+    if guest:
+        return guest
+    guest_id = upsert_guest(
+        db,
+        tg_id,
+        username=user.get("username"),
+        first_name=user.get("first_name"),
+        last_name=user.get("last_name"),
+    )
+    db.commit()
+    return db.get(Guest, guest_id)
+
+# Signed invite token: "v1_<family_group_id>_<inviter_guest_id>_<invite_id>_<exp>_<sig>", numbers in base36.
+# Legacy tokens are secrets.token_urlsafe(16), i.e. always 22 chars.
+INVITE_TOKEN_PREFIX = "v1_"
+_LEGACY_INVITE_LEN = 22
+
+def _b36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
+
+def _invite_sig(payload: str) -> str:
+    secret = settings.INVITE_SECRET or f"{settings.BOT_TOKEN}:{settings.INTERNAL_SECRET}"
+    digest = hmac.new(_signing_key("InviteToken", secret), payload.encode(), hashlib.sha256).digest()[:12]
+    return base64.urlsafe_b64encode(digest).decode()
+
+def is_signed_invite_token(token: str) -> bool:
+    return token.startswith(INVITE_TOKEN_PREFIX) and len(token) != _LEGACY_INVITE_LEN
+
+def issue_invite_token(family_group_id: int, inviter_guest_id: int, invite_id: int, expires_at: datetime) -> str:
+    exp = int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+    payload = "_".join(_b36(x) for x in (family_group_id, inviter_guest_id, invite_id, exp))
+    return f"{INVITE_TOKEN_PREFIX}{payload}_{_invite_sig(payload)}"
+
+def verify_invite_token(token: str) -> Dict[str, int]:
+    """
+    Checks signature and expiry without touching the DB.
+    pseudo_telegram_user_id is the telegram_user_id of the invite's browser-mode guest.
+    """
+    parts = token[len(INVITE_TOKEN_PREFIX):].split("_", 4)
+    if len(parts) != 5:
+        raise ValueError("Invite not found")
+    payload = "_".join(parts[:4])
+    if not hmac.compare_digest(_invite_sig(payload), parts[4]):
+        raise ValueError("Invite not found")
+    try:
+        family_group_id, inviter_guest_id, invite_id, exp = (int(x, 36) for x in parts[:4])
+    except ValueError:
+        raise ValueError("Invite not found")
+    if exp < time.time():
+        raise ValueError("Invite expired")
+    return {
+        "family_group_id": family_group_id,
+        "inviter_guest_id": inviter_guest_id,
+        "invite_id": invite_id,
+        "pseudo_telegram_user_id": -invite_id,
+        "expires_at": exp,
+    }
+
 def get_guest_from_invite(token: str, db: Session) -> Guest:
+    if is_signed_invite_token(token):
+        claims = verify_invite_token(token)
+        guest = (
+            db.query(Guest)
+            .filter(Guest.telegram_user_id == claims["pseudo_telegram_user_id"])
+            .one_or_none()
+        )
+        if guest and guest.family_group_id == claims["family_group_id"]:
+            return guest
+        # first use of this link, or the pseudo guest does not belong to the signed family:
+        # the DB path matches the whole token (family, inviter and id) against invite_tokens
+
     invite = db.query(InviteToken).filter(InviteToken.token == token).one_or_none()
     if not invite:
         raise ValueError("Invite not found")
@@ -52,15 +246,8 @@ def get_guest_from_invite(token: str, db: Session) -> Guest:
         if guest:
             return guest
 
-    pseudo_id = -invite.id
-    guest = db.query(Guest).filter(Guest.telegram_user_id == pseudo_id).one_or_none()
-    if not guest:
-        guest = Guest(telegram_user_id=pseudo_id, family_group_id=invite.family_group_id)
-        db.add(guest)
-        db.flush()
-        db.add(Profile(guest_id=guest.id))
-    invite.used_by_guest_id = guest.id
+    guest_id = upsert_guest(db, -invite.id, family_group_id=invite.family_group_id)
+    invite.used_by_guest_id = guest_id
     db.add(invite)
     db.commit()
-    db.refresh(guest)
-    return guest
+    return db.get(Guest, guest_id)
@@ -0,0 +1,87 @@
+"""
+@username → Telegram user id via Bot API getChat, cached in telegram_username_cache.
+
+Hits are trusted for USERNAME_CACHE_TTL_SECONDS; "not found" answers are cached for
+the shorter USERNAME_NEGATIVE_TTL_SECONDS. Network errors are not cached.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..db import dialect_insert
+from ..models import TelegramUsernameCache
+from .http_client import get_http_client
+from .notifier import bot_api_url
+
+logger = logging.getLogger(__name__)
+
+_MISS = (None, None)
+
+async def _get_chat(username: str) -> tuple[str | None, int | None] | None:
+    """
+    (username, id) from getChat, (None, None) when Telegram does not know the
+    username, None when the call itself failed.
+    """
+    url = bot_api_url("getChat")
+    try:
+        resp = await get_http_client().get(url, params={"chat_id": f"@{username}"})
+        data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+    except Exception as e:
+        logger.warning("resolve username failed: %s", str(e))
+        return None
+    if resp.status_code >= 500 or resp.status_code == 429:
+        logger.warning("resolve username failed: status=%s", resp.status_code)
+        return None
+    if not data.get("ok"):
+        return _MISS
+    result = data.get("result") or {}
+    return result.get("username") or username, result.get("id")
+
+def _fresh(row: TelegramUsernameCache, now: datetime) -> bool:
+    ttl = settings.USERNAME_CACHE_TTL_SECONDS if row.telegram_user_id else settings.USERNAME_NEGATIVE_TTL_SECONDS
+    return row.resolved_at + timedelta(seconds=ttl) > now
+
+async def resolve_usernames(db: AsyncSession, usernames) -> dict[str, tuple[str | None, int | None]]:
+    """
+    Resolves normalized (lowercase, no "@") usernames: one cache query, then one
+    concurrent getChat per stale or unknown name. New answers are written to the
+    cache in the caller's transaction.
+    """
+    names = sorted({u for u in usernames if u})
+    if not names or not settings.BOT_TOKEN:
+        return {u: _MISS for u in names}
+    now = datetime.utcnow()
+    cached = {
+        row.username: row
+        for row in (await db.scalars(
+            select(TelegramUsernameCache).where(TelegramUsernameCache.username.in_(names))
+        )).all()
+    }
+    out = {}
+    stale = []
+    for name in names:
+        row = cached.get(name)
+        if row and _fresh(row, now):
+            out[name] = (row.resolved_username, row.telegram_user_id)
+        else:
+            stale.append(name)
+    answers = await asyncio.gather(*(_get_chat(name) for name in stale))
+    insert = dialect_insert(db)
+    for name, answer in zip(stale, answers):
+        if answer is None:
+            row = cached.get(name)
+            # keep serving an expired hit rather than nothing while Telegram is unreachable
+            out[name] = (row.resolved_username, row.telegram_user_id) if row else _MISS
+            continue
+        out[name] = answer
+        values = {"resolved_username": answer[0], "telegram_user_id": answer[1], "resolved_at": now}
+        await db.execute(
+            insert(TelegramUsernameCache)
+            .values(username=name, **values)
+            .on_conflict_do_update(index_elements=["username"], set_=values)
+        )
+    return out
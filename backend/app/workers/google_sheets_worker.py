@@ -2,47 +2,50 @@ import time
 import logging
 import os
 import sqlite3
-from datetime import datetime
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, joinedload
 
-from ..db import SessionLocal
-from ..models import SheetSyncJob, Guest, Profile, FamilyProfile
-from ..services.google_sheets import _get_service, ensure_formatting, upsert_row, to_row, delete_row_by_telegram_id, clear_sheet_data
+from ..config import settings
+from ..db import SessionLocal, dialect_insert
+from ..models import SheetSyncJob, Guest, Profile, FamilyProfile, AppSettings
+from ..services.sheets_queue import due_jobs
+from ..services.google_sheets import (
+    _get_service, ensure_formatting_once, upsert_rows, to_row, delete_rows_by_telegram_id, clear_sheet_data,
+    write_all_rows, row_index,
+)
 
 logger = logging.getLogger(__name__)
 
 POLL_SECONDS = 5
 MAX_ATTEMPTS = 5
+# guests per round trip when sync_all streams the guest table
+GUEST_BATCH = 200
+# app_settings row bumped whenever a batch moved sheet rows; workers whose row
+# index was built against an older value rebuild it
+LAYOUT_VERSION_KEY = "sheets_layout_version"
 BACKUP_EVERY_SECONDS = 24 * 60 * 60
 BACKUP_KEEP = 14
 BACKUP_DIR = "/app/backups"
 DB_PATH = "/app/data/app.db"
 
 def _children_string(fp: FamilyProfile | None) -> str:
-    if not fp or not fp.children_json:
-        return ""
-    try:
-        import json as _json
-        items = _json.loads(fp.children_json)
-        out = []
-        for ch in items:
-            name = (ch.get("name") or "").strip()
-            age = (ch.get("age") or "").strip()
-            if name and age:
-                out.append(f"{name} ({age})")
-            elif name:
-                out.append(name)
-        return ", ".join(out)
-    except Exception:
+    if not fp:
         return ""
+    out = []
+    for ch in fp.children:
+        name = (ch.name or "").strip()
+        age = (ch.age or "").strip()
+        if name and age:
+            out.append(f"{name} ({age})")
+        elif name:
+            out.append(name)
+    return ", ".join(out)
 
-def _load_guest(db: Session, telegram_id: int) -> dict | None:
-    g = db.query(Guest).filter(Guest.telegram_user_id == telegram_id).one_or_none()
-    if not g:
-        return None
+def _guest_data(g: Guest) -> dict:
     p = g.profile
-    fp = db.query(FamilyProfile).filter(FamilyProfile.guest_id == g.id).one_or_none()
-    alcohol = (p.alcohol_prefs_csv or "").strip()
+    fp = g.family_profile
+    alcohol = ",".join(p.alcohol_prefs)
     return {
         "telegram_id": g.telegram_user_id,
         "tg_username": g.username or "",
@@ -63,28 +66,103 @@ def _load_guest(db: Session, telegram_id: int) -> dict | None:
         "created_at": g.created_at.isoformat() if g.created_at else "",
     }
 
-def _process_job(db: Session, job: SheetSyncJob) -> None:
+def _guests_query():
+    # profile and family profile joined in; alcohol and children come by selectin per batch
+    return select(Guest).options(joinedload(Guest.profile), joinedload(Guest.family_profile))
+
+def _guest_rows(db: Session, telegram_ids) -> list[list[str]]:
+    guests = db.scalars(_guests_query().where(Guest.telegram_user_id.in_(telegram_ids)).order_by(Guest.id)).unique()
+    return [to_row(_guest_data(g)) for g in guests if g.profile]
+
+def _all_guest_rows(db: Session) -> list[list[str]]:
+    guests = db.scalars(_guests_query().order_by(Guest.id).execution_options(yield_per=GUEST_BATCH))
+    return [to_row(_guest_data(g)) for g in guests if g.profile]
+
+def _claim(db: Session, now: datetime) -> list[SheetSyncJob]:
+    """
+    Takes up to SHEETS_BATCH_SIZE due jobs in one UPDATE ... RETURNING. Nothing is
+    taken while another worker holds a live batch: row numbers shift under
+    concurrent writers, so batches run one at a time across workers.
+    """
+    busy = (
+        select(SheetSyncJob.id)
+        .where(SheetSyncJob.status == "processing", SheetSyncJob.not_before > now)
+        .exists()
+    )
+    jobs = db.scalars(
+        update(SheetSyncJob)
+        .where(SheetSyncJob.id.in_(due_jobs(now, settings.SHEETS_BATCH_SIZE).scalar_subquery()), ~busy)
+        .values(status="processing", not_before=now + timedelta(seconds=settings.SHEETS_JOB_LEASE_SECONDS), updated_at=now)
+        .returning(SheetSyncJob)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(jobs, key=lambda job: (job.created_at, job.id))
+
+def _plan(jobs: list[SheetSyncJob]) -> tuple[bool, bool, dict[int, str]]:
+    """
+    Reduces a batch (oldest first) to (rewrite everything, clear first, last job
+    type per telegram_id). A sync_all rereads the whole table, so it covers the rest
+    of the batch, clear_all included; a clear_all drops the guest jobs before it.
+    """
+    full, clear, guests = False, False, {}
+    for job in jobs:
+        if job.type == "sync_all":
+            full = True
+        elif job.type == "clear_all":
+            clear = True
+            guests.clear()
+        elif job.telegram_id:
+            guests[job.telegram_id] = job.type
+    return full, clear, guests
+
+def _process_batch(db: Session, jobs: list[SheetSyncJob]) -> None:
     service = _get_service()
-    ensure_formatting(service)
-    if job.type == "sync_all":
-        guests = db.query(Guest).all()
-        for g in guests:
-            data = _load_guest(db, g.telegram_user_id)
-            if data:
-                upsert_row(service, to_row(data))
+    ensure_formatting_once(service)
+    full, clear, guests = _plan(jobs)
+    if full:
+        write_all_rows(service, _all_guest_rows(db))
         return
-    if job.type == "clear_all":
+    if clear:
+        # only A2:Q is cleared; the header row and its formatting stay
         clear_sheet_data(service)
-        ensure_formatting(service)
-        return
-    if job.type == "delete_guest":
-        if job.telegram_id:
-            delete_row_by_telegram_id(service, job.telegram_id)
-        return
-    if job.telegram_id:
-        data = _load_guest(db, job.telegram_id)
-        if data:
-            upsert_row(service, to_row(data))
+    deletes = [t for t, job_type in guests.items() if job_type == "delete_guest"]
+    if deletes:
+        delete_rows_by_telegram_id(service, deletes)
+    syncs = [t for t, job_type in guests.items() if job_type == "sync_guest"]
+    if syncs:
+        upsert_rows(service, _guest_rows(db, syncs))
+
+_layout_version: str | None = None
+
+def _check_layout_version(db: Session) -> None:
+    global _layout_version
+    current = db.scalar(select(AppSettings.value).where(AppSettings.key == LAYOUT_VERSION_KEY))
+    if current != _layout_version:
+        # another worker appended or deleted rows since our index was built
+        row_index.invalidate()
+        _layout_version = current
+
+def _bump_layout_version(db: Session) -> None:
+    global _layout_version
+    current = db.scalar(select(AppSettings.value).where(AppSettings.key == LAYOUT_VERSION_KEY))
+    _layout_version = str(int(current or 0) + 1)
+    db.execute(
+        dialect_insert(db)(AppSettings)
+        .values(key=LAYOUT_VERSION_KEY, value=_layout_version, updated_at=datetime.utcnow())
+        .on_conflict_do_update(index_elements=["key"], set_={"value": _layout_version, "updated_at": datetime.utcnow()})
+    )
+    row_index.layout_changed = False
+
+def _retry_status(db: Session, job: SheetSyncJob) -> str:
+    if job.attempts >= MAX_ATTEMPTS:
+        return "failed"
+    # a newer pending job for the same target redoes this work (and owns the dedupe key)
+    if job.dedupe_key and db.scalar(
+        select(SheetSyncJob.id).where(SheetSyncJob.status == "pending", SheetSyncJob.dedupe_key == job.dedupe_key)
+    ):
+        return "superseded"
+    return "pending"
 
 def _maybe_backup(last_backup_ts: float | None) -> float | None:
     now = time.time()
@@ -94,7 +172,7 @@ def _maybe_backup(last_backup_ts: float | None) -> float | None:
     ts = time.strftime("%Y-%m-%d_%H%M", time.gmtime(now))
     dest = os.path.join(BACKUP_DIR, f"app_{ts}.db")
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_PATH, timeout=settings.SQLITE_BUSY_TIMEOUT_MS / 1000)
         conn.execute(f"VACUUM INTO '{dest}'")
         conn.close()
         logger.info("db backup created: %s", dest)
@@ -113,6 +191,47 @@ def _maybe_backup(last_backup_ts: float | None) -> float | None:
         pass
     return now
 
+def _retry_batch(db: Session, jobs: list[SheetSyncJob]) -> None:
+    now = datetime.utcnow()
+    for job in jobs:
+        job.attempts = (job.attempts or 0) + 1
+        job.status = _retry_status(db, job)
+        job.not_before = now + timedelta(seconds=min(30, POLL_SECONDS * (job.attempts + 1)))
+        job.updated_at = now
+        db.add(job)
+        # the next job's _retry_status must see this one's status
+        db.flush()
+
+def _work_batch(db: Session) -> int:
+    """
+    Claims, applies and settles one batch; returns how many jobs it held.
+    """
+    jobs = _claim(db, datetime.utcnow())
+    if not jobs:
+        return 0
+    _check_layout_version(db)
+    try:
+        _process_batch(db, jobs)
+    except Exception as e:
+        db.rollback()
+        # rows may have moved before the failure; make every index rebuild
+        row_index.invalidate()
+        _bump_layout_version(db)
+        _retry_batch(db, jobs)
+        db.commit()
+        logger.warning("sheets batch failed (ids=%s): %s", [job.id for job in jobs], str(e))
+        return len(jobs)
+    if row_index.layout_changed:
+        _bump_layout_version(db)
+    db.execute(
+        update(SheetSyncJob)
+        .where(SheetSyncJob.id.in_([job.id for job in jobs]))
+        .values(status="done", updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return len(jobs)
+
 def main():
     logger.info("Google Sheets worker started")
     last_backup = None
@@ -120,36 +239,11 @@ def main():
         last_backup = _maybe_backup(last_backup)
         db = SessionLocal()
         try:
-            job = (
-                db.query(SheetSyncJob)
-                .filter(SheetSyncJob.status == "pending")
-                .order_by(SheetSyncJob.created_at.asc())
-                .first()
-            )
-            if not job:
-                db.close()
-                time.sleep(POLL_SECONDS)
-                continue
-            job.status = "processing"
-            job.updated_at = datetime.utcnow()
-            db.add(job)
-            db.commit()
-            try:
-                _process_job(db, job)
-                job.status = "done"
-                job.updated_at = datetime.utcnow()
-                db.add(job)
-                db.commit()
-            except Exception as e:
-                job.attempts = (job.attempts or 0) + 1
-                job.status = "pending" if job.attempts < MAX_ATTEMPTS else "failed"
-                job.updated_at = datetime.utcnow()
-                db.add(job)
-                db.commit()
-                logger.warning("sheets job failed (id=%s, attempts=%s): %s", job.id, job.attempts, str(e))
-                time.sleep(min(30, POLL_SECONDS * (job.attempts + 1)))
+            claimed = _work_batch(db)
         finally:
             db.close()
+        if not claimed:
+            time.sleep(POLL_SECONDS)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,45 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+# settings and engines are built at import time, so the environment comes first
+_tmp = tempfile.mkdtemp(prefix="wedding-tests-")
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/app.db")
+os.environ.setdefault("ADMIN_IDS", "42")
+os.environ.setdefault("OUTBOX_DISPATCHER_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+def baseline_db(path) -> None:
+    """
+    A database as the first release left it, with legacy CSV/JSON columns filled in.
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript((FIXTURES / "baseline_schema.sql").read_text())
+    conn.executescript(
+        "INSERT INTO guests (id, telegram_user_id, username, created_at, updated_at) "
+        "VALUES (1, 100, 'Alice', '2025-01-01', '2025-01-01');"
+        "INSERT INTO profiles (id, guest_id, rsvp_status, is_relative, is_best_friend, has_plus_one_requested, "
+        "alcohol_prefs_csv, photos_csv) VALUES (1, 1, 'yes', 0, 0, 0, 'Вино, Не пью', 'f1,f2');"
+        # browser-mode guest of a deleted invite 7; invite 3 is still there
+        "INSERT INTO guests (id, telegram_user_id, created_at, updated_at) VALUES (2, -7, '2025-01-01', '2025-01-01');"
+        "INSERT INTO family_groups (id, created_at) VALUES (1, '2025-01-01');"
+        "INSERT INTO invite_tokens (id, token, family_group_id, inviter_guest_id, status, created_at) "
+        "VALUES (3, 'tok', 1, 1, 'pending', '2025-01-01');"
+        "INSERT INTO sheet_sync_jobs (type, telegram_id, status, attempts, created_at, updated_at) VALUES "
+        "('sync_guest', 100, 'pending', 0, '2025-01-01', '2025-01-01'), "
+        "('sync_guest', 100, 'pending', 0, '2025-01-02', '2025-01-02');"
+    )
+    conn.execute(
+        "INSERT INTO family_profiles (id, guest_id, with_partner, children_json, updated_at) "
+        "VALUES (1, 1, 0, ?, '2025-01-01')",
+        (json.dumps([{"id": 1700000000000, "name": "Kid", "age": 3}]),),
+    )
+    conn.commit()
+    conn.close()
@@ -0,0 +1,108 @@
+"""
+In-memory stand-in for the googleapiclient Sheets service: one sheet, A1-notation
+ranges, and a record of the calls made.
+"""
+import re
+
+class _Request:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self):
+        return self._run()
+
+class FakeSheets:
+    def __init__(self, rows: list[list[str]] | None = None, header: list[str] | None = None):
+        self.grid: list[list[str]] = [list(header or ["telegram_id"])] + [list(r) for r in rows or []]
+        self.calls: list[str] = []
+        self._in_values = False
+
+    # service.spreadsheets() and .values() share this object; values() flips the namespace
+    def spreadsheets(self):
+        self._in_values = False
+        return self
+
+    def values(self):
+        self._in_values = True
+        return self
+
+    @staticmethod
+    def _span(rng: str) -> tuple[int, int | None, bool]:
+        # "Guest TG!A2:Q" → (2, None, False); "Guest TG!A5" → (5, 5, True)
+        m = re.match(r".*!([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$", rng)
+        start = int(m.group(2) or 1)
+        if m.group(3) is None:
+            return start, start if m.group(2) else None, True
+        return start, int(m.group(4)) if m.group(4) else None, m.group(1) == m.group(3)
+
+    def _read(self, rng: str) -> dict:
+        start, end, single_column = self._span(rng)
+        rows = self.grid[start - 1:end]
+        values = [r[:1] if single_column else list(r) for r in rows]
+        while values and not values[-1]:
+            values.pop()
+        return {"values": values} if values else {}
+
+    def _put(self, row_idx: int, values: list[str]) -> None:
+        while len(self.grid) < row_idx:
+            self.grid.append([])
+        self.grid[row_idx - 1] = list(values)
+
+    def get(self, spreadsheetId, range=None, **kw):
+        if not self._in_values:
+            self.calls.append("spreadsheets.get")
+            return _Request(lambda: {"sheets": [
+                {"properties": {"title": "Guest TG", "sheetId": 0}, "bandedRanges": [{}]},
+            ]})
+        self.calls.append("values.get")
+        return _Request(lambda: self._read(range))
+
+    def batchGet(self, spreadsheetId, ranges, **kw):
+        self.calls.append("values.batchGet")
+        return _Request(lambda: {"valueRanges": [self._read(r) for r in ranges]})
+
+    def update(self, spreadsheetId, range, body, **kw):
+        self.calls.append("values.update")
+        def run():
+            start = self._span(range)[0]
+            for i, values in enumerate(body["values"]):
+                self._put(start + i, values)
+            return {}
+        return _Request(run)
+
+    def append(self, spreadsheetId, range, body, **kw):
+        self.calls.append("values.append")
+        def run():
+            while len(self.grid) > 1 and not self.grid[-1]:
+                self.grid.pop()
+            start = len(self.grid) + 1
+            self.grid.extend(list(v) for v in body["values"])
+            return {"updates": {"updatedRange": f"'Guest TG'!A{start}:Q{start + len(body['values']) - 1}"}}
+        return _Request(run)
+
+    def clear(self, spreadsheetId, range, body):
+        self.calls.append("values.clear")
+        def run():
+            del self.grid[self._span(range)[0] - 1:]
+            return {}
+        return _Request(run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        if self._in_values:
+            self.calls.append("values.batchUpdate")
+            def write():
+                for data in body["data"]:
+                    self._put(self._span(data["range"])[0], data["values"][0])
+                return {}
+            return _Request(write)
+        self.calls.append("spreadsheets.batchUpdate")
+        def run():
+            for request in body["requests"]:
+                if "deleteDimension" in request:
+                    rng = request["deleteDimension"]["range"]
+                    del self.grid[rng["startIndex"]:rng["endIndex"]]
+            return {}
+        return _Request(run)
+
+    def ids(self) -> list[str]:
+        return [r[0] if r else "" for r in self.grid[1:]]
@@ -0,0 +1,151 @@
+-- schema of a database created by the first release (before schema_version)
+CREATE TABLE event_info (
+	id INTEGER NOT NULL,
+	content TEXT NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY (id)
+);
+CREATE TABLE event_content (
+	"key" VARCHAR(64) NOT NULL,
+	value_text TEXT NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY ("key")
+);
+CREATE TABLE event_timing (
+	"group" INTEGER NOT NULL,
+	value_json TEXT NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY ("group")
+);
+CREATE TABLE family_groups (
+	id INTEGER NOT NULL,
+	created_at DATETIME NOT NULL,
+	PRIMARY KEY (id)
+);
+CREATE TABLE groups (
+	id INTEGER NOT NULL,
+	name VARCHAR(128) NOT NULL,
+	PRIMARY KEY (id),
+	UNIQUE (name)
+);
+CREATE TABLE change_log (
+	id INTEGER NOT NULL,
+	guest_id INTEGER NOT NULL,
+	field VARCHAR(128) NOT NULL,
+	old_value TEXT,
+	new_value TEXT,
+	created_at DATETIME NOT NULL,
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_change_log_guest_id ON change_log (guest_id);
+CREATE TABLE admin_settings (
+	admin_id INTEGER NOT NULL,
+	system_notifications_enabled BOOLEAN NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY (admin_id)
+);
+CREATE TABLE app_settings (
+	"key" VARCHAR(64) NOT NULL,
+	value VARCHAR(32) NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY ("key")
+);
+CREATE TABLE sheet_sync_jobs (
+	id INTEGER NOT NULL,
+	type VARCHAR(32) NOT NULL,
+	telegram_id INTEGER,
+	status VARCHAR(16) NOT NULL,
+	attempts INTEGER NOT NULL,
+	payload TEXT,
+	created_at DATETIME NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY (id)
+);
+CREATE INDEX ix_sheet_sync_jobs_telegram_id ON sheet_sync_jobs (telegram_id);
+CREATE TABLE guests (
+	id INTEGER NOT NULL,
+	telegram_user_id INTEGER NOT NULL,
+	username VARCHAR(64),
+	first_name VARCHAR(128),
+	last_name VARCHAR(128),
+	phone VARCHAR(32),
+	family_group_id INTEGER,
+	created_at DATETIME NOT NULL,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY (id),
+	FOREIGN KEY(family_group_id) REFERENCES family_groups (id)
+);
+CREATE UNIQUE INDEX ix_guests_telegram_user_id ON guests (telegram_user_id);
+CREATE TABLE profiles (
+	id INTEGER NOT NULL,
+	guest_id INTEGER NOT NULL,
+	rsvp_status VARCHAR(16) NOT NULL,
+	full_name VARCHAR(256),
+	birth_date DATE,
+	gender VARCHAR(16),
+	side VARCHAR(16),
+	is_relative BOOLEAN NOT NULL,
+	is_best_friend BOOLEAN NOT NULL,
+	has_plus_one_requested BOOLEAN NOT NULL,
+	plus_one_partner_username VARCHAR(64),
+	plus_one_invite_sent_at DATETIME,
+	food_pref VARCHAR(16),
+	food_allergies TEXT,
+	alcohol_prefs_csv TEXT,
+	extra_known_since VARCHAR(32),
+	extra_memory TEXT,
+	extra_fact TEXT,
+	photos_csv TEXT,
+	welcome_seen_at DATETIME,
+	partner_guest_id INTEGER,
+	partner_pending_full_name VARCHAR(256),
+	partner_pending_birth_date DATE,
+	PRIMARY KEY (id),
+	UNIQUE (guest_id),
+	FOREIGN KEY(guest_id) REFERENCES guests (id),
+	FOREIGN KEY(partner_guest_id) REFERENCES guests (id)
+);
+CREATE INDEX ix_profiles_guest_id ON profiles (guest_id);
+CREATE TABLE invite_tokens (
+	id INTEGER NOT NULL,
+	token VARCHAR(64) NOT NULL,
+	family_group_id INTEGER NOT NULL,
+	inviter_guest_id INTEGER NOT NULL,
+	used_by_guest_id INTEGER,
+	invitee_telegram_user_id INTEGER,
+	status VARCHAR(16) NOT NULL,
+	accepted_at DATETIME,
+	declined_at DATETIME,
+	expires_at DATETIME,
+	created_at DATETIME NOT NULL,
+	PRIMARY KEY (id),
+	FOREIGN KEY(family_group_id) REFERENCES family_groups (id),
+	FOREIGN KEY(inviter_guest_id) REFERENCES guests (id),
+	FOREIGN KEY(used_by_guest_id) REFERENCES guests (id)
+);
+CREATE INDEX ix_invite_tokens_family_group_id ON invite_tokens (family_group_id);
+CREATE UNIQUE INDEX ix_invite_tokens_token ON invite_tokens (token);
+CREATE INDEX ix_invite_tokens_inviter_guest_id ON invite_tokens (inviter_guest_id);
+CREATE INDEX ix_invite_tokens_invitee_telegram_user_id ON invite_tokens (invitee_telegram_user_id);
+CREATE TABLE family_profiles (
+	id INTEGER NOT NULL,
+	guest_id INTEGER NOT NULL,
+	with_partner BOOLEAN NOT NULL,
+	partner_name VARCHAR(256),
+	children_json TEXT,
+	updated_at DATETIME NOT NULL,
+	PRIMARY KEY (id),
+	UNIQUE (guest_id),
+	FOREIGN KEY(guest_id) REFERENCES guests (id)
+);
+CREATE INDEX ix_family_profiles_guest_id ON family_profiles (guest_id);
+CREATE TABLE group_members (
+	id INTEGER NOT NULL,
+	group_id INTEGER NOT NULL,
+	guest_id INTEGER NOT NULL,
+	PRIMARY KEY (id),
+	FOREIGN KEY(group_id) REFERENCES groups (id),
+	FOREIGN KEY(guest_id) REFERENCES guests (id)
+);
+CREATE INDEX ix_group_members_group_id ON group_members (group_id);
+CREATE INDEX ix_group_members_guest_id ON group_members (guest_id);
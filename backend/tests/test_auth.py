@@ -0,0 +1,56 @@
+import hashlib
+import hmac
+import json
+import time
+import urllib.parse
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select, text
+
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.main import app
+from app.migrations import run_migrations
+from app.models import Guest
+
+def _init_data(user_id: int) -> str:
+    data = {
+        "auth_date": str(int(time.time())),
+        "query_id": "q",
+        "user": json.dumps({"id": user_id, "first_name": "Ann", "username": "ann"}),
+    }
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
+    secret = hmac.new(b"WebAppData", settings.BOT_TOKEN.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urllib.parse.urlencode(data)
+
+@pytest.fixture
+def client():
+    run_migrations(engine)
+    with TestClient(app) as client:
+        yield client
+    with engine.begin() as conn:
+        for table in ("change_log", "sheet_sync_jobs", "profiles", "guests"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+def _delete_guest(telegram_user_id: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM profiles WHERE guest_id IN (SELECT id FROM guests WHERE telegram_user_id = :t)"
+        ), {"t": telegram_user_id})
+        conn.execute(text("DELETE FROM guests WHERE telegram_user_id = :t"), {"t": telegram_user_id})
+
+def test_session_token_of_deleted_guest_falls_back_to_init_data(client):
+    init_data = _init_data(800)
+    token = client.post("/api/auth/telegram", json={"initData": init_data}).json()["session_token"]
+    _delete_guest(800)
+
+    assert client.get("/api/profile", headers={"x-session-token": token}).status_code == 401
+    headers = {"x-session-token": token, "x-tg-initdata": init_data}
+    # sync and async routes both re-create the guest from initData
+    assert client.get("/api/profile", headers=headers).status_code == 200
+    _delete_guest(800)
+    assert client.post("/api/extra", headers=headers, json={"extra_fact": "hi"}).status_code == 200
+    with SessionLocal() as db:
+        assert db.scalars(select(Guest.first_name).where(Guest.telegram_user_id == 800)).all() == ["Ann"]
@@ -0,0 +1,53 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import get_async_db, get_db
+from app.main import app
+from app.migrations import run_migrations
+from app.services.telegram_auth import issue_session_token
+from conftest import baseline_db
+
+@pytest.fixture
+def legacy_client(tmp_path):
+    # guest 1 (telegram 100) has a child saved as JSON by the first release
+    path = tmp_path / "legacy.db"
+    baseline_db(path)
+    engine = create_engine(f"sqlite:///{path}")
+    run_migrations(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    sync_sessions = sessionmaker(bind=engine, expire_on_commit=False)
+    async_sessions = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    def db():
+        with sync_sessions() as session:
+            yield session
+
+    async def async_db():
+        async with async_sessions() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = db
+    app.dependency_overrides[get_async_db] = async_db
+    token, _ = issue_session_token(1, 100)
+    with TestClient(app, headers={"x-session-token": token}) as client:
+        yield client
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+def test_migrated_child_round_trips_with_string_id_and_age(legacy_client):
+    legacy = legacy_client.get("/api/family/me").json()["children"]
+    assert [(c["id"], c["name"], c["age"]) for c in legacy] == [("1700000000000", "Kid", "3")]
+
+    # an older client posting numbers gets back what a later GET returns
+    children = legacy + [{"id": 1700000000001, "name": "Baby", "age": 1, "note": ""}]
+    saved = legacy_client.post("/api/family/save", json={"with_partner": False, "children": children})
+    assert saved.status_code == 200
+    assert saved.json() == legacy_client.get("/api/family/me").json()
+    assert [(c["id"], c["age"]) for c in saved.json()["children"]] == [("1700000000000", "3"), ("1700000000001", "1")]
+
+    # posting the GET response back unchanged is a no-op
+    again = legacy_client.post("/api/family/save", json=legacy_client.get("/api/family/me").json())
+    assert again.json() == saved.json()
@@ -0,0 +1,57 @@
+import pytest
+
+from app.services import google_sheets as gs
+from fake_sheets import FakeSheets
+
+def _row(telegram_id: int, name: str) -> list[str]:
+    return [str(telegram_id), "", name] + [""] * 14
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(gs, "row_index", gs.RowIndex())
+
+def test_upsert_appends_new_rows_and_updates_known_ones():
+    sheet = FakeSheets(header=gs.HEADERS)
+    gs.upsert_rows(sheet, [_row(1, "a"), _row(2, "b")])
+    gs.upsert_rows(sheet, [_row(2, "b2")])
+    assert [r[:3] for r in sheet.grid[1:]] == [["1", "", "a"], ["2", "", "b2"]]
+    assert sheet.calls.count("values.append") == 1
+
+def test_steady_state_upsert_is_one_write():
+    sheet = FakeSheets(header=gs.HEADERS)
+    gs.upsert_rows(sheet, [_row(1, "a"), _row(2, "b")])
+    sheet.calls.clear()
+    gs.upsert_rows(sheet, [_row(1, "a2"), _row(2, "b2")])
+    assert sheet.calls == ["values.batchUpdate"]
+
+def test_upsert_after_manual_reorder_lands_right_once_the_index_expires(monkeypatch, caplog):
+    sheet = FakeSheets(header=gs.HEADERS)
+    gs.upsert_rows(sheet, [_row(1, "one"), _row(2, "two"), _row(3, "three")])
+    # someone sorts the sheet by hand
+    sheet.grid[1:] = [sheet.grid[3], sheet.grid[1], sheet.grid[2]]
+    monkeypatch.setattr(gs.settings, "SHEETS_ROW_INDEX_TTL_SECONDS", -1)
+    gs.upsert_rows(sheet, [_row(1, "one v2")])
+    by_id = {r[0]: r[2] for r in sheet.grid[1:]}
+    assert by_id == {"1": "one v2", "2": "two", "3": "three"}
+    assert gs.row_index.rows == {"3": 2, "1": 3, "2": 4}
+    assert "3 moved" in caplog.text
+
+def test_delete_shifts_the_rows_below():
+    sheet = FakeSheets([_row(1, "a"), _row(2, "b"), _row(3, "c")], header=gs.HEADERS)
+    assert gs.delete_rows_by_telegram_id(sheet, [1]) == 1
+    assert sheet.ids() == ["2", "3"]
+    gs.upsert_rows(sheet, [_row(3, "c2")])
+    assert sheet.grid[2][:3] == ["3", "", "c2"]
+
+def test_delete_after_manual_reorder_removes_the_right_row():
+    sheet = FakeSheets([_row(1, "a"), _row(2, "b"), _row(3, "c")], header=gs.HEADERS)
+    gs.row_index.ensure(sheet)
+    sheet.grid[1], sheet.grid[3] = sheet.grid[3], sheet.grid[1]
+    gs.delete_rows_by_telegram_id(sheet, [1])
+    assert sheet.ids() == ["3", "2"]
+
+def test_write_all_rows_replaces_the_data_rows():
+    sheet = FakeSheets([_row(9, "stale")] * 5, header=gs.HEADERS)
+    gs.write_all_rows(sheet, [_row(1, "a"), _row(2, "b")])
+    assert sheet.ids() == ["1", "2"]
+    assert gs.row_index.rows == {"1": 2, "2": 3}
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func, select, text
+
+from app.db import SessionLocal, engine
+from app.migrations import run_migrations
+from app.models import Guest, Profile
+from app.services.telegram_auth import get_or_create_guest, upsert_guest
+
+THREADS = 8
+
+@pytest.fixture
+def db():
+    run_migrations(engine)
+    with SessionLocal() as session:
+        yield session
+    with engine.begin() as conn:
+        for table in ("profiles", "guests"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+def _in_parallel(fn) -> list:
+    # each thread has its own session and connection; the barrier lines up their first query
+    barrier = threading.Barrier(THREADS)
+
+    def run(i):
+        with SessionLocal() as session:
+            barrier.wait()
+            return fn(session, i)
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        return list(pool.map(run, range(THREADS)))
+
+def _counts(db, telegram_user_id: int) -> tuple[int, int]:
+    guests = db.scalar(select(func.count()).select_from(Guest).where(Guest.telegram_user_id == telegram_user_id))
+    profiles = db.scalar(
+        select(func.count()).select_from(Profile).join(Guest, Guest.id == Profile.guest_id)
+        .where(Guest.telegram_user_id == telegram_user_id)
+    )
+    return guests, profiles
+
+def test_parallel_first_contact_creates_one_guest(db):
+    ids = _in_parallel(lambda session, i: get_or_create_guest(session, {"id": 900, "first_name": "Ann"}).id)
+    assert len(set(ids)) == 1
+    assert _counts(db, 900) == (1, 1)
+
+def test_parallel_upserts_converge_on_one_row(db):
+    def upsert(session, i):
+        guest_id = upsert_guest(session, 901, username=f"user{i}")
+        session.commit()
+        return guest_id
+
+    ids = _in_parallel(upsert)
+    assert len(set(ids)) == 1
+    assert _counts(db, 901) == (1, 1)
+    assert db.scalar(select(Guest.username).where(Guest.telegram_user_id == 901)) in {f"user{i}" for i in range(THREADS)}
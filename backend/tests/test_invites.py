@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app.db import SessionLocal, engine
+from app.migrations import run_migrations
+from app.models import FamilyGroup, Guest, InviteToken
+from app.services.telegram_auth import get_guest_from_invite, issue_invite_token, upsert_guest
+
+@pytest.fixture
+def db():
+    run_migrations(engine)
+    with SessionLocal() as session:
+        yield session
+    with engine.begin() as conn:
+        for table in ("invite_tokens", "profiles", "guests", "family_groups"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+def _invite(db, inviter_id: int) -> InviteToken:
+    group = FamilyGroup()
+    db.add(group)
+    db.flush()
+    expires_at = datetime.utcnow() + timedelta(days=7)
+    invite = InviteToken(token="x" * 10, family_group_id=group.id, inviter_guest_id=inviter_id, expires_at=expires_at)
+    db.add(invite)
+    db.flush()
+    invite.token = issue_invite_token(group.id, inviter_id, invite.id, expires_at)
+    db.commit()
+    return invite
+
+def test_signed_invite_binds_its_own_pseudo_guest(db):
+    inviter_id = upsert_guest(db, 500)
+    invite = _invite(db, inviter_id)
+    guest = get_guest_from_invite(invite.token, db)
+    assert guest.telegram_user_id == -invite.id
+    assert get_guest_from_invite(invite.token, db).id == guest.id
+
+def test_invite_ids_are_not_reused(db):
+    inviter_id = upsert_guest(db, 500)
+    first = _invite(db, inviter_id)
+    get_guest_from_invite(first.token, db)
+    db.delete(first)
+    db.commit()
+    assert _invite(db, inviter_id).id != first.id
+
+def test_old_link_does_not_bind_another_familys_pseudo_guest(db):
+    inviter_id = upsert_guest(db, 500)
+    old = _invite(db, inviter_id)
+    token, old_id = old.token, old.id
+    db.delete(old)
+    db.commit()
+    # another family's placeholder that happens to carry the same pseudo id
+    other = FamilyGroup()
+    db.add(other)
+    db.flush()
+    upsert_guest(db, -old_id, family_group_id=other.id)
+    db.commit()
+    with pytest.raises(ValueError):
+        get_guest_from_invite(token, db)
+    assert db.query(Guest).filter(Guest.telegram_user_id == -old_id).one().family_group_id == other.id
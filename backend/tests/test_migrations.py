@@ -0,0 +1,45 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app.db import Base
+from app.migrations import LATEST_VERSION, run_migrations
+from conftest import baseline_db
+
+def _index_names(engine) -> dict[str, set[str]]:
+    insp = inspect(engine)
+    return {t: {i["name"] for i in insp.get_indexes(t)} for t in insp.get_table_names() if t != "schema_version"}
+
+def test_baseline_database_upgrades_through_every_migration(tmp_path):
+    baseline_db(tmp_path / "legacy.db")
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() == LATEST_VERSION
+        assert conn.execute(text("SELECT value FROM profile_alcohol ORDER BY position")).scalars().all() == [
+            "Вино", "Не пью алкоголь",
+        ]
+        assert conn.execute(text("SELECT name, age FROM family_children")).one() == ("Kid", "3")
+        jobs = conn.execute(text("SELECT status, dedupe_key FROM sheet_sync_jobs ORDER BY id")).all()
+        assert jobs == [("superseded", None), ("pending", "sync_guest:100")]
+        assert conn.execute(text("SELECT token FROM invite_tokens WHERE id = 3")).scalar() == "tok"
+        assert conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'invite_tokens'")).scalar() == 7
+        assert "AUTOINCREMENT" in conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'invite_tokens'")
+        ).scalar()
+
+    # same tables, columns and indexes as a database created from the models
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    Base.metadata.create_all(fresh)
+    upgraded, expected = _index_names(engine), _index_names(fresh)
+    for table, names in expected.items():
+        assert names <= upgraded[table], table
+        columns = {c["name"] for c in inspect(engine).get_columns(table)}
+        assert {c["name"] for c in inspect(fresh).get_columns(table)} <= columns, table
+
+def test_migrations_are_idempotent(tmp_path):
+    baseline_db(tmp_path / "legacy.db")
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    run_migrations(engine)
+    run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_version")).scalar() == LATEST_VERSION
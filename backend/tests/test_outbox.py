@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from app.db import SessionLocal, engine
+from app.migrations import run_migrations
+from app.models import ChangeLog, Guest
+from app.services.outbox import _render_digests
+
+@pytest.fixture
+def db():
+    run_migrations(engine)
+    with SessionLocal() as session:
+        yield session
+    with engine.begin() as conn:
+        for table in ("change_log", "guests"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+def _digest(db, *entries: tuple[str, str, str]):
+    guest = Guest(telegram_user_id=700, first_name="Ann")
+    db.add(guest)
+    db.flush()
+    created_at = datetime.utcnow() - timedelta(seconds=1)
+    for field, old, new in entries:
+        db.add(ChangeLog(guest_id=guest.id, field=field, old_value=old, new_value=new, created_at=created_at))
+    db.commit()
+    row = SimpleNamespace(id=1, category="digest", text="", guest_id=guest.id, created_at=created_at)
+    return guest, asyncio.run(_render_digests([row], datetime.utcnow()))[1]
+
+def test_digest_header_names_the_form_that_changed(db):
+    guest, text = _digest(db, ("Пара", "Нет", "Да"), ("Дети (кол-во)", "0", "1"))
+    assert text == f"<b>Семья обновлена</b>\nAnn (id {guest.id})\n\nПара: Нет → Да\nДети (кол-во): 0 → 1"
+
+def test_digest_of_several_forms_names_each_of_them(db):
+    _, text = _digest(db, ("Фото", "—", "f1"), ("RSVP", "maybe", "yes"), ("RSVP", "yes", "no"))
+    header, _, _, *lines = text.split("\n")
+    assert header == "<b>Анкета обновлена, Доп. информация обновлена</b>"
+    assert lines == ["RSVP: maybe → no", "Фото: — → f1"]
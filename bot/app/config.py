@@ -9,3 +9,5 @@ if _api_base.endswith("/api"):
     _api_base = _api_base[:-4]
 API_BASE_URL = _api_base
 INTERNAL_SECRET = os.getenv("INTERNAL_SECRET", "change_me")
+# Bot API root; point at the backend's fake_bot_api for offline runs
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").strip().rstrip("/")
@@ -20,7 +20,17 @@ def admin_main_kb(system_enabled: bool = False, animations_enabled: bool = True)
     kb.row(KeyboardButton("Очистить базу"), KeyboardButton("Удалить гостя"), KeyboardButton("DB Health"))
     return kb
 
-def guests_inline_kb(page: int, rsvp: str | None, q: str | None, has_prev: bool, has_next: bool, items: list[dict] | None = None):
+def guests_inline_kb(
+    page: int,
+    rsvp: str | None,
+    q: str | None,
+    has_prev: bool,
+    has_next: bool,
+    items: list[dict] | None = None,
+    prev_cursor: str | None = None,
+    next_cursor: str | None = None,
+    total: int = 0,
+):
     kb = InlineKeyboardMarkup()
     kb.row(
         InlineKeyboardButton("Все", callback_data="guests:all"),
@@ -29,10 +39,17 @@ def guests_inline_kb(page: int, rsvp: str | None, q: str | None, has_prev: bool,
         InlineKeyboardButton("Не знаю", callback_data="guests:maybe"),
     )
     nav = []
-    if has_prev:
-        nav.append(InlineKeyboardButton("←", callback_data=f"guests_page:{page-1}:{rsvp or ''}:{q or ''}"))
-    if has_next:
-        nav.append(InlineKeyboardButton("→", callback_data=f"guests_page:{page+1}:{rsvp or ''}:{q or ''}"))
+    if prev_cursor or next_cursor:
+        # keyset paging: guests_cur:<page>:<total>:<cursor>:<rsvp>
+        if prev_cursor:
+            nav.append(InlineKeyboardButton("←", callback_data=f"guests_cur:{page-1}:{total}:{prev_cursor}:{rsvp or ''}"))
+        if next_cursor:
+            nav.append(InlineKeyboardButton("→", callback_data=f"guests_cur:{page+1}:{total}:{next_cursor}:{rsvp or ''}"))
+    else:
+        if has_prev:
+            nav.append(InlineKeyboardButton("←", callback_data=f"guests_page:{page-1}:{rsvp or ''}:{q or ''}"))
+        if has_next:
+            nav.append(InlineKeyboardButton("→", callback_data=f"guests_page:{page+1}:{rsvp or ''}:{q or ''}"))
     if nav:
         kb.row(*nav)
     return kb
@@ -4,12 +4,16 @@ from requests import RequestException
 from flask import Flask, request, jsonify
 
 import telebot
+from telebot import apihelper
 from telebot.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
 
-from .config import BOT_TOKEN, ADMIN_IDS, WEBAPP_URL, API_BASE_URL, INTERNAL_SECRET
+from .config import BOT_TOKEN, ADMIN_IDS, WEBAPP_URL, API_BASE_URL, INTERNAL_SECRET, TELEGRAM_API_BASE
 from .keyboards import admin_kb, admin_main_kb, guests_inline_kb
+from .outbound import OutboundQueue, PRIORITY_QUESTION, PRIORITY_SYSTEM
 
+apihelper.API_URL = TELEGRAM_API_BASE + "/bot{0}/{1}"
 bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+outbound = OutboundQueue(bot)
 app = Flask(__name__)
 BOT_USERNAME = None
 ADMIN_STATE = {}
@@ -94,12 +98,24 @@ def ensure_bot_username():
         BOT_USERNAME = ""
     return BOT_USERNAME
 
-def render_guests(chat_id: int, page: int = 1, rsvp: str | None = None, q: str | None = None):
+def render_guests(
+    chat_id: int,
+    page: int = 1,
+    rsvp: str | None = None,
+    q: str | None = None,
+    cursor: str | None = None,
+    total: int | None = None,
+):
+    # browsing pages by keyset cursor (total carried over from page 1); searches are ranked and page-numbered
     params = {"page": page, "page_size": 10}
     if rsvp:
         params["rsvp"] = rsvp
     if q:
         params["q"] = q
+        params["ranked"] = "true"
+    elif cursor:
+        params["cursor"] = cursor
+        params["include_total"] = "false" if total is not None else "true"
     res = api_get("/api/admin/guests", params=params)
     if not res.ok:
         detail = (res.text or "").strip()
@@ -110,8 +126,10 @@ def render_guests(chat_id: int, page: int = 1, rsvp: str | None = None, q: str |
         return
     data = res.json()
     items = data.get("items", [])
-    total = data.get("total", 0)
-    text_lines = [f"<b>Гости</b> (стр. {data.get('page')}, всего {total})"]
+    if data.get("total") is not None:
+        total = data.get("total")
+    total = total or 0
+    text_lines = [f"<b>Гости</b> (стр. {page}, всего {total})"]
     if total == 0:
         text_lines.append("В dev БД может быть пустой. В prod БД хранится в backend/data/app.db (bind-mount).")
     else:
@@ -165,9 +183,15 @@ def render_guests(chat_id: int, page: int = 1, rsvp: str | None = None, q: str |
             lines.append(row)
         table = "<pre>" + "\n".join(lines).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;") + "</pre>"
         text_lines.append(table)
-    has_prev = page > 1
-    has_next = page * data.get("page_size", 10) < total
-    kb = guests_inline_kb(page, rsvp, q, has_prev, has_next, items)
+    if q:
+        has_prev = page > 1
+        has_next = page * data.get("page_size", 10) < total
+        kb = guests_inline_kb(page, rsvp, q, has_prev, has_next, items)
+    else:
+        kb = guests_inline_kb(
+            page, rsvp, q, bool(data.get("prev_cursor")), bool(data.get("next_cursor")), items,
+            prev_cursor=data.get("prev_cursor"), next_cursor=data.get("next_cursor"), total=total,
+        )
     bot.send_message(chat_id, "\n".join(text_lines), reply_markup=kb)
     ADMIN_STATE[chat_id] = {"mode": "guests", "page": page, "rsvp": rsvp, "q": q}
 
@@ -255,10 +279,14 @@ def admin_db_health(m: Message):
     data = res.json()
     tables = ", ".join(data.get("tables", [])) or "—"
     counts = data.get("counts", {})
+    pragmas = data.get("pragmas", {})
+    full_scans = ", ".join(data.get("full_scans", [])) or "нет"
     text = (
         "<b>DB Health</b>\n"
         f"Path: {data.get('path')}\n"
         f"Exists: {data.get('exists')} | Size: {data.get('size_bytes')} bytes\n"
+        f"Journal: {pragmas.get('journal_mode', '—')} | FK: {pragmas.get('foreign_keys', '—')}\n"
+        f"Full scans: {full_scans}\n"
         f"Tables: {tables}\n"
         f"Guests: {counts.get('guests', 0)}, Profiles: {counts.get('profiles', 0)}, "
         f"Families: {counts.get('family_groups', 0)}, Invites: {counts.get('invite_tokens', 0)}"
@@ -353,6 +381,13 @@ def guests_page_cb(c):
     q = q or None
     render_guests(c.message.chat.id, page=int(page), rsvp=rsvp, q=q)
 
+@bot.callback_query_handler(func=lambda c: c.data.startswith("guests_cur:"))
+def guests_cursor_cb(c):
+    if not is_admin(c.from_user.id):
+        return
+    _, page, total, cursor, rsvp = c.data.split(":", 4)
+    render_guests(c.message.chat.id, page=int(page), rsvp=rsvp or None, cursor=cursor, total=int(total))
+
 @bot.callback_query_handler(func=lambda c: c.data.startswith("bf_set:") or c.data.startswith("bf_unset:"))
 def best_friend_set_unset_cb(c):
     if not is_admin(c.from_user.id):
@@ -534,12 +569,11 @@ def internal_notify():
     payload = data.get("payload", {})
 
     text = f"<b>Событие:</b> {event}\n<b>Данные:</b> <code>{payload}</code>"
+    priority = PRIORITY_QUESTION if event == "question" else PRIORITY_SYSTEM
+    # queued: paced against Telegram limits by the outbound worker thread
     for admin_id in ADMIN_IDS:
-        try:
-            bot.send_message(admin_id, text)
-        except Exception:
-            pass
-    return jsonify({"ok": True})
+        outbound.submit(admin_id, text, priority)
+    return jsonify({"ok": True, "queued": len(ADMIN_IDS)})
 
 def run_flask():
     app.run(host="0.0.0.0", port=8081)
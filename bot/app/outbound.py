@@ -0,0 +1,86 @@
+"""
+Paced sending for messages the bot pushes on its own (internal notify, broadcasts).
+
+Telegram allows about 30 messages/s per bot and 1 message/s per chat. One worker
+thread drains a priority queue under a global token bucket and a per-chat spacing,
+and holds a chat back for retry_after when Telegram answers 429.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_QUESTION = 0
+PRIORITY_USER = 1
+PRIORITY_SYSTEM = 2
+
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 5
+PER_CHAT_INTERVAL = 1.1
+MAX_ATTEMPTS = 5
+
+class OutboundQueue:
+    def __init__(self, bot, rate: float = GLOBAL_RATE, per_chat_interval: float = PER_CHAT_INTERVAL):
+        self.bot = bot
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(GLOBAL_BURST)
+        self._refilled_at = time.monotonic()
+        self._chat_ready: dict[int, float] = {}
+        # (priority, seq, chat_id, text, kwargs, attempts)
+        self._items: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_SYSTEM, **kwargs) -> None:
+        with self._cond:
+            heapq.heappush(self._items, (priority, next(self._seq), chat_id, text, kwargs, 0))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _next(self) -> tuple:
+        # called with the lock held; blocks until an item may be sent
+        while True:
+            now = time.monotonic()
+            self._tokens = min(GLOBAL_BURST, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            wait = None
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+            else:
+                for item in sorted(self._items):
+                    ready_at = self._chat_ready.get(item[2], 0.0)
+                    if ready_at <= now:
+                        self._items.remove(item)
+                        heapq.heapify(self._items)
+                        self._tokens -= 1
+                        self._chat_ready[item[2]] = now + self.per_chat_interval
+                        return item
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+            self._cond.wait(timeout=wait)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                priority, seq, chat_id, text, kwargs, attempts = self._next()
+            try:
+                self.bot.send_message(chat_id, text, **kwargs)
+            except ApiTelegramException as e:
+                retry_after = ((e.result_json or {}).get("parameters") or {}).get("retry_after")
+                if e.error_code == 429 and retry_after and attempts + 1 < MAX_ATTEMPTS:
+                    with self._cond:
+                        self._chat_ready[chat_id] = time.monotonic() + float(retry_after)
+                        # keeps its original place in the chat's queue
+                        heapq.heappush(self._items, (priority, seq, chat_id, text, kwargs, attempts + 1))
+                    continue
+                logger.warning("outbound: send to %s failed: %s", chat_id, e)
+            except Exception as e:
+                logger.warning("outbound: send to %s failed: %s", chat_id, e)
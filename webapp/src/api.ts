@@ -13,6 +13,9 @@ export function getInviteToken(): string {
   }
 }
 
+// Signed session token from /api/auth/telegram; lets the backend skip initData checks.
+let sessionToken = "";
+
 const rawBase = (import.meta as any).env?.VITE_API_URL || "/api";
 const API_BASE = rawBase.endsWith("/") ? rawBase.slice(0, -1) : rawBase;
 
@@ -47,7 +50,15 @@ async function parseError(res: Response): Promise<string> {
   }
 }
 
-async function req(path: string, method: string, body?: any) {
+export class ApiError extends Error {
+  status: number;
+  constructor(message: string, status: number) {
+    super(message);
+    this.status = status;
+  }
+}
+
+async function req(path: string, method: string, body?: any, extraHeaders?: Record<string, string>) {
   const initData = tgInitData();
   const inviteToken = initData ? "" : getInviteToken();
   const res = await fetch(buildUrl(path), {
@@ -55,11 +66,13 @@ async function req(path: string, method: string, body?: any) {
     headers: {
       "Content-Type": "application/json",
       "x-tg-initdata": initData,
-      ...(inviteToken ? { "x-invite-token": inviteToken } : {})
+      ...(inviteToken ? { "x-invite-token": inviteToken } : {}),
+      ...(sessionToken ? { "x-session-token": sessionToken } : {}),
+      ...(extraHeaders || {})
     },
     body: body ? JSON.stringify(body) : undefined
   });
-  if (!res.ok) throw new Error(await parseError(res));
+  if (!res.ok) throw new ApiError(await parseError(res), res.status);
   const contentType = res.headers.get("content-type") || "";
   if (contentType.includes("application/json")) {
     return res.json();
@@ -68,6 +81,46 @@ async function req(path: string, method: string, body?: any) {
   return text ? JSON.parse(text) : null;
 }
 
+function newIdempotencyKey(): string {
+  const c = (globalThis as any).crypto;
+  if (c?.randomUUID) return c.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
+const SAVE_ATTEMPTS = 3;
+// saves still waiting for an answer, by path + body: a double tap joins the first request
+const savesInFlight = new Map<string, Promise<any>>();
+
+function isRetryable(e: any): boolean {
+  // fetch rejects with a TypeError on network failure; 409 = same key still being processed
+  if (!(e instanceof ApiError)) return true;
+  return e.status === 409 || e.status >= 500;
+}
+
+// One Idempotency-Key per save action, reused by its retries, so the backend applies it once.
+async function save(path: string, body: any) {
+  const id = `${path} ${JSON.stringify(body)}`;
+  const pending = savesInFlight.get(id);
+  if (pending) return pending;
+  const key = newIdempotencyKey();
+  const run = (async () => {
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await req(path, "POST", body, { "Idempotency-Key": key });
+      } catch (e) {
+        if (attempt >= SAVE_ATTEMPTS || !isRetryable(e)) throw e;
+        await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+      }
+    }
+  })();
+  savesInFlight.set(id, run);
+  try {
+    return await run;
+  } finally {
+    savesInFlight.delete(id);
+  }
+}
+
 export const api = {
   auth: async (initData?: string) => {
     const resolvedInitData = initData || tgInitData();
@@ -83,17 +136,21 @@ export const api = {
     });
     if (!res.ok) throw new Error(await parseError(res));
     const contentType = res.headers.get("content-type") || "";
+    let data: any = null;
     if (contentType.includes("application/json")) {
-      return res.json();
+      data = await res.json();
+    } else {
+      const text = await res.text();
+      data = text ? JSON.parse(text) : null;
     }
-    const text = await res.text();
-    return text ? JSON.parse(text) : null;
+    sessionToken = data?.session_token || "";
+    return data;
   },
 
   getProfile: () => req("/api/profile", "GET"),
   profileExists: () => req("/api/profile/exists", "GET"),
-  saveProfile: (payload: any) => req("/api/profile", "POST", payload),
-  saveExtra: (payload: any) => req("/api/extra", "POST", payload),
+  saveProfile: (payload: any) => save("/api/profile", payload),
+  saveExtra: (payload: any) => save("/api/extra", payload),
   linkPartner: (payload: any) => req("/api/partner/link", "POST", payload),
   eventInfo: () => fetch(buildUrl("/api/event")).then(r=>r.json()),
   eventContent: () => req("/api/event-info/content", "GET"),
@@ -123,7 +180,7 @@ export type FamilyPayload = {
 };
 
 export async function saveFamily(data: FamilyPayload) {
-  return req("/api/family/save", "POST", {
+  return save("/api/family/save", {
     with_partner: data.withPartner,
     partner_name: data.partnerName || null,
     children: data.children || []